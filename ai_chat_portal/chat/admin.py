@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Conversation, Message, ConversationQuery
+from django.db.models import Count
+from .models import Conversation, Message, ConversationQuery, AnalysisJob, DailyStats
+from .search import search_conversations, search_messages
 
 
 @admin.register(Conversation)
@@ -13,38 +15,52 @@ class ConversationAdmin(admin.ModelAdmin):
         'created_at',
         'ended_at',
         'message_count_display',
+        'total_tokens',
+        'last_message_at',
         'sentiment'
     ]
-    list_filter = ['status', 'sentiment', 'created_at']
+    list_filter = ['status', 'analysis_status', 'sentiment', 'created_at']
     search_fields = ['title', 'summary', 'key_topics']
     readonly_fields = [
         'created_at',
         'ended_at',
+        'message_count',
+        'total_tokens',
+        'last_message_at',
         'summary',
         'key_topics',
         'action_items',
-        'sentiment',
-        'embedding'
+        'sentiment'
     ]
     date_hierarchy = 'created_at'
     
     fieldsets = (
         ('Basic Information', {
-            'fields': ('title', 'status', 'created_at', 'ended_at')
+            'fields': ('title', 'status', 'analysis_status', 'created_at', 'ended_at')
+        }),
+        ('Activity', {
+            'fields': ('message_count', 'total_tokens', 'last_message_at')
         }),
         ('AI Analysis', {
             'fields': ('summary', 'key_topics', 'action_items', 'sentiment'),
             'classes': ('collapse',)
         }),
-        ('Technical', {
-            'fields': ('embedding',),
-            'classes': ('collapse',)
-        }),
     )
     
+    def get_queryset(self, request):
+        # Embedding columns are large and never shown here
+        return super().get_queryset(request).defer('embedding', 'embedding_vector', 'search_vector')
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Indexed full-text search instead of ILIKE over every search field
+        if not search_term:
+            return queryset, False
+        return search_conversations(queryset, search_term, include_messages=False), False
+    
     def message_count_display(self, obj):
         return obj.get_message_count()
     message_count_display.short_description = 'Messages'
+    message_count_display.admin_order_field = 'message_count'
 
 
 @admin.register(Message)
@@ -64,6 +80,26 @@ class MessageAdmin(admin.ModelAdmin):
     readonly_fields = ['timestamp']
     date_hierarchy = 'timestamp'
     
+    def get_queryset(self, request):
+        # The conversation column renders each row's parent; join it instead
+        # of loading it per row, without its large columns
+        return (
+            super().get_queryset(request)
+            .select_related('conversation')
+            .defer(
+                'search_vector',
+                'conversation__embedding',
+                'conversation__embedding_vector',
+                'conversation__search_vector',
+                'conversation__context_summary',
+            )
+        )
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_messages(queryset, search_term), False
+    
     def content_preview(self, obj):
         return obj.content[:100] + '...' if len(obj.content) > 100 else obj.content
     content_preview.short_description = 'Content'
@@ -85,10 +121,61 @@ class ConversationQueryAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'execution_time']
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_relevant=Count('relevant_conversations'))
+    
     def query_preview(self, obj):
         return obj.query_text[:100] + '...' if len(obj.query_text) > 100 else obj.query_text
     query_preview.short_description = 'Query'
     
     def relevant_count(self, obj):
-        return obj.relevant_conversations.count()
-    relevant_count.short_description = 'Relevant Convs'
\ No newline at end of file
+        return obj.num_relevant
+    relevant_count.short_description = 'Relevant Convs'
+    relevant_count.admin_order_field = 'num_relevant'
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    """Admin interface for AnalysisJob model"""
+    
+    list_display = [
+        'id',
+        'conversation',
+        'status',
+        'attempts',
+        'created_at',
+        'finished_at',
+        'next_run_at'
+    ]
+    list_filter = ['status', 'created_at']
+    readonly_fields = [
+        'created_at',
+        'started_at',
+        'finished_at',
+        'lease_expires_at',
+        'stage_timings',
+        'last_error'
+    ]
+    list_select_related = ['conversation']
+    date_hierarchy = 'created_at'
+
+
+@admin.register(DailyStats)
+class DailyStatsAdmin(admin.ModelAdmin):
+    """Read-only view of the analytics rollups"""
+    
+    list_display = [
+        'date',
+        'conversations_started',
+        'conversations_ended',
+        'messages',
+        'tokens',
+        'queries'
+    ]
+    date_hierarchy = 'date'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -1,24 +1,133 @@
 import google.generativeai as genai
-from django.conf import settings
+from django.db import close_old_connections
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
+import threading
+
+from .gemini_client import get_model
+from .models import Conversation
+from .search import update_conversation_vectors
+from .bm25 import reindex_bm25_conversation
 
 logger = logging.getLogger(__name__)
 
-def generate_title_from_text(text):
+DEFAULT_TITLE = "New Conversation"
+
+# Deferred titles are generated here, after the response has been sent
+_title_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='title')
+# conversation id -> Future of the title being generated, so every message
+# after the fourth doesn't queue another model call for the same conversation
+_titles_in_flight = {}
+_titles_lock = threading.Lock()
+
+def generate_title_from_text(text, model=None):
     """
     Generate a short, descriptive title from conversation text.
-    
+
     Args:
         text (str): First few messages of conversation
-    
+        model: Optional model to use instead of the configured Gemini model
+
     Returns:
         str: Generated title (max 50 chars)
     """
     try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        model = genai.GenerativeModel(settings.GEMINI_MODEL)
-        
-        prompt = f"""Generate a short, descriptive title (max 6 words) for a conversation that starts with:
+        if model is None:
+            model = get_model()
+
+        response = model.generate_content(
+            _build_title_prompt(text),
+            generation_config=_title_generation_config()
+        )
+
+        return _clean_title(response.text)
+
+    except Exception as e:
+        logger.error(f"Error generating title: {str(e)}")
+        return DEFAULT_TITLE
+
+
+async def agenerate_title_from_text(text, model=None):
+    """
+    Async variant of generate_title_from_text.
+
+    Args:
+        text (str): First few messages of conversation
+        model: Optional model to use instead of the configured Gemini model
+    """
+    try:
+        if model is None:
+            model = get_model()
+
+        prompt = _build_title_prompt(text)
+        if hasattr(model, 'generate_content_async'):
+            response = await model.generate_content_async(
+                prompt, generation_config=_title_generation_config()
+            )
+        else:
+            response = await asyncio.to_thread(
+                model.generate_content, prompt, generation_config=_title_generation_config()
+            )
+
+        return _clean_title(response.text)
+
+    except Exception as e:
+        logger.error(f"Error generating title: {str(e)}")
+        return DEFAULT_TITLE
+
+
+def schedule_title_generation(conversation_id, text=None, model=None):
+    """
+    Generate a title in the background and store it on the conversation.
+
+    The title only replaces the default one, so a title set by the user in
+    the meantime is kept. Without `text` the first four messages are read
+    by the background thread. While a title is being generated for the
+    conversation, its future is returned instead of starting another one.
+
+    Returns:
+        Future: Resolves to the generated title
+    """
+    with _titles_lock:
+        future = _titles_in_flight.get(conversation_id)
+        if future is None:
+            future = _titles_in_flight[conversation_id] = _title_pool.submit(
+                _generate_and_save_title, conversation_id, text, model
+            )
+            future.add_done_callback(lambda _: _release_title(conversation_id, future))
+        return future
+
+
+def _release_title(conversation_id, future):
+    with _titles_lock:
+        if _titles_in_flight.get(conversation_id) is future:
+            del _titles_in_flight[conversation_id]
+
+
+def _generate_and_save_title(conversation_id, text, model):
+    try:
+        if text is None:
+            first_messages = Conversation.objects.get(pk=conversation_id).messages.order_by('timestamp')[:4]
+            text = " ".join(msg.content for msg in first_messages)
+        new_title = generate_title_from_text(text, model=model)
+        updated = Conversation.objects.filter(
+            pk=conversation_id,
+            title__in=[DEFAULT_TITLE, '']
+        ).update(title=new_title, **Conversation.changed())
+        if updated:
+            update_conversation_vectors([conversation_id])
+            reindex_bm25_conversation(conversation_id)
+        logger.info(f"Auto-generated title: {new_title}")
+        return new_title
+    except Exception as title_error:
+        logger.error(f"Failed to generate title: {str(title_error)}")
+    finally:
+        close_old_connections()
+
+
+def _build_title_prompt(text):
+    return f"""Generate a short, descriptive title (max 6 words) for a conversation that starts with:
 
 "{text[:500]}"
 
@@ -29,25 +138,22 @@ Rules:
 - Be specific and clear
 
 Title:"""
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=50,
-                temperature=0.7,
-            )
-        )
-        
-        title = response.text.strip()
-        
-        # Clean up the title
-        title = title.replace('"', '').replace("'", "")
-        if len(title) > 60:
-            title = title[:57] + "..."
-            
-        logger.info(f"Generated title: {title}")
-        return title
-        
-    except Exception as e:
-        logger.error(f"Error generating title: {str(e)}")
-        return "New Conversation"
\ No newline at end of file
+
+
+def _title_generation_config():
+    return genai.types.GenerationConfig(
+        max_output_tokens=50,
+        temperature=0.7,
+    )
+
+
+def _clean_title(text):
+    title = text.strip()
+
+    # Clean up the title
+    title = title.replace('"', '').replace("'", "")
+    if len(title) > 60:
+        title = title[:57] + "..."
+
+    logger.info(f"Generated title: {title}")
+    return title
@@ -0,0 +1,291 @@
+"""
+Daily rollups for the analytics endpoint.
+
+Reads only touch DailyStats and DailyTopicCount, one row per day (and per
+topic), so a date-range query costs the same however many conversations and
+messages exist. The rollups are kept current by the signals in chat.signals
+and can be rebuilt from the raw tables with `manage.py rebuild_analytics`.
+"""
+import datetime
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, JSONField, Max, Sum, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .commit_hooks import on_commit_batched
+from .models import Conversation, ConversationQuery, DailyStats, DailyTopicCount, Message, _group_by_count
+
+TOP_TOPICS = 10
+
+
+def day_bounds(day):
+    """Aware datetimes delimiting a local calendar day"""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def increment(day, query_time=None, **counters):
+    """
+    Add to one day's activity counters with a single UPDATE, creating the
+    row on the first event of the day.
+    """
+    updates = {field: F(field) + value for field, value in counters.items()}
+    if query_time is not None:
+        updates['query_time_total'] = F('query_time_total') + query_time
+        updates['query_time_max'] = Greatest('query_time_max', Value(query_time))
+
+    if DailyStats.objects.filter(date=day).update(**updates):
+        return
+    initial = dict(counters)
+    if query_time is not None:
+        initial.update(query_time_total=query_time, query_time_max=query_time)
+    try:
+        with transaction.atomic():
+            DailyStats.objects.create(date=day, **initial)
+    except IntegrityError:
+        # Another writer created the row first
+        DailyStats.objects.filter(date=day).update(**updates)
+
+
+def record_conversation_started(conversation):
+    increment(timezone.localdate(conversation.created_at), conversations_started=1)
+
+
+def record_message(message):
+    increment(timezone.localdate(message.timestamp), messages=1, tokens=message.tokens_used)
+
+
+def record_query(query):
+    increment(
+        timezone.localdate(query.created_at),
+        queries=1,
+        query_time=query.execution_time or 0.0
+    )
+
+
+def refresh_outcomes(day):
+    """
+    Recompute the ended-conversation fields of one day from the
+    conversations that ended on it (an indexed range on ended_at).
+    """
+    start, end = day_bounds(day)
+    ended = Conversation.objects.filter(status='ended', ended_at__gte=start, ended_at__lt=end)
+
+    count = 0
+    duration = 0.0
+    sentiments = Counter()
+    topics = Counter()
+    for created_at, ended_at, sentiment, topic_index in ended.values_list(
+        'created_at', 'ended_at', 'sentiment', 'topic_index'
+    ).iterator(chunk_size=2000):
+        count += 1
+        duration += (ended_at - created_at).total_seconds() / 60
+        if sentiment:
+            sentiments[sentiment] += 1
+        topics.update(topic_index)
+
+    outcomes = {
+        'conversations_ended': count,
+        'duration_minutes_total': duration,
+        'sentiment_counts': dict(sentiments),
+    }
+    with transaction.atomic():
+        if not DailyStats.objects.filter(date=day).update(**outcomes):
+            _, created = DailyStats.objects.get_or_create(date=day, defaults=outcomes)
+            if not created:
+                DailyStats.objects.filter(date=day).update(**outcomes)
+        DailyTopicCount.objects.filter(date=day).delete()
+        DailyTopicCount.objects.bulk_create(
+            DailyTopicCount(date=day, topic=topic, count=n) for topic, n in topics.items()
+        )
+
+
+def record_outcome_change(old, new):
+    """
+    Move one conversation's contribution to the outcome rollups from `old`
+    to `new` (Conversation.outcome() before and after a write, None when
+    not ended) once the current transaction commits. Changes are batched,
+    so deleting thousands of conversations updates each day once.
+    """
+    if old == new:
+        return
+    changes = Counter()
+    if old is not None:
+        changes[old] -= 1
+    if new is not None:
+        changes[new] += 1
+    on_commit_batched('analytics_outcomes', changes, apply_outcome_changes)
+
+
+def apply_outcome_changes(changes):
+    """
+    Add a Counter of outcome -> conversations (negative to remove them) to
+    the daily rollups with F() updates, without rescanning the conversations.
+    """
+    days = {}
+    for (day, minutes, sentiment, topics), n in changes.items():
+        if not n:
+            continue
+        delta = days.setdefault(day, {'ended': 0, 'minutes': 0.0, 'sentiments': Counter(), 'topics': Counter()})
+        delta['ended'] += n
+        delta['minutes'] += n * minutes
+        if sentiment:
+            delta['sentiments'][sentiment] += n
+        for topic in topics:
+            delta['topics'][topic] += n
+
+    for day, delta in days.items():
+        updates = {
+            'conversations_ended': Greatest(F('conversations_ended') + delta['ended'], Value(0)),
+            'duration_minutes_total': F('duration_minutes_total') + delta['minutes'],
+        }
+        sentiments = {sentiment: n for sentiment, n in delta['sentiments'].items() if n}
+        if sentiments:
+            updates['sentiment_counts'] = _add_counts('sentiment_counts', sentiments)
+        if not DailyStats.objects.filter(date=day).update(**updates):
+            DailyStats.objects.bulk_create([DailyStats(date=day)], ignore_conflicts=True)
+            DailyStats.objects.filter(date=day).update(**updates)
+        _adjust_topic_counts(day, delta['topics'])
+
+
+def _add_counts(field, counts):
+    """A jsonb expression adding `counts` to the name -> count object in `field`"""
+    pairs = ', '.join(f'%s::text, COALESCE(("{field}"->>%s)::int, 0) + %s' for _ in counts)
+    params = [value for name, n in counts.items() for value in (name, name, n)]
+    return RawSQL(f'"{field}" || jsonb_build_object({pairs})', params, output_field=JSONField())
+
+
+def _adjust_topic_counts(day, counts):
+    removed = {topic: -n for topic, n in counts.items() if n < 0}
+    added = {topic: n for topic, n in counts.items() if n > 0}
+    for amount, topics in _group_by_count(removed):
+        DailyTopicCount.objects.filter(date=day, topic__in=topics).update(
+            count=Greatest(F('count') - amount, Value(0))
+        )
+    if removed:
+        DailyTopicCount.objects.filter(date=day, topic__in=list(removed), count=0).delete()
+    if added:
+        DailyTopicCount.objects.bulk_create(
+            [DailyTopicCount(date=day, topic=topic) for topic in added], ignore_conflicts=True
+        )
+    for amount, topics in _group_by_count(added):
+        DailyTopicCount.objects.filter(date=day, topic__in=topics).update(count=F('count') + amount)
+
+
+def rebuild():
+    """
+    Recompute every rollup from the raw tables with grouped queries.
+
+    Returns:
+        int: Number of days with data
+    """
+    days = {}
+
+    def add(rows, **fields):
+        for row in rows:
+            stats = days.setdefault(row['day'], DailyStats(date=row['day']))
+            for field, key in fields.items():
+                setattr(stats, field, row[key] or 0)
+
+    add(
+        Conversation.objects.annotate(day=TruncDate('created_at'))
+        .values('day').annotate(n=Count('id')).order_by(),
+        conversations_started='n'
+    )
+    add(
+        Message.objects.annotate(day=TruncDate('timestamp'))
+        .values('day').annotate(n=Count('id'), t=Sum('tokens_used')).order_by(),
+        messages='n', tokens='t'
+    )
+    add(
+        ConversationQuery.objects.annotate(day=TruncDate('created_at'))
+        .values('day')
+        .annotate(n=Count('id'), total=Sum('execution_time'), slowest=Max('execution_time'))
+        .order_by(),
+        queries='n', query_time_total='total', query_time_max='slowest'
+    )
+    ended_days = set(
+        Conversation.objects.filter(status='ended', ended_at__isnull=False)
+        .annotate(day=TruncDate('ended_at'))
+        .values_list('day', flat=True).distinct().order_by()
+    )
+    for day in ended_days:
+        days.setdefault(day, DailyStats(date=day))
+
+    with transaction.atomic():
+        DailyTopicCount.objects.all().delete()
+        DailyStats.objects.all().delete()
+        DailyStats.objects.bulk_create(days.values(), batch_size=1000)
+        for day in ended_days:
+            refresh_outcomes(day)
+    return len(days)
+
+
+def summarize(date_from=None, date_to=None):
+    """
+    Analytics for an inclusive date range, read from the rollups only.
+
+    Returns:
+        dict: Totals, distributions, top topics and a per-day series
+    """
+    stats = DailyStats.objects.all()
+    topics = DailyTopicCount.objects.all()
+    if date_from:
+        stats = stats.filter(date__gte=date_from)
+        topics = topics.filter(date__gte=date_from)
+    if date_to:
+        stats = stats.filter(date__lte=date_to)
+        topics = topics.filter(date__lte=date_to)
+
+    totals = Counter()
+    sentiments = Counter()
+    slowest_query = 0.0
+    daily = []
+    for day in stats:
+        totals.update({
+            'conversations': day.conversations_started,
+            'ended': day.conversations_ended,
+            'messages': day.messages,
+            'tokens': day.tokens,
+            'queries': day.queries,
+        })
+        totals['duration'] += day.duration_minutes_total
+        totals['query_time'] += day.query_time_total
+        slowest_query = max(slowest_query, day.query_time_max)
+        sentiments.update(day.sentiment_counts)
+        daily.append({
+            'date': day.date.isoformat(),
+            'conversations': day.conversations_started,
+            'ended': day.conversations_ended,
+            'messages': day.messages,
+            'tokens': day.tokens,
+            'queries': day.queries,
+        })
+
+    top_topics = list(
+        topics.values('topic').annotate(count=Sum('count')).order_by('-count', 'topic')[:TOP_TOPICS]
+    )
+
+    return {
+        'total_conversations': totals['conversations'],
+        'ended_conversations': totals['ended'],
+        'total_messages': totals['messages'],
+        'total_tokens': totals['tokens'],
+        'top_topics': top_topics,
+        'topics_discussed': topics.values('topic').distinct().count(),
+        'sentiment_distribution': dict(+sentiments),  # Without sentiments moved out to zero
+        'average_duration_minutes': (
+            round(totals['duration'] / totals['ended'], 2) if totals['ended'] else None
+        ),
+        'queries': {
+            'count': totals['queries'],
+            'average_seconds': (
+                round(totals['query_time'] / totals['queries'], 3) if totals['queries'] else None
+            ),
+            'max_seconds': round(slowest_query, 3),
+        },
+        'daily': daily,
+    }
@@ -0,0 +1,463 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.db import close_old_connections
+
+from .embedding_index import VectorIndex, EmbeddingIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _nearest(data, centroids, chunk_size=8192):
+    """Index of the closest centroid (L2) for every row of data"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(data.shape[0], dtype=np.int64)
+    for start in range(0, data.shape[0], chunk_size):
+        block = data[start:start + chunk_size]
+        distances = centroid_norms[None, :] - 2 * (block @ centroids.T)
+        assignments[start:start + chunk_size] = distances.argmin(axis=1)
+    return assignments
+
+
+def kmeans(data, k, n_iter=20, seed=0):
+    """
+    Plain Lloyd's k-means in NumPy.
+
+    Empty clusters are re-seeded from random points so every centroid
+    stays usable as an inverted list or codebook entry.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, data.shape[0])
+    centroids = data[rng.choice(data.shape[0], k, replace=False)].astype(np.float32)
+
+    for _ in range(n_iter):
+        assignments = _nearest(data, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(data.shape[0], len(empty), replace=False)]
+
+    return centroids
+
+
+class IVFPQIndex(VectorIndex):
+    """
+    Approximate nearest-neighbour index: inverted file + product quantization.
+
+    Vectors are assigned to the nearest of `nlist` k-means centroids and the
+    residual is compressed into `m` one-byte codes. A query only visits the
+    `nprobe` closest inverted lists and scores their codes with per-subspace
+    lookup tables (asymmetric distance computation).
+
+    Knobs:
+        nlist: number of coarse centroids (more lists, fewer vectors scanned)
+        m: number of PQ sub-quantizers, must divide the dimension
+           (larger m = better recall, more memory per vector)
+        nprobe: lists visited per query (recall/latency trade-off)
+        rerank: when > 0, keep float16 copies of the vectors and rescore the
+           best k * rerank PQ candidates exactly (recovers most of the recall
+           lost to quantization at 2 bytes per dimension)
+
+    Until enough vectors exist to train the quantizers they are kept in an
+    exact index and searched by brute force.
+
+    Quantizers fit the vectors they were trained on. Once the index holds
+    `retrain_growth` times as many vectors, it is rebuilt from the database
+    in a background thread (rebuild()) and swapped in; 0 turns this off and
+    leaves retraining to `manage.py rebuild_ann_index`. Every training is
+    saved to `path`.
+    """
+
+    KSUB = 256
+    MAX_TRAINING_POINTS = 100000
+    # Attributes replaced wholesale when a rebuilt index is swapped in
+    STATE = (
+        'centroids', 'codebooks', '_codebook_norms', '_centroid_terms', '_list_ids', '_list_codes',
+        '_list_vectors', '_id_to_list', '_pending', '_trained_size', '_loaded', '_synced_at',
+    )
+
+    def __init__(self, nlist=256, m=16, nprobe=8, rerank=0, path=None, seed=0, retrain_growth=4):
+        super().__init__()
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.path = path
+        self.seed = seed
+        self.retrain_growth = retrain_growth
+        self._rebuilding = False
+        self._reset()
+
+    def _reset(self):
+        self.centroids = None
+        self.codebooks = None
+        self._list_ids = []
+        self._list_codes = []
+        self._list_vectors = []
+        self._id_to_list = {}
+        self._pending = EmbeddingIndex()
+        self._trained_size = 0
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def needs_retraining(self):
+        """The index has outgrown the sample its quantizers were trained on"""
+        return (
+            self.is_trained and bool(self.retrain_growth)
+            and len(self) >= self.retrain_growth * max(self._trained_size, self.KSUB)
+        )
+
+    def __len__(self):
+        return len(self._id_to_list) + len(self._pending)
+
+    def indexed_ids(self):
+        return set(self._id_to_list) | self._pending.indexed_ids()
+
+    def train(self, vectors):
+        """Fit coarse centroids and PQ codebooks on a sample of vectors"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dimension = vectors.shape
+        if dimension % self.m:
+            raise ValueError(f"Dimension {dimension} is not divisible by m={self.m}")
+
+        rng = np.random.default_rng(self.seed)
+        if n > self.MAX_TRAINING_POINTS:
+            vectors = vectors[rng.choice(n, self.MAX_TRAINING_POINTS, replace=False)]
+
+        nlist = max(1, min(self.nlist, vectors.shape[0] // 8))
+        centroids = kmeans(vectors, nlist, seed=self.seed)
+        residuals = vectors - centroids[_nearest(vectors, centroids)]
+
+        dsub = dimension // self.m
+        codebooks = np.empty((self.m, self.KSUB, dsub), dtype=np.float32)
+        for sub in range(self.m):
+            block = np.ascontiguousarray(residuals[:, sub * dsub:(sub + 1) * dsub])
+            trained = kmeans(block, self.KSUB, n_iter=15, seed=self.seed + sub)
+            codebooks[sub, :len(trained)] = trained
+            # Fewer training points than codes: pad so every code id is valid
+            codebooks[sub, len(trained):] = trained[0]
+
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self._trained_size = vectors.shape[0]
+        self._precompute_tables()
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(len(centroids))]
+        self._list_codes = [np.empty((0, self.m), dtype=np.uint8) for _ in range(len(centroids))]
+        self._list_vectors = [
+            np.empty((0, dimension if self.rerank else 0), dtype=np.float16)
+            for _ in range(len(centroids))
+        ]
+        self._id_to_list = {}
+
+    def _precompute_tables(self):
+        """
+        Cache the query-independent parts of the ADC lookup tables.
+
+        With r = q - c, ||r - b||^2 = ||q - c||^2 + ||b||^2 - 2 q.b + 2 c.b,
+        so per query only q.b has to be computed; c.b is stored per list.
+        """
+        nlist = self.centroids.shape[0]
+        dsub = self.codebooks.shape[2]
+        self._codebook_norms = (self.codebooks ** 2).sum(axis=2)
+        self._centroid_terms = np.einsum(
+            'lmd,mkd->lmk', self.centroids.reshape(nlist, self.m, dsub), self.codebooks
+        )
+
+    def _encode(self, vectors):
+        """Return (list assignment, PQ codes) for a batch of vectors"""
+        assignments = _nearest(vectors, self.centroids)
+        residuals = vectors - self.centroids[assignments]
+        dsub = self.codebooks.shape[2]
+        codes = np.empty((vectors.shape[0], self.m), dtype=np.uint8)
+        for sub in range(self.m):
+            block = np.ascontiguousarray(residuals[:, sub * dsub:(sub + 1) * dsub])
+            codes[:, sub] = _nearest(block, self.codebooks[sub])
+        return assignments, codes
+
+    def add(self, ids, vectors):
+        """Encode and append a batch of vectors to their inverted lists"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+
+        with self._lock:
+            for conversation_id in ids.tolist():
+                self._remove(conversation_id)
+
+            assignments, codes = self._encode(vectors)
+            order = np.argsort(assignments, kind='stable')
+            lists, starts = np.unique(assignments[order], return_index=True)
+            bounds = list(starts[1:]) + [len(order)]
+
+            for list_no, start, end in zip(lists.tolist(), starts.tolist(), bounds):
+                rows = order[start:end]
+                self._list_ids[list_no] = np.concatenate((self._list_ids[list_no], ids[rows]))
+                self._list_codes[list_no] = np.concatenate((self._list_codes[list_no], codes[rows]))
+                if self.rerank:
+                    self._list_vectors[list_no] = np.concatenate(
+                        (self._list_vectors[list_no], vectors[rows].astype(np.float16))
+                    )
+                for conversation_id in ids[rows].tolist():
+                    self._id_to_list[conversation_id] = list_no
+
+    def load(self, rows):
+        """Train on and index (conversation_id, embedding) pairs"""
+        ids = []
+        vectors = []
+        for conversation_id, embedding in rows:
+            if embedding is None or not len(embedding):
+                continue
+            ids.append(conversation_id)
+            vectors.append(np.asarray(embedding, dtype=np.float32))
+
+        with self._lock:
+            self._reset()
+            if len(vectors) >= self.KSUB:
+                matrix = np.vstack(vectors)
+                self.train(matrix)
+                self.add(ids, matrix)
+            else:
+                self._pending.load(zip(ids, vectors))
+            self._loaded = True
+            logger.info(
+                f"Loaded {len(self)} embeddings into IVF-PQ index "
+                f"(trained={self.is_trained})"
+            )
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if self.path and os.path.exists(self.path):
+                try:
+                    self.load_file(self.path)
+                    self.sync_with_db(full=True)
+                    self._maybe_rebuild()
+                    return
+                except Exception as e:
+                    logger.warning(f"Could not load ANN index from {self.path}: {str(e)}")
+            self.load_from_db()
+            if self.path and self.is_trained:
+                self.save(self.path)
+
+    def upsert(self, conversation_id, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if not self.is_trained:
+                self._pending.upsert(conversation_id, vector)
+                if len(self._pending) >= self.KSUB:
+                    self._train_pending()
+                return
+            self.add([conversation_id], vector[None, :])
+        self._maybe_rebuild()
+
+    def _train_pending(self):
+        pending = self._pending
+        ids = pending._ids[:len(pending)].copy()
+        matrix = pending._matrix[:len(pending)].copy()
+        self._pending = EmbeddingIndex()
+        self.train(matrix)
+        self.add(ids, matrix)
+        self._save_quietly()
+
+    def rebuild(self):
+        """
+        Retrain on the vectors stored in the database and swap the new index
+        in. Searches keep using the old one meanwhile; writes committed
+        during the rebuild are picked up by the next sync_with_db().
+        """
+        fresh = IVFPQIndex(
+            nlist=self.nlist, m=self.m, nprobe=self.nprobe, rerank=self.rerank,
+            seed=self.seed, retrain_growth=self.retrain_growth
+        )
+        fresh.load_from_db()
+        with self._lock:
+            for name in self.STATE:
+                setattr(self, name, getattr(fresh, name))
+        logger.info(f"Rebuilt IVF-PQ index on {self._trained_size} training vectors ({len(self)} indexed)")
+        self._save_quietly()
+
+    def _maybe_rebuild(self):
+        with self._lock:
+            if self._rebuilding or not self.needs_retraining:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name='ann-rebuild', daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"IVF-PQ rebuild failed: {str(e)}")
+        finally:
+            self._rebuilding = False
+            close_old_connections()
+
+    def _save_quietly(self):
+        if not self.path or not self.is_trained:
+            return
+        try:
+            self.save(self.path)
+        except Exception as e:
+            logger.warning(f"Could not save ANN index to {self.path}: {str(e)}")
+
+    def remove(self, conversation_id):
+        with self._lock:
+            self._remove(conversation_id)
+
+    def _remove(self, conversation_id):
+        self._pending.remove(conversation_id)
+        list_no = self._id_to_list.pop(conversation_id, None)
+        if list_no is None:
+            return
+        keep = self._list_ids[list_no] != conversation_id
+        self._list_ids[list_no] = self._list_ids[list_no][keep]
+        self._list_codes[list_no] = self._list_codes[list_no][keep]
+        if self.rerank:
+            self._list_vectors[list_no] = self._list_vectors[list_no][keep]
+
+    def search(self, query_embedding, k=10, candidate_ids=None, nprobe=None, rerank=None):
+        """
+        Approximate top-k by cosine similarity.
+        nprobe and rerank override the index defaults for this query.
+
+        Returns:
+            list: (conversation_id, similarity_score) tuples, best first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        nprobe = nprobe or self.nprobe
+        rerank = self.rerank if rerank is None else min(rerank, self.rerank)
+
+        with self._lock:
+            if not self.is_trained:
+                return self._pending.search(query, k=k, candidate_ids=candidate_ids)
+            if k <= 0:
+                return []
+
+            candidates = None
+            if candidate_ids is not None:
+                candidates = np.fromiter(candidate_ids, dtype=np.int64)
+
+            coarse = ((self.centroids - query) ** 2).sum(axis=1)
+            probe = np.argsort(coarse)[:nprobe]
+            dsub = self.codebooks.shape[2]
+            query_terms = np.einsum('md,mkd->mk', query.reshape(self.m, dsub), self.codebooks)
+            base_table = self._codebook_norms - 2 * query_terms
+            sub_range = np.arange(self.m)
+
+            all_ids = []
+            all_distances = []
+            all_rows = []
+            for list_no in probe.tolist():
+                ids = self._list_ids[list_no]
+                if not len(ids):
+                    continue
+                codes = self._list_codes[list_no]
+                rows = np.arange(len(ids))
+                if candidates is not None:
+                    mask = np.isin(ids, candidates)
+                    ids = ids[mask]
+                    codes = codes[mask]
+                    rows = rows[mask]
+                    if not len(ids):
+                        continue
+
+                table = base_table + 2 * self._centroid_terms[list_no]
+                all_distances.append(coarse[list_no] + table[sub_range, codes].sum(axis=1))
+                all_ids.append(ids)
+                all_rows.append(np.stack((np.full(len(rows), list_no), rows), axis=1))
+
+            if not all_ids:
+                return []
+
+            ids = np.concatenate(all_ids)
+            # Squared L2 between unit vectors is 2 - 2 * cosine
+            scores = 1.0 - np.concatenate(all_distances) / 2.0
+            if not rerank:
+                return EmbeddingIndex._top_k(ids, scores, k)
+
+            locations = np.concatenate(all_rows)
+            shortlist = EmbeddingIndex._top_k(np.arange(len(ids)), scores, k * rerank)
+            positions = np.array([position for position, _ in shortlist], dtype=np.int64)
+            vectors = np.stack([
+                self._list_vectors[list_no][row] for list_no, row in locations[positions].tolist()
+            ]).astype(np.float32)
+            return EmbeddingIndex._top_k(ids[positions], vectors @ query, k)
+
+    def save(self, path=None):
+        """Persist quantizers and inverted lists to a .npz file"""
+        path = path or self.path
+        with self._lock:
+            if not self.is_trained:
+                raise ValueError("Cannot save an untrained index")
+            sizes = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                params=np.array([self.nlist, self.m, self.nprobe, self.rerank], dtype=np.int64),
+                trained_size=np.array([self._trained_size], dtype=np.int64),
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                list_sizes=sizes,
+                ids=np.concatenate(self._list_ids),
+                codes=np.concatenate(self._list_codes),
+                vectors=np.concatenate(self._list_vectors),
+                # Watermark for sync_with_db() after a restart
+                synced_at=np.array([self._synced_at.timestamp() if self._synced_at else np.nan]),
+            )
+            os.replace(tmp_path, path)
+            logger.info(f"Saved ANN index with {len(self)} vectors to {path}")
+
+    def load_file(self, path=None):
+        """Restore an index written by save()"""
+        path = path or self.path
+        with np.load(path) as data:
+            nlist, m, _, rerank = data['params'].tolist()
+            if m != self.m or bool(rerank) != bool(self.rerank):
+                raise ValueError(
+                    f"Persisted index (m={m}, rerank={rerank}) does not match "
+                    f"configuration (m={self.m}, rerank={self.rerank})"
+                )
+            offsets = np.concatenate(([0], np.cumsum(data['list_sizes'])))
+            ids = data['ids']
+            codes = data['codes']
+            vectors = data['vectors']
+
+            with self._lock:
+                self._reset()
+                self.nlist = nlist
+                self.centroids = data['centroids']
+                self.codebooks = data['codebooks']
+                self._precompute_tables()
+                self._list_ids = [ids[offsets[i]:offsets[i + 1]].copy() for i in range(len(offsets) - 1)]
+                self._list_codes = [codes[offsets[i]:offsets[i + 1]].copy() for i in range(len(offsets) - 1)]
+                self._list_vectors = [
+                    vectors[offsets[i]:offsets[i + 1]].copy() if self.rerank else vectors[:0]
+                    for i in range(len(offsets) - 1)
+                ]
+                for list_no, list_ids in enumerate(self._list_ids):
+                    for conversation_id in list_ids.tolist():
+                        self._id_to_list[conversation_id] = list_no
+                # Files written before trained_size was stored: assume the minimum sample
+                self._trained_size = int(data['trained_size'][0]) if 'trained_size' in data.files else self.KSUB
+                self._loaded = True
+                if 'synced_at' in data.files and not np.isnan(data['synced_at'][0]):
+                    self.mark_synced(datetime.fromtimestamp(float(data['synced_at'][0]), tz=dt_timezone.utc))
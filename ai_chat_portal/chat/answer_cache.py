@@ -0,0 +1,126 @@
+"""
+Semantic cache for query_conversations answers.
+
+Users often ask nearly the same question about past conversations ("what
+did we decide about X"). Once retrieval has picked the conversations that go
+into the prompt, the answer depends only on the question and those
+conversations' prompt fields. Entries are therefore grouped under a key
+hashed from that context (see EnhancedAIService._answer_cache_key), and a
+new question is answered from an entry whose question embedding is within
+the cosine threshold of it, without calling the model.
+
+Invalidation follows from the key: editing, re-analysing or deleting any of
+the conversations changes the context, so the old entries are never matched
+again and age out of the LLM cache they are stored in (both tiers, so the
+entries are shared by all workers when CACHES['llm'] is configured).
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .llm_cache import get_llm_cache
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed on (prompt context, question embedding).
+
+        answer = answer_cache.lookup(key, query_embedding)
+        if answer is None:
+            answer = call_model()
+            answer_cache.store(key, query_embedding, answer, latency)
+    """
+
+    def __init__(self, store, threshold=0.95, max_variants=16, ttl=3600):
+        self.store_backend = store
+        self.threshold = threshold
+        self.max_variants = max_variants
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'saved_seconds': 0.0,
+        }
+
+    def lookup(self, key, query_embedding):
+        """Cached answer text or None"""
+        if query_embedding is None:
+            return None
+        return self._match(self.store_backend.get(key), query_embedding)
+
+    async def alookup(self, key, query_embedding):
+        if query_embedding is None:
+            return None
+        return self._match(await self.store_backend.aget(key), query_embedding)
+
+    def store(self, key, query_embedding, answer, latency):
+        """
+        Remember an answer and the model latency it cost, so hits can report
+        the time they saved.
+        """
+        if query_embedding is None:
+            return
+        self.store_backend.set(
+            key, self._variants(self.store_backend.get(key), query_embedding, answer, latency), self.ttl
+        )
+
+    async def astore(self, key, query_embedding, answer, latency):
+        if query_embedding is None:
+            return
+        variants = self._variants(await self.store_backend.aget(key), query_embedding, answer, latency)
+        await self.store_backend.aset(key, variants, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['saved_seconds'] = round(stats['saved_seconds'], 3)
+        stats['threshold'] = self.threshold
+        return stats
+
+    def _match(self, variants, query_embedding):
+        best = None
+        if variants:
+            similarities = np.array([v['embedding'] for v in variants]) @ np.asarray(query_embedding)
+            position = int(np.argmax(similarities))
+            if similarities[position] >= self.threshold:
+                best = variants[position]
+
+        with self._lock:
+            if best is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._stats['saved_seconds'] += best['latency']
+        return best['answer']
+
+    def _variants(self, variants, query_embedding, answer, latency):
+        # A new list: the in-process tier hands out the stored object itself
+        variants = list(variants or [])
+        variants.append({'embedding': list(query_embedding), 'answer': answer, 'latency': latency})
+        with self._lock:
+            self._stats['stores'] += 1
+        return variants[-self.max_variants:]
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Process-wide answer cache configured from AI_CONFIG, stored in the LLM cache"""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(
+                    get_llm_cache(),
+                    threshold=settings.AI_CONFIG.get('ANSWER_CACHE_THRESHOLD', 0.95),
+                    max_variants=settings.AI_CONFIG.get('ANSWER_CACHE_VARIANTS', 16),
+                    ttl=settings.AI_CONFIG.get('ANSWER_CACHE_TTL', 3600),
+                )
+    return _answer_cache
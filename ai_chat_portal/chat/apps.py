@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .jobs import start_server_workers
+        from .metrics import install_query_timer
+
+        connection_created.connect(install_query_timer, dispatch_uid='chat_query_timer')
+        start_server_workers()
@@ -0,0 +1,297 @@
+"""
+Async versions of the LLM-bound conversation actions.
+
+Served through config.asgi, each request awaits Gemini instead of holding
+a worker thread, so one process can keep hundreds of model calls in flight.
+Request and response shapes match the ConversationViewSet actions.
+"""
+import functools
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+
+from .models import Conversation, Message, ConversationQuery
+from .serializers import (
+    ConversationDetailSerializer,
+    MessageSerializer,
+    MessageCreateSerializer,
+    ConversationQuerySerializer,
+    ConversationQueryResponseSerializer
+)
+from .enhanced_ai_service import EnhancedAIService
+from .ai_utils import agenerate_title_from_text, schedule_title_generation
+from .jobs import get_job_queue
+from .context import ConversationContext
+from .topics import filter_by_topics
+from .views import ConversationViewSet
+
+logger = logging.getLogger(__name__)
+
+
+def get_ai_service():
+    return EnhancedAIService()
+
+
+class ConversationAccess(APIView):
+    """
+    The authentication, permission and throttle classes of ConversationViewSet,
+    so the async routes are limited exactly like the viewset actions (and
+    share their throttle counters).
+    """
+    
+    def get_authenticators(self):
+        return [auth() for auth in ConversationViewSet.authentication_classes]
+    
+    def get_permissions(self):
+        return [permission() for permission in ConversationViewSet.permission_classes]
+    
+    def get_throttles(self):
+        return [throttle() for throttle in ConversationViewSet.throttle_classes]
+
+
+def check_access(request, *args, **kwargs):
+    """
+    Run ConversationAccess's checks on a plain Django request. Returns DRF's
+    rendered error response (401/403/429 with its headers), or None when the
+    request may proceed.
+    """
+    view = ConversationAccess()
+    view.args, view.kwargs = args, kwargs
+    drf_request = view.initialize_request(request, *args, **kwargs)
+    view.request = drf_request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(drf_request, *args, **kwargs)
+    except Exception as exc:
+        response = view.finalize_response(drf_request, view.handle_exception(exc), *args, **kwargs)
+        return response.render()
+    return None
+
+
+def async_api_view(methods):
+    """
+    Async counterpart of DRF's @api_view: method check, the viewset's
+    authentication, permission and throttle checks, JSON body parsing and
+    CSRF exemption (Django 4.2 decorators are not async-aware).
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return _error(f'Method "{request.method}" not allowed.', 405)
+            denied = await sync_to_async(check_access)(request, *args, **kwargs)
+            if denied is not None:
+                return denied
+            if request.content_type == 'application/json':
+                try:
+                    request.data = json.loads(request.body or b'{}')
+                except ValueError:
+                    return _error('Invalid JSON body', 400)
+            else:
+                request.data = request.POST
+            return await view_func(request, *args, **kwargs)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _error(message, status):
+    return _json({'error': message}, status=status)
+
+
+async def _get_conversation(pk):
+    return await (
+        Conversation.objects
+        .defer('embedding', 'embedding_vector')
+        .filter(pk=pk)
+        .afirst()
+    )
+
+
+@async_api_view(['POST'])
+async def send_message(request, pk):
+    """
+    POST /api/async/conversations/{id}/send_message/
+    """
+    try:
+        conversation = await _get_conversation(pk)
+        if conversation is None:
+            return _error('Conversation not found', 404)
+
+        if conversation.status != 'active':
+            return _error('Cannot send message to ended conversation', 400)
+
+        message_serializer = MessageCreateSerializer(data=request.data)
+        if not message_serializer.is_valid():
+            return _json(message_serializer.errors, status=400)
+        user_content = message_serializer.validated_data['content']
+
+        user_message = await Message.objects.acreate(
+            conversation=conversation,
+            sender='user',
+            content=user_content
+        )
+
+        context = await sync_to_async(
+            ConversationContext(conversation).load
+        )(exclude=user_message)
+        history = context.history()
+
+        gemini_service = get_ai_service()
+        ai_response_data = await gemini_service.agenerate_chat_response(
+            user_content,
+            conversation_history=history
+        )
+
+        ai_message = await Message.objects.acreate(
+            conversation=conversation,
+            sender='ai',
+            content=ai_response_data['response'],
+            tokens_used=ai_response_data['tokens_used']
+        )
+
+        await _maybe_generate_title(conversation, gemini_service)
+        context.fold_in_background(gemini_service)
+
+        return _json({
+            'user_message': MessageSerializer(user_message).data,
+            'ai_message': MessageSerializer(ai_message).data
+        }, status=201)
+
+    except Exception as e:
+        logger.error(f"Error sending message: {str(e)}")
+        return _error(f'Failed to send message: {str(e)}', 500)
+
+
+async def _maybe_generate_title(conversation, gemini_service):
+    """AUTO-GENERATE TITLE AFTER 4 MESSAGES"""
+    if conversation.message_count >= 4 and (conversation.title == "New Conversation" or not conversation.title):
+        try:
+            if settings.AI_CONFIG.get('DEFERRED_TITLE'):
+                schedule_title_generation(conversation.id, model=gemini_service.model)
+                return
+
+            first_messages = [msg async for msg in conversation.messages.order_by('timestamp')[:4]]
+            text_for_title = " ".join([msg.content for msg in first_messages])
+
+            new_title = await agenerate_title_from_text(text_for_title, model=gemini_service.model)
+            conversation.title = new_title
+            await conversation.asave(update_fields=['title'])
+            logger.info(f"Auto-generated title: {new_title}")
+        except Exception as title_error:
+            logger.error(f"Failed to generate title: {str(title_error)}")
+
+
+@async_api_view(['POST'])
+async def end_conversation(request, pk):
+    """
+    POST /api/async/conversations/{id}/end_conversation/
+    """
+    try:
+        conversation = await _get_conversation(pk)
+        if conversation is None:
+            return _error('Conversation not found', 404)
+
+        if conversation.status == 'ended':
+            return _error('Conversation already ended', 400)
+
+        if conversation.message_count < 2:
+            return _error('Cannot end conversation with less than 2 messages', 400)
+
+        if settings.AI_CONFIG.get('BACKGROUND_ANALYSIS'):
+            await sync_to_async(get_job_queue().enqueue)(conversation)
+            data = await sync_to_async(lambda: ConversationDetailSerializer(conversation).data)()
+            return _json(data, status=202)
+
+        message_data = [
+            {'sender': msg.sender, 'content': msg.content}
+            async for msg in conversation.messages.all()
+        ]
+
+        gemini_service = get_ai_service()
+        analysis, embedding = await gemini_service.aanalyze_conversation(message_data)
+
+        conversation.status = 'ended'
+        conversation.ended_at = timezone.now()
+        conversation.summary = analysis['summary']
+        conversation.key_topics = analysis['key_topics']
+        conversation.action_items = analysis['action_items']
+        conversation.sentiment = analysis['sentiment']
+        conversation.embedding_vector = embedding
+        conversation.analysis_status = 'completed'
+        await conversation.asave()
+
+        data = await sync_to_async(lambda: ConversationDetailSerializer(conversation).data)()
+        return _json(data)
+
+    except Exception as e:
+        logger.error(f"Error ending conversation: {str(e)}")
+        return _error(f'Failed to end conversation: {str(e)}', 500)
+
+
+@async_api_view(['POST'])
+async def query_conversations(request):
+    """
+    POST /api/async/conversations/query_conversations/
+    """
+    try:
+        start_time = time.time()
+
+        query_serializer = ConversationQuerySerializer(data=request.data)
+        if not query_serializer.is_valid():
+            return _json(query_serializer.errors, status=400)
+        query_text = query_serializer.validated_data['query']
+
+        conversations = Conversation.objects.filter(status='ended')
+
+        if 'date_from' in query_serializer.validated_data:
+            conversations = conversations.filter(
+                created_at__gte=query_serializer.validated_data['date_from']
+            )
+        if 'date_to' in query_serializer.validated_data:
+            conversations = conversations.filter(
+                created_at__lte=query_serializer.validated_data['date_to']
+            )
+
+        if 'topics' in query_serializer.validated_data:
+            conversations = filter_by_topics(
+                conversations,
+                query_serializer.validated_data['topics'],
+                match=query_serializer.validated_data['topics_match']
+            )
+
+        gemini_service = get_ai_service()
+        ai_response, relevant_conversations = await gemini_service.aquery_past_conversations(
+            query_text,
+            conversations
+        )
+
+        execution_time = time.time() - start_time
+        query_obj = await ConversationQuery.objects.acreate(
+            query_text=query_text,
+            response=ai_response,
+            execution_time=execution_time
+        )
+        await query_obj.aadd_relevant_conversations(relevant_conversations)
+
+        data = await sync_to_async(lambda: ConversationQueryResponseSerializer(
+            query_obj,
+            context={'relevant_conversations': relevant_conversations}
+        ).data)()
+        return _json(data)
+
+    except Exception as e:
+        logger.error(f"Error querying conversations: {str(e)}")
+        return _error(f'Failed to query conversations: {str(e)}', 500)
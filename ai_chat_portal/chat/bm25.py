@@ -0,0 +1,372 @@
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from heapq import nlargest
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .index_sync import DatabaseSyncMixin
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+COMPOUND_SPLIT_RE = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have how i in is it its "
+    "me my of on or our so that the their them there these they this to was we were "
+    "what when where which who why will with you your about can could should would".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased word tokens without stopwords. Identifiers such as
+    "JIRA-4821" are kept whole and also split into their parts.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if COMPOUND_SPLIT_RE.search(token):
+            tokens.extend(
+                part for part in COMPOUND_SPLIT_RE.split(token)
+                if part and part not in STOPWORDS
+            )
+    return tokens
+
+
+class BM25Index(DatabaseSyncMixin):
+    """
+    In-memory Okapi BM25 index of conversation text.
+
+    A conversation's document is its title, topics and summary (counted
+    FIELD_BOOST times) plus the text of its messages. Postings map each term
+    to {conversation_id: term frequency}; messages are appended to a document
+    incrementally, so a new chat turn only touches the new message's terms.
+    Per-term IDF values are cached and dropped when the term's document
+    frequency or the document count changes. Terms found in nearly every
+    document (IDF below MIN_IDF, e.g. the "jira" of "jira-4821") are treated
+    as stopwords, so they cannot pull unrelated conversations into a ranking.
+
+    Writes made by other processes are picked up by sync_with_db()
+    (chat.index_sync). Each document remembers the newest message id read
+    from the database, and the ids appended since by this process's signals,
+    so a sync re-reads the fields of a changed conversation but only appends
+    the messages it has not seen; an active chat is never re-tokenized.
+    Messages of one conversation are assumed to commit in id order, and
+    edits to existing messages made by other processes need a full
+    reindex_bm25_conversation().
+    """
+
+    FIELD_BOOST = 2
+    MIN_IDF = 0.1
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._fields = {}
+        self._documents = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._postings = defaultdict(dict)
+        self._idf = {}
+        self._message_marks = {}  # conversation_id -> newest message id read from the database
+        self._unsynced_messages = {}  # conversation_id -> ids above the mark appended by signals
+        self._init_sync()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def indexed_ids(self):
+        with self._lock:
+            return set(self._documents)
+
+    def load(self, conversations, messages=()):
+        """
+        Replace the index contents.
+
+        Args:
+            conversations: (conversation_id, title, summary, key_topics) rows
+            messages: (conversation_id, content) or
+                (conversation_id, content, message_id) rows
+        """
+        with self._lock:
+            self._fields = {}
+            self._documents = {}
+            self._lengths = {}
+            self._total_length = 0
+            self._postings = defaultdict(dict)
+            self._idf = {}
+            self._message_marks = {}
+            self._unsynced_messages = {}
+
+            message_terms = defaultdict(Counter)
+            for conversation_id, content, *message_id in messages:
+                message_terms[conversation_id].update(tokenize(content))
+                if message_id:
+                    self._mark(conversation_id, message_id[0])
+            for conversation_id, title, summary, key_topics in conversations:
+                fields = self._field_terms(title, summary, key_topics)
+                self._fields[conversation_id] = fields
+                self._replace(conversation_id, self._boosted(fields) + message_terms.pop(conversation_id, Counter()))
+
+            self._loaded = True
+            logger.info(f"Loaded {len(self._documents)} conversations into BM25 index")
+
+    def set_fields(self, conversation_id, title, summary, key_topics):
+        """Replace the title/summary/topics part of a conversation's document"""
+        self._set_field_terms(conversation_id, self._field_terms(title, summary, key_topics))
+
+    def _set_field_terms(self, conversation_id, fields):
+        with self._lock:
+            old_fields = self._fields.get(conversation_id, Counter())
+            document = self._documents.get(conversation_id, Counter()) - self._boosted(old_fields)
+            self._fields[conversation_id] = fields
+            self._replace(conversation_id, document + self._boosted(fields))
+
+    def add_message(self, conversation_id, content, message_id=None):
+        """
+        Append one message's text to a conversation's document. With a
+        message_id, messages the document already holds are skipped, so the
+        signal handlers and sync_with_db() can both deliver a message.
+        """
+        terms = Counter(tokenize(content))
+        with self._lock:
+            if message_id is not None:
+                if message_id <= self._message_marks.get(conversation_id, 0):
+                    return
+                unsynced = self._unsynced_messages.setdefault(conversation_id, set())
+                if message_id in unsynced:
+                    return
+                # Not a watermark: older messages from other processes may still be missing
+                unsynced.add(message_id)
+            self._append(conversation_id, terms)
+
+    def _append(self, conversation_id, terms):
+        with self._lock:
+            if not terms:
+                return
+            if conversation_id not in self._documents:
+                self._fields[conversation_id] = Counter()
+                self._documents[conversation_id] = Counter()
+                self._lengths[conversation_id] = 0
+                self._idf.clear()
+            document = self._documents[conversation_id]
+            for term, count in terms.items():
+                if term not in document:
+                    self._idf.pop(term, None)
+                document[term] += count
+                self._postings[term][conversation_id] = document[term]
+            added = sum(terms.values())
+            self._lengths[conversation_id] += added
+            self._total_length += added
+
+    def remove(self, conversation_id):
+        with self._lock:
+            self._message_marks.pop(conversation_id, None)
+            self._unsynced_messages.pop(conversation_id, None)
+            if conversation_id in self._documents:
+                self._replace(conversation_id, None)
+                self._fields.pop(conversation_id, None)
+
+    def search(self, query, k=10, candidate_ids=None):
+        """
+        Rank conversations against a free-text query.
+
+        Returns:
+            list: (conversation_id, bm25_score) tuples, best first
+        """
+        terms = set(tokenize(query))
+        candidates = set(candidate_ids) if candidate_ids is not None else None
+
+        with self._lock:
+            if not self._documents or k <= 0:
+                return []
+            average_length = self._total_length / len(self._documents) or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = self._term_idf(term, len(postings))
+                if idf < self.MIN_IDF:
+                    continue
+                for conversation_id, frequency in postings.items():
+                    if candidates is not None and conversation_id not in candidates:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[conversation_id] / average_length)
+                    scores[conversation_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def load_from_db(self):
+        from .models import Conversation, Message
+
+        started = timezone.now()
+        conversations = (
+            Conversation.objects
+            .values_list('id', 'title', 'summary', 'key_topics')
+            .iterator(chunk_size=2000)
+        )
+        messages = Message.objects.values_list('conversation_id', 'content', 'id').iterator(chunk_size=5000)
+        self.load(conversations, messages)
+        self.mark_synced(started)
+
+    def stored_ids(self):
+        from .models import Conversation
+
+        return Conversation.objects.values_list('id', flat=True)
+
+    def refresh_conversations(self, conversation_ids):
+        """
+        Catch these conversations up with the database: re-read their fields,
+        append messages newer than each document's newest one and drop
+        conversations that no longer exist.
+        """
+        from .models import Conversation, Message
+
+        rows = {
+            conversation_id: fields
+            for conversation_id, *fields in Conversation.objects.filter(id__in=conversation_ids)
+            .values_list('id', 'title', 'summary', 'key_topics')
+        }
+        with self._lock:
+            marks = {conversation_id: self._message_marks.get(conversation_id, 0) for conversation_id in rows}
+
+        unseen = [conversation_id for conversation_id, mark in marks.items() if not mark]
+        newer = Q(conversation_id__in=unseen)
+        for conversation_id, mark in marks.items():
+            if mark:
+                newer |= Q(conversation_id=conversation_id, id__gt=mark)
+        messages = list(
+            Message.objects.filter(newer).order_by('id').values_list('conversation_id', 'content', 'id')
+        ) if rows else []
+
+        with self._lock:
+            for conversation_id in conversation_ids:
+                if conversation_id not in rows:
+                    self.remove(conversation_id)
+                    continue
+                fields = self._field_terms(*rows[conversation_id])
+                if conversation_id not in self._documents or self._fields.get(conversation_id) != fields:
+                    self._set_field_terms(conversation_id, fields)
+            for conversation_id, content, message_id in messages:
+                if message_id <= self._message_marks.get(conversation_id, 0):
+                    continue
+                self._message_marks[conversation_id] = message_id
+                unsynced = self._unsynced_messages.get(conversation_id)
+                if unsynced and message_id in unsynced:
+                    continue
+                self._append(conversation_id, Counter(tokenize(content)))
+            for conversation_id in rows:
+                unsynced = self._unsynced_messages.get(conversation_id)
+                if unsynced:
+                    mark = self._message_marks.get(conversation_id, 0)
+                    unsynced.difference_update([i for i in unsynced if i <= mark])
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load_from_db()
+
+    def _field_terms(self, title, summary, key_topics):
+        return Counter(tokenize(' '.join([title or '', summary or '', ' '.join(key_topics or [])])))
+
+    def _mark(self, conversation_id, message_id):
+        if message_id > self._message_marks.get(conversation_id, 0):
+            self._message_marks[conversation_id] = message_id
+
+    def _boosted(self, fields):
+        return Counter({term: count * self.FIELD_BOOST for term, count in fields.items()})
+
+    def _term_idf(self, term, document_frequency):
+        idf = self._idf.get(term)
+        if idf is None:
+            total = len(self._documents)
+            idf = math.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
+            self._idf[term] = idf
+        return idf
+
+    def _replace(self, conversation_id, document):
+        """Swap a conversation's term counts (None removes it) and fix the postings"""
+        old = self._documents.pop(conversation_id, None)
+        if old is not None:
+            for term in old:
+                postings = self._postings[term]
+                postings.pop(conversation_id, None)
+                if not postings:
+                    del self._postings[term]
+                self._idf.pop(term, None)
+            self._total_length -= self._lengths.pop(conversation_id)
+
+        if document is not None:
+            document = +document
+            self._documents[conversation_id] = document
+            for term, count in document.items():
+                self._postings[term][conversation_id] = count
+                self._idf.pop(term, None)
+            self._lengths[conversation_id] = sum(document.values())
+            self._total_length += self._lengths[conversation_id]
+
+        if (old is None) != (document is None):
+            # The document count changed, so every IDF is stale
+            self._idf.clear()
+
+
+_bm25 = None
+_bm25_lock = threading.Lock()
+
+
+def get_bm25_index():
+    """
+    Return the shared BM25 index, loading it from the database on first use
+    and catching up with other processes' writes every INDEX_SYNC_INTERVAL seconds.
+    """
+    from django.conf import settings
+
+    global _bm25
+    if _bm25 is None:
+        with _bm25_lock:
+            if _bm25 is None:
+                config = settings.AI_CONFIG
+                _bm25 = BM25Index(k1=config.get('BM25_K1', 1.2), b=config.get('BM25_B', 0.75))
+    _bm25.ensure_loaded()
+    _bm25.maybe_sync(settings.AI_CONFIG.get('INDEX_SYNC_INTERVAL', 5))
+    return _bm25
+
+
+def update_bm25_fields(conversation_id, title, summary, key_topics):
+    """Reflect saved conversation fields; a no-op until the index has been loaded"""
+    if _bm25 is not None and _bm25._loaded:
+        _bm25.set_fields(conversation_id, title, summary, key_topics)
+
+
+def reindex_bm25_conversation(conversation_id, full=False):
+    """
+    Re-read one conversation, e.g. after a queryset.update(). Only new
+    messages are appended unless `full`, which rebuilds the document after
+    an existing message changed.
+    """
+    if _bm25 is not None and _bm25._loaded:
+        with _bm25._lock:
+            if full:
+                _bm25.remove(conversation_id)
+            _bm25.refresh_conversations([conversation_id])
+
+
+def add_bm25_message(conversation_id, content, message_id=None):
+    if _bm25 is not None and _bm25._loaded:
+        _bm25.add_message(conversation_id, content, message_id=message_id)
+
+
+def remove_from_bm25_index(conversation_ids):
+    if _bm25 is not None:
+        for conversation_id in conversation_ids:
+            _bm25.remove(conversation_id)
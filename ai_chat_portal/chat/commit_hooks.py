@@ -0,0 +1,40 @@
+from collections import Counter
+
+from django.db import transaction
+
+
+class _Batch:
+    def __init__(self, flush):
+        self.flush = flush
+        self.items = Counter()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        self.flush(self.items)
+
+
+def on_commit_batched(key, items, flush, using=None):
+    """
+    Add items to a batch that is flushed once when the current transaction
+    commits (at once in autocommit mode).
+
+    Signal receivers use this for aggregate bookkeeping: deleting thousands
+    of rows in one transaction then costs one flush(Counter of items) per
+    key instead of one UPDATE per row, and never rewrites the same hot row
+    thousands of times.
+    """
+    connection = transaction.get_connection(using)
+    batches = connection.__dict__.setdefault('_commit_batches', {})
+    batch = batches.get(key)
+    # A batch is reusable while its callback is still queued; a rollback
+    # discards the queue, a commit runs it
+    if batch is not None and not batch.done and any(
+        entry[1] is batch for entry in connection.run_on_commit
+    ):
+        batch.items.update(items)
+        return
+
+    batch = batches[key] = _Batch(flush)
+    batch.items.update(items)
+    transaction.on_commit(batch, using=using)
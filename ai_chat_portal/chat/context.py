@@ -0,0 +1,177 @@
+"""
+Chat context for the next turn of a conversation.
+
+Instead of re-sending the whole transcript, a turn sends the conversation's
+rolling summary followed by the most recent messages that fit the token
+budget. Messages are folded into the summary in batches once they slide out
+of the window, so the DB read (messages not yet folded) and the prompt size
+stay bounded however long the chat gets.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Conversation
+
+logger = logging.getLogger(__name__)
+
+# Summary folds run here so they never add latency to a chat turn
+_fold_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='context-fold')
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), good enough for budgeting"""
+    return len(text) // 4 + 1
+
+
+def build_gemini_history(messages):
+    """Build conversation history in Gemini format"""
+    history = []
+    for msg in messages:
+        role = 'user' if msg.sender == 'user' else 'model'
+        history.append({
+            'role': role,
+            'parts': [msg.content]
+        })
+    return history
+
+
+class ConversationContext:
+    """
+    Sliding window plus rolling summary for one conversation.
+
+        context = ConversationContext(conversation).load(exclude=user_message)
+        history = context.history()
+        ...
+        context.fold_in_background(gemini_service)
+
+    Only messages newer than `context_summarized_until` are read. Once
+    `summary_every` messages have piled up beyond the newest `window`, they
+    are merged into the summary, at most FOLD_BATCH per model call; the
+    cursor only moves past batches that were actually summarized, so a
+    failed or lagging fold is retried on the next turn instead of losing
+    messages. A window of 0 disables all of this and sends the full
+    transcript.
+    """
+
+    FOLD_BATCH = 40
+
+    def __init__(self, conversation, window=None, token_budget=None, summary_every=None):
+        config = settings.AI_CONFIG
+        self.conversation = conversation
+        self.window = config.get('CONTEXT_WINDOW_MESSAGES', 12) if window is None else window
+        self.token_budget = config.get('CONTEXT_TOKEN_BUDGET', 6000) if token_budget is None else token_budget
+        self.summary_every = config.get('CONTEXT_SUMMARY_EVERY', 8) if summary_every is None else summary_every
+        self.messages = []
+
+    def load(self, exclude=None):
+        """Fetch the unsummarized tail of the conversation, oldest first"""
+        messages = self.conversation.messages.only('id', 'conversation', 'sender', 'content', 'timestamp')
+        if exclude is not None:
+            messages = messages.exclude(pk=exclude.pk)
+        if self.window and self.conversation.context_summarized_until:
+            messages = messages.filter(timestamp__gt=self.conversation.context_summarized_until)
+        self.messages = list(messages.order_by('timestamp', 'id'))
+        return self
+
+    def history(self):
+        """Gemini history: rolling summary, then the newest messages within the token budget"""
+        summary = self.conversation.context_summary if self.window else ''
+        used = estimate_tokens(summary) if summary else 0
+
+        kept = []
+        for msg in reversed(self.messages):
+            cost = estimate_tokens(msg.content)
+            if self.window and self.token_budget and kept and used + cost > self.token_budget:
+                break
+            kept.append(msg)
+            used += cost
+        kept.reverse()
+
+        history = []
+        if summary:
+            history.append({'role': 'user', 'parts': [f"Summary of our conversation so far: {summary}"]})
+            history.append({'role': 'model', 'parts': ["Understood, I will keep that in mind."]})
+        return history + build_gemini_history(kept)
+
+    def pending_fold(self):
+        """Messages that have left the window and are due to be summarized"""
+        if not self.window or len(self.messages) < self.window + self.summary_every:
+            return []
+        overflow = self.messages[:-self.window]
+        # The cursor is a timestamp: never stop between messages that share one
+        first_kept = self.messages[-self.window].timestamp
+        while overflow and overflow[-1].timestamp == first_kept:
+            overflow.pop()
+        return overflow
+
+    def fold_batches(self):
+        """
+        pending_fold() split into (message dicts, timestamp of the last one)
+        batches of about FOLD_BATCH messages, oldest first
+        """
+        batches = []
+        batch = []
+        for msg in self.pending_fold():
+            if len(batch) >= self.FOLD_BATCH and msg.timestamp != batch[-1].timestamp:
+                batches.append(batch)
+                batch = []
+            batch.append(msg)
+        if batch:
+            batches.append(batch)
+        return [
+            ([{'sender': msg.sender, 'content': msg.content} for msg in batch], batch[-1].timestamp)
+            for batch in batches
+        ]
+
+    def fold_in_background(self, service):
+        """
+        Merge the messages that left the window into the rolling summary.
+
+        Returns:
+            Future or None: None when no fold is due
+        """
+        batches = self.fold_batches()
+        if not batches:
+            return None
+        return _fold_pool.submit(
+            _fold,
+            self.conversation.pk,
+            self.conversation.context_summary,
+            self.conversation.context_summarized_until,
+            batches,
+            service
+        )
+
+
+def _fold(conversation_id, summary, summarized_until, batches, service):
+    """
+    Fold the batches in order, saving summary and cursor after each one.
+    Stops at the first failure, leaving the rest for the next turn.
+
+    Returns:
+        str or None: The new summary, None if nothing was folded
+    """
+    folded = 0
+    try:
+        for messages, until in batches:
+            new_summary = service.update_rolling_summary(summary, messages)
+            # Only applies if no other fold moved the cursor in the meantime
+            updated = Conversation.objects.filter(
+                pk=conversation_id,
+                context_summarized_until=summarized_until
+            ).update(context_summary=new_summary, context_summarized_until=until)
+            if not updated:
+                break
+            summary, summarized_until = new_summary, until
+            folded += len(messages)
+    except Exception as e:
+        logger.error(f"Failed to update context summary: {str(e)}")
+    finally:
+        close_old_connections()
+    if not folded:
+        return None
+    logger.info(f"Folded {folded} messages into context summary of conversation {conversation_id}")
+    return summary
@@ -0,0 +1,285 @@
+import threading
+import logging
+import numpy as np
+from django.utils import timezone
+
+from .index_sync import DatabaseSyncMixin
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex(DatabaseSyncMixin):
+    """
+    Common interface for conversation embedding search backends.
+
+    Subclasses implement load(), upsert(), remove(), search() and
+    indexed_ids(); this base takes care of the lock, of lazily loading from
+    the database and of catching up with writes from other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._init_sync()
+
+    def load(self, rows):
+        raise NotImplementedError
+
+    def upsert(self, conversation_id, embedding):
+        raise NotImplementedError
+
+    def remove(self, conversation_id):
+        raise NotImplementedError
+
+    def search(self, query_embedding, k=10, candidate_ids=None):
+        raise NotImplementedError
+
+    def indexed_ids(self):
+        raise NotImplementedError
+
+    def load_from_db(self):
+        """Build the index from every stored conversation embedding"""
+        from .models import Conversation
+
+        started = timezone.now()
+        rows = (
+            Conversation.objects
+            .filter(embedding_vector__isnull=False)
+            .values_list('id', 'embedding_vector')
+            .iterator(chunk_size=2000)
+        )
+        self.load(rows)
+        self.mark_synced(started)
+
+    def stored_ids(self):
+        from .models import Conversation
+
+        return Conversation.objects.filter(embedding_vector__isnull=False).values_list('id', flat=True)
+
+    def refresh_conversations(self, conversation_ids):
+        """Re-read the embeddings of these conversations (deleted or cleared ones are dropped)"""
+        from .models import Conversation
+
+        rows = dict(Conversation.objects.filter(id__in=conversation_ids).values_list('id', 'embedding_vector'))
+        for conversation_id in conversation_ids:
+            embedding = rows.get(conversation_id)
+            if embedding is not None and len(embedding):
+                self.upsert(conversation_id, embedding)
+            else:
+                self.remove(conversation_id)
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load_from_db()
+
+
+class EmbeddingIndex(VectorIndex):
+    """
+    Exact in-memory index of conversation embeddings.
+
+    Vectors are kept in one contiguous float32 matrix (already normalized,
+    so a dot product is the cosine similarity) alongside an id array.
+    Rows are appended into spare capacity and removed by swapping with the
+    last row, so incremental updates never rebuild the matrix.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self):
+        super().__init__()
+        self._matrix = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._positions = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def indexed_ids(self):
+        return set(self._positions)
+
+    @property
+    def dimension(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    def load(self, rows):
+        """
+        Replace the index contents with (conversation_id, embedding) pairs.
+        """
+        with self._lock:
+            self._matrix = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._positions = {}
+            self._size = 0
+            for conversation_id, embedding in rows:
+                self._upsert(conversation_id, embedding)
+            self._loaded = True
+            logger.info(f"Loaded {self._size} embeddings into search index")
+
+    def upsert(self, conversation_id, embedding):
+        """Insert or replace the vector stored for a conversation"""
+        with self._lock:
+            self._upsert(conversation_id, embedding)
+
+    def remove(self, conversation_id):
+        """Drop a conversation from the index, if present"""
+        with self._lock:
+            row = self._positions.pop(conversation_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                moved_id = int(self._ids[last])
+                self._ids[row] = moved_id
+                self._positions[moved_id] = row
+            self._size = last
+
+    def search(self, query_embedding, k=10, candidate_ids=None):
+        """
+        Rank indexed conversations against a normalized query vector.
+
+        Args:
+            query_embedding: Normalized query vector
+            k (int): Number of results to return
+            candidate_ids: Optional iterable restricting results to these ids
+
+        Returns:
+            list: (conversation_id, similarity_score) tuples, best first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return []
+            if query.shape[0] != self._matrix.shape[1]:
+                logger.warning(
+                    f"Query dimension {query.shape[0]} does not match index "
+                    f"dimension {self._matrix.shape[1]}"
+                )
+                return []
+
+            scores = self._matrix[:self._size] @ query
+            ids = self._ids[:self._size]
+
+            if candidate_ids is not None:
+                candidates = np.fromiter(candidate_ids, dtype=np.int64)
+                mask = np.isin(ids, candidates)
+                scores = scores[mask]
+                ids = ids[mask]
+
+            return self._top_k(ids, scores, k)
+
+    @staticmethod
+    def _top_k(ids, scores, k):
+        if scores.shape[0] == 0:
+            return []
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def _upsert(self, conversation_id, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.ndim != 1 or vector.shape[0] == 0:
+            return
+
+        if self._matrix is None:
+            self._matrix = np.empty(
+                (self.INITIAL_CAPACITY, vector.shape[0]), dtype=np.float32
+            )
+            self._ids = np.empty(self.INITIAL_CAPACITY, dtype=np.int64)
+        elif vector.shape[0] != self._matrix.shape[1]:
+            logger.warning(
+                f"Skipping embedding for conversation {conversation_id}: "
+                f"dimension {vector.shape[0]} != {self._matrix.shape[1]}"
+            )
+            return
+
+        row = self._positions.get(conversation_id)
+        if row is None:
+            if self._size == self._matrix.shape[0]:
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._ids[row] = conversation_id
+            self._positions[conversation_id] = row
+        self._matrix[row] = vector
+
+    def _grow(self):
+        capacity = self._matrix.shape[0] * 2
+        matrix = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix = matrix
+        self._ids = ids
+
+
+def create_index(backend=None):
+    """
+    Instantiate the search backend named by AI_CONFIG['SEARCH_BACKEND'].
+    'exact' scans every vector; 'ivfpq' is the approximate IVF-PQ index.
+    """
+    from django.conf import settings
+
+    config = settings.AI_CONFIG
+    backend = backend or config.get('SEARCH_BACKEND', 'exact')
+    if backend == 'exact':
+        return EmbeddingIndex()
+    if backend == 'ivfpq':
+        from .ann_index import IVFPQIndex
+        return IVFPQIndex(
+            nlist=config.get('ANN_NLIST', 256),
+            m=config.get('ANN_M', 16),
+            nprobe=config.get('ANN_NPROBE', 8),
+            rerank=config.get('ANN_RERANK', 10),
+            path=config.get('ANN_INDEX_PATH') or None,
+            retrain_growth=config.get('ANN_RETRAIN_GROWTH', 4),
+        )
+    raise ValueError(f"Unknown search backend: {backend}")
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_embedding_index():
+    """
+    Return the shared index, loading it from the database on first use and
+    catching up with other processes' writes every INDEX_SYNC_INTERVAL seconds.
+    """
+    from django.conf import settings
+
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = create_index()
+    _index.ensure_loaded()
+    _index.maybe_sync(settings.AI_CONFIG.get('INDEX_SYNC_INTERVAL', 5))
+    return _index
+
+
+def update_embedding_index(conversation_id, embedding):
+    """
+    Reflect a stored embedding in the shared index; called once the write
+    has committed. A no-op until the index has been loaded; the initial
+    load reads the DB.
+    """
+    if _index is not None and _index._loaded:
+        if embedding is not None and len(embedding):
+            _index.upsert(conversation_id, embedding)
+        else:
+            _index.remove(conversation_id)
+
+
+def remove_from_embedding_index(conversation_ids):
+    """Drop deleted conversations from the shared index"""
+    if _index is not None:
+        for conversation_id in conversation_ids:
+            _index.remove(conversation_id)
@@ -1,26 +1,164 @@
 import google.generativeai as genai
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.core.cache import cache
 import logging
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import asyncio
+import contextvars
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+
+from .answer_cache import get_answer_cache
+from .context import estimate_tokens
+from .embedding_index import get_embedding_index
+from .gemini_client import get_model
+from .metrics import instrument, record_tokens
+from .llm_cache import get_llm_cache, make_key, normalize_text
+from .search import rank_conversation_ids, reciprocal_rank_fusion
+from .bm25 import get_bm25_index
+from .models import Conversation
 
 logger = logging.getLogger(__name__)
 
+# Shared by all service instances so fan-out never spawns threads per request
+_fanout_pool = ThreadPoolExecutor(
+    max_workers=settings.AI_CONFIG.get('FANOUT_WORKERS', 16),
+    thread_name_prefix='ai-fanout'
+)
+
+# Chunk summaries of long conversations; separate so a summary running on the
+# fan-out pool never waits for its own chunks to get a fan-out worker
+_summary_pool = ThreadPoolExecutor(
+    max_workers=settings.AI_CONFIG.get('SUMMARY_WORKERS', 8),
+    thread_name_prefix='ai-summary'
+)
+
+
+
+class RateLimiter:
+    """Spaces calls evenly so that at most `per_minute` start in any minute"""
+    
+    def __init__(self, per_minute=None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        time.sleep(slot - now)
+
 
+@instrument
 class EnhancedAIService:
     """
     Enhanced AI Service with semantic search, caching, and advanced analytics.
     Optimized for conversation intelligence and query performance.
     """
     
-    def __init__(self):
-        """Initialize Gemini API with settings"""
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
+    def __init__(self, model=None, embedder=None):
+        """
+        Uses the process-wide Gemini model (chat.gemini_client) by default.
+        A ready-made model (e.g. FakeGenerativeModel) and an embedder with
+        embed(texts) / aembed(texts) can be injected to run offline.
+        """
+        if model is None:
+            model = get_model()
+        self.model = model
+        self.embedder = embedder
         self.config = settings.AI_CONFIG
-        self.cache_timeout = 3600  # 1 hour cache
+        self.cache = get_llm_cache()
+        self.cache_timeout = self.config.get('LLM_CACHE_TTL', 3600)
+        self.answer_cache = get_answer_cache()
+        self.answer_cache_enabled = self.config.get('ANSWER_CACHE', True)
+    
+    def run_concurrently(self, calls, timeout=None, executor=None):
+        """
+        Run independent model calls in parallel under one shared deadline.
+        
+        Args:
+            calls (dict): name -> (callable, *args)
+            timeout (float): Seconds for the whole batch; defaults to
+                AI_CONFIG['LLM_DEADLINE']
+            executor: Thread pool to run on; defaults to the shared fan-out pool
+        
+        Returns:
+            dict: name -> result, or None for calls that missed the deadline
+        """
+        timeout = self.config.get('LLM_DEADLINE') if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        executor = executor or _fanout_pool
+        futures = {
+            # Each call sees the request's context (e.g. its Server-Timing record)
+            name: executor.submit(contextvars.copy_context().run, func, *args)
+            for name, (func, *args) in calls.items()
+        }
+        
+        results = {}
+        for name, future in futures.items():
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FuturesTimeout:
+                future.cancel()
+                logger.warning(f"{name} missed the {timeout}s deadline")
+                results[name] = None
+        return results
+    
+    async def arun_concurrently(self, calls, timeout=None):
+        """Async variant of run_concurrently; calls map name -> (coroutine function, *args)"""
+        timeout = self.config.get('LLM_DEADLINE') if timeout is None else timeout
+        tasks = {
+            name: asyncio.ensure_future(func(*args))
+            for name, (func, *args) in calls.items()
+        }
+        await asyncio.wait(tasks.values(), timeout=timeout or None)
+        
+        results = {}
+        for name, task in tasks.items():
+            if task.done():
+                results[name] = task.result()
+            else:
+                task.cancel()
+                logger.warning(f"{name} missed the {timeout}s deadline")
+                results[name] = None
+        return results
+    
+    def analyze_conversation(self, messages, timeout=None):
+        """
+        Summary and embedding for an ended conversation, generated concurrently.
+        
+        Returns:
+            tuple: (analysis dict, embedding list or None)
+        """
+        results = self.run_concurrently({
+            'summary': (self.generate_conversation_summary, messages),
+            'embedding': (self.generate_embedding, self._conversation_text(messages)),
+        }, timeout=timeout)
+        return self._analysis_result(results)
+    
+    async def aanalyze_conversation(self, messages, timeout=None):
+        """Async variant of analyze_conversation"""
+        results = await self.arun_concurrently({
+            'summary': (self.agenerate_conversation_summary, messages),
+            'embedding': (self.agenerate_embedding, self._conversation_text(messages)),
+        }, timeout=timeout)
+        return self._analysis_result(results)
+    
+    def _conversation_text(self, messages):
+        return "\n".join([msg['content'] for msg in messages])
+    
+    def _analysis_result(self, results):
+        # A missing embedding is tolerated (it can be backfilled), a missing summary is not
+        if results['summary'] is None:
+            raise TimeoutError("Conversation summary missed the deadline")
+        return results['summary'], results['embedding']
     
     def generate_chat_response(self, user_message, conversation_history=None):
         """
@@ -28,90 +166,440 @@ class EnhancedAIService:
         """
         try:
             # Build cache key for repeated queries
-            cache_key = f"chat_response_{hash(user_message + str(conversation_history))}"
-            cached_response = cache.get(cache_key)
+            cache_key = self._chat_cache_key(user_message, conversation_history)
+            cached_response = self.cache.get(cache_key)
 
-            if cached_response:
+            if cached_response is not None:
                 logger.info("Returning cached chat response")
                 return cached_response
 
             # Generate response
-            if conversation_history:
-                chat = self.model.start_chat(history=conversation_history)
-                response = chat.send_message(
-                    user_message,
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=self.config['MAX_TOKENS'],
-                        temperature=self.config['TEMPERATURE'],
-                        top_p=self.config['TOP_P'],
-                    )
-                )
-            else:
-                response = self.model.generate_content(
-                    user_message,
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=self.config['MAX_TOKENS'],
-                        temperature=self.config['TEMPERATURE'],
-                        top_p=self.config['TOP_P'],
-                    )
-                )
+            response = self._send_chat(user_message, conversation_history)
+            result = self._chat_result(response)
+
+            # Cache the response
+            self.cache.set(cache_key, result, self.cache_timeout)
+            return result
+
+        except Exception as e:
+            logger.error(f"Error generating chat response: {str(e)}")
+            raise Exception(f"Failed to generate AI response: {str(e)}")
+    
+    async def agenerate_chat_response(self, user_message, conversation_history=None):
+        """
+        Async variant of generate_chat_response; awaits the model call
+        instead of blocking a worker thread.
+        """
+        try:
+            cache_key = self._chat_cache_key(user_message, conversation_history)
+            cached_response = await self.cache.aget(cache_key)
 
-            # ✅ Unified text extraction logic
-            response_text = ""
+            if cached_response is not None:
+                logger.info("Returning cached chat response")
+                return cached_response
 
-            # Case 1: Simple text
-            if hasattr(response, "text") and isinstance(response.text, str):
-                response_text = response.text.strip()
+            response = await self._asend_chat(user_message, conversation_history)
+            result = self._chat_result(response)
 
-            # Case 2: Multiple parts
-            elif hasattr(response, "parts") and response.parts:
-                texts = [p.text for p in response.parts if hasattr(p, "text")]
-                response_text = " ".join(texts).strip()
+            await self.cache.aset(cache_key, result, self.cache_timeout)
+            return result
 
-            # Case 3: Candidates
-            elif hasattr(response, "candidates") and response.candidates:
-                parts = response.candidates[0].content.parts
-                texts = [p.text for p in parts if hasattr(p, "text")]
-                response_text = " ".join(texts).strip()
+        except Exception as e:
+            logger.error(f"Error generating chat response: {str(e)}")
+            raise Exception(f"Failed to generate AI response: {str(e)}")
+    
+    def _chat_cache_key(self, user_message, conversation_history):
+        history = [
+            {'role': turn['role'], 'parts': [normalize_text(part) for part in turn['parts']]}
+            for turn in conversation_history or []
+        ]
+        return make_key(
+            'chat',
+            self.model_name,
+            {key: self.config[key] for key in ('MAX_TOKENS', 'TEMPERATURE', 'TOP_P')},
+            {'message': normalize_text(user_message), 'history': history}
+        )
+    
+    @property
+    def model_name(self):
+        return getattr(self.model, 'model_name', type(self.model).__name__)
+    
+    def _chat_result(self, response):
+        """Extract response text and token usage from a chat response"""
+        # ✅ Unified text extraction logic
+        response_text = ""
 
-            else:
-                response_text = "No textual response received."
+        # Case 1: Simple text
+        if hasattr(response, "text") and isinstance(response.text, str):
+            response_text = response.text.strip()
 
-            # ✅ Safe token usage extraction
-            usage_data = getattr(response, 'usage_metadata', None)
-            total_tokens = 0
-            if usage_data:
-                total_tokens = getattr(usage_data, 'total_token_count', 0) or usage_data.get('total_token_count', 0)
+        # Case 2: Multiple parts
+        elif hasattr(response, "parts") and response.parts:
+            texts = [p.text for p in response.parts if hasattr(p, "text")]
+            response_text = " ".join(texts).strip()
 
-            result = {
-                'response': response_text,
-                'tokens_used': total_tokens
-            }
+        # Case 3: Candidates
+        elif hasattr(response, "candidates") and response.candidates:
+            parts = response.candidates[0].content.parts
+            texts = [p.text for p in parts if hasattr(p, "text")]
+            response_text = " ".join(texts).strip()
 
-            # Cache the response
-            cache.set(cache_key, result, self.cache_timeout)
-            logger.info(f"Generated response with {total_tokens} tokens")
+        else:
+            response_text = "No textual response received."
 
-            return result
+        total_tokens = self._record_usage(response)
+        logger.info(f"Generated response with {total_tokens} tokens")
 
+        return {
+            'response': response_text,
+            'tokens_used': total_tokens
+        }
+    
+    def stream_chat_response(self, user_message, conversation_history=None):
+        """
+        Stream an AI response as the model produces it.
+        
+        Yields:
+            dict: {'type': 'chunk', 'text': ...} per model chunk, then
+                  {'type': 'done', 'response': full_text, 'tokens_used': n}
+        """
+        try:
+            response = self._send_chat(user_message, conversation_history, stream=True)
+            
+            parts = []
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except (AttributeError, ValueError):
+                    # Chunks without text parts (e.g. safety metadata)
+                    continue
+                if text:
+                    parts.append(text)
+                    yield {'type': 'chunk', 'text': text}
+            
+            total_tokens = self._record_usage(response)
+            logger.info(f"Streamed response with {total_tokens} tokens")
+            yield {
+                'type': 'done',
+                'response': "".join(parts).strip() or "No textual response received.",
+                'tokens_used': total_tokens
+            }
+        
         except Exception as e:
-            logger.error(f"Error generating chat response: {str(e)}")
+            logger.error(f"Error streaming chat response: {str(e)}")
             raise Exception(f"Failed to generate AI response: {str(e)}")
+    
+    def _send_chat(self, user_message, conversation_history=None, stream=False):
+        """Send a message to Gemini, continuing the chat when history exists"""
+        generation_config = genai.types.GenerationConfig(
+            max_output_tokens=self.config['MAX_TOKENS'],
+            temperature=self.config['TEMPERATURE'],
+            top_p=self.config['TOP_P'],
+        )
+        if conversation_history:
+            chat = self.model.start_chat(history=conversation_history)
+            return chat.send_message(
+                user_message,
+                generation_config=generation_config,
+                stream=stream
+            )
+        return self.model.generate_content(
+            user_message,
+            generation_config=generation_config,
+            stream=stream
+        )
+    
+    async def _asend_chat(self, user_message, conversation_history=None):
+        """Async _send_chat using the client's native async methods when available"""
+        if not hasattr(self.model, 'generate_content_async'):
+            return await asyncio.to_thread(self._send_chat, user_message, conversation_history)
+        
+        generation_config = genai.types.GenerationConfig(
+            max_output_tokens=self.config['MAX_TOKENS'],
+            temperature=self.config['TEMPERATURE'],
+            top_p=self.config['TOP_P'],
+        )
+        if conversation_history:
+            chat = self.model.start_chat(history=conversation_history)
+            return await chat.send_message_async(user_message, generation_config=generation_config)
+        return await self.model.generate_content_async(user_message, generation_config=generation_config)
+    
+    def _extract_tokens(self, response):
+        """Safe token usage extraction"""
+        usage_data = getattr(response, 'usage_metadata', None)
+        if not usage_data:
+            return 0
+        if isinstance(usage_data, dict):
+            return usage_data.get('total_token_count', 0) or 0
+        return getattr(usage_data, 'total_token_count', 0) or 0
+    
+    def _record_usage(self, response):
+        """Count a response's tokens in the metrics; returns the count"""
+        tokens = self._extract_tokens(response)
+        record_tokens(tokens, self.model_name)
+        return tokens
         
     def generate_conversation_summary(self, messages):
         """
         Generate comprehensive conversation analysis with enhanced extraction.
         
+        Transcripts longer than AI_CONFIG['CHUNK_SIZE'] tokens are analysed
+        map-reduce style: the chunks are summarized concurrently, then their
+        topics, action items and sentiment are merged and one more call
+        condenses the chunk summaries. Chunk analyses are cached, so
+        re-analysing a conversation only sends the chunks that changed.
+        
         Args:
             messages (list): List of message dicts
         
         Returns:
             dict: Complete analysis with summary, topics, actions, sentiment
         """
+        chunks = self._chunk_transcript(messages)
+        if len(chunks) == 1:
+            analyses = [self._summarize_chunk(chunks[0])]
+        else:
+            results = self.run_concurrently(
+                {index: (self._summarize_chunk, chunk) for index, chunk in enumerate(chunks)},
+                executor=_summary_pool
+            )
+            analyses = [results[index] for index in range(len(chunks))]
+        
+        parts = [(analysis, chunk) for analysis, chunk in zip(analyses, chunks) if analysis is not None]
+        if not parts:
+            return self._fallback_analysis(messages)
+        if len(chunks) == 1:
+            return parts[0][0]
+        
+        analysis = self._merge_analyses(parts)
+        analysis.update(self._combine_summaries([part for part, _ in parts]))
+        return analysis
+    
+    async def agenerate_conversation_summary(self, messages):
+        """Async variant of generate_conversation_summary"""
+        chunks = self._chunk_transcript(messages)
+        if len(chunks) == 1:
+            analyses = [await self._asummarize_chunk(chunks[0])]
+        else:
+            results = await self.arun_concurrently(
+                {index: (self._asummarize_chunk, chunk) for index, chunk in enumerate(chunks)}
+            )
+            analyses = [results[index] for index in range(len(chunks))]
+        
+        parts = [(analysis, chunk) for analysis, chunk in zip(analyses, chunks) if analysis is not None]
+        if not parts:
+            return self._fallback_analysis(messages)
+        if len(chunks) == 1:
+            return parts[0][0]
+        
+        analysis = self._merge_analyses(parts)
+        analysis.update(await self._acombine_summaries([part for part, _ in parts]))
+        return analysis
+    
+    SUMMARY_GENERATION = {'temperature': 0.2}  # Lower for consistency
+    SUMMARY_LIST_LIMIT = 10  # Merged action items, insights, questions and decisions
+    SUMMARY_TOPIC_LIMIT = 5
+    MIXED_SENTIMENT_SHARE = 0.25  # Positive and negative both above this share of the transcript
+    
+    def _chunk_transcript(self, messages):
+        """
+        Formatted transcript split into chunks of at most CHUNK_SIZE tokens.
+        
+        Chunks end on message boundaries (a longer message is split on its
+        own) and are filled greedily from the start, so appending messages
+        leaves every chunk but the last one unchanged, and cached.
+        """
+        limit = self.config.get('CHUNK_SIZE', 1000)
+        chunks, current, current_tokens = [], [], 0
+        for msg in messages:
+            for piece in self._split_text(self._format_message(msg), limit):
+                tokens = estimate_tokens(piece)
+                if current and current_tokens + tokens > limit:
+                    chunks.append("\n\n".join(current))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        chunks.append("\n\n".join(current))
+        return chunks
+    
+    def _split_text(self, text, limit):
+        """Pieces of at most `limit` estimated tokens, cut on whitespace when possible"""
+        size = max(limit - 1, 1) * 4
+        pieces = []
+        while len(text) > size:
+            cut = text.rfind(' ', 0, size)
+            if cut <= 0:
+                cut = size
+            pieces.append(text[:cut])
+            text = text[cut:].lstrip()
+        pieces.append(text)
+        return pieces
+    
+    def _summary_cache_key(self, kind, payload):
+        return make_key(kind, self.model_name, self.SUMMARY_GENERATION, payload)
+    
+    def _summarize_chunk(self, conversation_text):
+        """Analysis of one chunk (cached), or None when the model call or its JSON failed"""
+        cache_key = self._summary_cache_key('summary', conversation_text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
         try:
-            conversation_text = self._format_messages_for_analysis(messages)
-            
-            prompt = f"""Analyze this conversation thoroughly and provide detailed insights:
+            response = self.model.generate_content(
+                self._summary_prompt(conversation_text),
+                generation_config=genai.types.GenerationConfig(**self.SUMMARY_GENERATION)
+            )
+            self._record_usage(response)
+            analysis = self._parse_analysis(response.text)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON parse error: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"Error in summary generation: {str(e)}")
+            return None
+        self.cache.set(cache_key, analysis, self.cache_timeout * 24)
+        return analysis
+    
+    async def _asummarize_chunk(self, conversation_text):
+        cache_key = self._summary_cache_key('summary', conversation_text)
+        cached = await self.cache.aget(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            response = await self._agenerate_content(self._summary_prompt(conversation_text))
+            self._record_usage(response)
+            analysis = self._parse_analysis(response.text)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON parse error: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"Error in summary generation: {str(e)}")
+            return None
+        await self.cache.aset(cache_key, analysis, self.cache_timeout * 24)
+        return analysis
+    
+    async def _agenerate_content(self, prompt):
+        generation_config = genai.types.GenerationConfig(**self.SUMMARY_GENERATION)
+        if hasattr(self.model, 'generate_content_async'):
+            return await self.model.generate_content_async(prompt, generation_config=generation_config)
+        return await asyncio.to_thread(
+            self.model.generate_content, prompt, generation_config=generation_config
+        )
+    
+    def _merge_analyses(self, parts):
+        """
+        Reduce step for (analysis, chunk text) pairs, in transcript order.
+        
+        Topics are ranked by the share of the transcript that mentions them,
+        list fields are concatenated without duplicates, and the sentiment is
+        weighted by chunk length: 'mixed' when both positive and negative
+        passages are substantial.
+        """
+        weights = [estimate_tokens(chunk) for _, chunk in parts]
+        analyses = [analysis for analysis, _ in parts]
+        
+        topic_weights, topic_names = {}, {}
+        for analysis, weight in zip(analyses, weights):
+            for topic in analysis.get('key_topics') or []:
+                key = normalize_text(topic).lower()
+                if key:
+                    topic_names.setdefault(key, topic)
+                    topic_weights[key] = topic_weights.get(key, 0) + weight
+        # sorted() is stable: equally weighted topics keep their first appearance order
+        ranked = sorted(topic_weights, key=topic_weights.get, reverse=True)
+        
+        merged = {
+            'key_topics': [topic_names[key] for key in ranked[:self.SUMMARY_TOPIC_LIMIT]],
+            'sentiment': self._merge_sentiment(analyses, weights),
+        }
+        for field in ('action_items', 'key_insights', 'questions_asked', 'decisions_made'):
+            seen, items = set(), []
+            for analysis in analyses:
+                for item in analysis.get(field) or []:
+                    key = normalize_text(item).lower()
+                    if key and key not in seen:
+                        seen.add(key)
+                        items.append(item)
+            merged[field] = items[:self.SUMMARY_LIST_LIMIT]
+        return merged
+    
+    def _merge_sentiment(self, analyses, weights):
+        totals = {}
+        for analysis, weight in zip(analyses, weights):
+            sentiment = str(analysis.get('sentiment') or 'neutral').lower()
+            totals[sentiment] = totals.get(sentiment, 0) + weight
+        
+        total = sum(totals.values())
+        positive = totals.get('positive', 0) + totals.get('mixed', 0) / 2
+        negative = totals.get('negative', 0) + totals.get('mixed', 0) / 2
+        if min(positive, negative) >= self.MIXED_SENTIMENT_SHARE * total:
+            return 'mixed'
+        return max(totals, key=totals.get)
+    
+    def _combine_summaries(self, analyses):
+        """Overall summary and main intent condensed from the chunk summaries"""
+        summaries = [analysis.get('summary', '') for analysis in analyses]
+        cache_key = self._summary_cache_key('summary_reduce', summaries)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            response = self.model.generate_content(
+                self._combine_prompt(summaries),
+                generation_config=genai.types.GenerationConfig(**self.SUMMARY_GENERATION)
+            )
+            self._record_usage(response)
+            combined = self._parse_combined(response.text)
+        except Exception as e:
+            logger.error(f"Error combining chunk summaries: {str(e)}")
+            return self._joined_summaries(analyses)
+        self.cache.set(cache_key, combined, self.cache_timeout * 24)
+        return combined
+    
+    async def _acombine_summaries(self, analyses):
+        summaries = [analysis.get('summary', '') for analysis in analyses]
+        cache_key = self._summary_cache_key('summary_reduce', summaries)
+        cached = await self.cache.aget(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            response = await self._agenerate_content(self._combine_prompt(summaries))
+            self._record_usage(response)
+            combined = self._parse_combined(response.text)
+        except Exception as e:
+            logger.error(f"Error combining chunk summaries: {str(e)}")
+            return self._joined_summaries(analyses)
+        await self.cache.aset(cache_key, combined, self.cache_timeout * 24)
+        return combined
+    
+    def _combine_prompt(self, summaries):
+        parts = "\n".join(f"{number}. {summary}" for number, summary in enumerate(summaries, 1))
+        return f"""These are summaries of consecutive parts of one conversation:
+
+{parts}
+
+Provide the analysis of the whole conversation in JSON format:
+{{
+    "summary": "2-3 sentence summary capturing the essence",
+    "main_intent": "primary purpose of the conversation"
+}}"""
+    
+    def _parse_combined(self, response_text):
+        combined = self._parse_analysis(response_text)
+        return {'summary': combined['summary'], 'main_intent': combined.get('main_intent', '')}
+    
+    def _joined_summaries(self, analyses):
+        """Reduce fallback: the chunk summaries back to back"""
+        return {
+            'summary': ' '.join(analysis.get('summary', '') for analysis in analyses).strip(),
+            'main_intent': analyses[0].get('main_intent', ''),
+        }
+    
+    def _build_summary_prompt(self, messages):
+        return self._summary_prompt(self._format_messages_for_analysis(messages))
+    
+    def _summary_prompt(self, conversation_text):
+        return f"""Analyze this conversation thoroughly and provide detailed insights:
 
 Conversation:
 {conversation_text}
@@ -129,39 +617,59 @@ Provide a comprehensive analysis in JSON format:
 }}
 
 Be specific and extract actual content from the conversation."""
+    
+    def _parse_analysis(self, response_text):
+        """Parse the JSON analysis out of a model reply"""
+        response_text = response_text.strip()
+        
+        if '```json' in response_text:
+            response_text = response_text.split('```json')[1].split('```')[0].strip()
+        elif '```' in response_text:
+            response_text = response_text.split('```')[1].split('```')[0].strip()
+        
+        analysis = json.loads(response_text)
+        
+        # Ensure all required fields exist
+        analysis.setdefault('summary', 'No summary available')
+        analysis.setdefault('key_topics', [])
+        analysis.setdefault('action_items', [])
+        analysis.setdefault('sentiment', 'neutral')
+        
+        logger.info("Generated enhanced conversation analysis")
+        return analysis
+    
+    def update_rolling_summary(self, previous_summary, messages):
+        """
+        Fold messages that left the chat context window into the running summary.
+        
+        Args:
+            previous_summary (str): Current summary, may be empty
+            messages (list): Message dicts, oldest first
+        
+        Returns:
+            str: Updated summary
+        """
+        prompt = f"""Maintain a running summary of a conversation between a user and an AI assistant.
 
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.2,  # Lower for consistency
-                )
+Current summary:
+{previous_summary or "(none yet)"}
+
+New messages:
+{self._format_messages_for_analysis(messages)}
+
+Rewrite the summary to include the new messages. Keep facts, names, numbers,
+decisions and open questions the assistant may need later. Max 200 words.
+
+Summary:"""
+        response = self.model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                temperature=0.2,
+                max_output_tokens=400,
             )
-            
-            # Parse JSON response
-            response_text = response.text.strip()
-            
-            if '```json' in response_text:
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                response_text = response_text.split('```')[1].split('```')[0].strip()
-            
-            analysis = json.loads(response_text)
-            
-            # Ensure all required fields exist
-            analysis.setdefault('summary', 'No summary available')
-            analysis.setdefault('key_topics', [])
-            analysis.setdefault('action_items', [])
-            analysis.setdefault('sentiment', 'neutral')
-            
-            logger.info("Generated enhanced conversation analysis")
-            return analysis
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parse error: {str(e)}")
-            return self._fallback_analysis(messages)
-        except Exception as e:
-            logger.error(f"Error in summary generation: {str(e)}")
-            return self._fallback_analysis(messages)
+        )
+        self._record_usage(response)
+        return response.text.strip()
     
     def generate_embedding(self, text):
         """
@@ -169,46 +677,319 @@ Be specific and extract actual content from the conversation."""
         """
         try:
             # Check cache first
-            cache_key = f"embedding_{hash(text[:100])}"
-            cached_embedding = cache.get(cache_key)
-            if cached_embedding:
+            cache_key = self._embedding_cache_key(text)
+            cached_embedding = self.cache.get(cache_key)
+            if cached_embedding is not None:
                 return cached_embedding
 
-            # Use correct top-level call for Gemini embeddings
-            result = genai.embed_content(
-                model="gemini-embedding-001",          # Correct embedding model
-                contents=[text],                        # Must be a list
-                config=genai.types.EmbedContentConfig(
-                    task_type="RETRIEVAL_DOCUMENT",
-                    output_dimensionality=768           # Optional, recommended
-                )
-            )
+            embedding_list = self._normalize(self._embed_texts([text])[0])
+
+            # Cache the embedding for 24 hours
+            self.cache.set(cache_key, embedding_list, self.cache_timeout * 24)
+            return embedding_list
 
-            # Extract embedding vector
-            embedding_obj = result.embeddings[0]       # First item
-            embedding_values = np.array(embedding_obj.values, dtype=float)
+        except Exception as e:
+            logger.error(f"Error generating embedding: {e}")
+            return None
+    
+    async def agenerate_embedding(self, text):
+        """Async variant of generate_embedding"""
+        try:
+            cache_key = self._embedding_cache_key(text)
+            cached_embedding = await self.cache.aget(cache_key)
+            if cached_embedding is not None:
+                return cached_embedding
 
-            # Normalize for cosine similarity
-            embedding_values = embedding_values / np.linalg.norm(embedding_values)
-            embedding_list = embedding_values.tolist()
+            if self.embedder is not None and hasattr(self.embedder, 'aembed'):
+                vectors = await self.embedder.aembed([text])
+            else:
+                vectors = await asyncio.to_thread(self._embed_texts, [text])
+            embedding_list = self._normalize(vectors[0])
 
-            # Cache the embedding for 24 hours
-            cache.set(cache_key, embedding_list, self.cache_timeout * 24)
+            await self.cache.aset(cache_key, embedding_list, self.cache_timeout * 24)
             return embedding_list
 
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             return None
     
+    def generate_embeddings(self, texts, batch_size=None, concurrency=None, requests_per_minute=None):
+        """
+        Embed many texts with batched, concurrent requests.
+        
+        Cached vectors are reused, identical texts are embedded once and new
+        vectors are added to the cache. Defaults come from AI_CONFIG
+        (EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_REQUESTS_PER_MINUTE).
+        
+        Returns:
+            list: One normalized embedding per text, None where its batch failed
+        """
+        batch_size = batch_size or self.config.get('EMBED_BATCH_SIZE', 100)
+        concurrency = concurrency or self.config.get('EMBED_CONCURRENCY', 4)
+        if requests_per_minute is None:
+            requests_per_minute = self.config.get('EMBED_REQUESTS_PER_MINUTE')
+        
+        keys = [self._embedding_cache_key(text) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+        
+        # cache key -> positions of the texts still to embed
+        missing = {}
+        for position, (key, embedding) in enumerate(zip(keys, results)):
+            if embedding is None:
+                missing.setdefault(key, []).append(position)
+        pending = list(missing)
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        limiter = RateLimiter(requests_per_minute)
+        
+        def embed_batch(batch_keys):
+            limiter.wait()
+            return batch_keys, self._embed_texts([texts[missing[key][0]] for key in batch_keys])
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in as_completed([pool.submit(embed_batch, batch) for batch in batches]):
+                try:
+                    batch_keys, vectors = future.result()
+                except Exception as e:
+                    logger.error(f"Error generating embedding batch: {e}")
+                    continue
+                for key, values in zip(batch_keys, vectors):
+                    embedding = self._normalize(values)
+                    self.cache.set(key, embedding, self.cache_timeout * 24)
+                    for position in missing[key]:
+                        results[position] = embedding
+        
+        return results
+    
+    EMBEDDING_MODEL = "gemini-embedding-001"
+    EMBEDDING_DIMENSION = 768
+    
+    def _embedding_cache_key(self, text):
+        # The whole text is hashed: conversations sharing an opening must not share a vector
+        model = type(self.embedder).__name__ if self.embedder is not None else self.EMBEDDING_MODEL
+        return make_key(
+            'embedding',
+            model,
+            {'task_type': 'RETRIEVAL_DOCUMENT', 'dimension': self.EMBEDDING_DIMENSION},
+            normalize_text(text)
+        )
+    
+    def _embed_texts(self, texts):
+        """Raw embedding vectors for a list of texts"""
+        if self.embedder is not None:
+            return self.embedder.embed(texts)
+
+        # Use correct top-level call for Gemini embeddings
+        result = genai.embed_content(
+            model=self.EMBEDDING_MODEL,             # Correct embedding model
+            contents=texts,                         # Must be a list
+            config=genai.types.EmbedContentConfig(
+                task_type="RETRIEVAL_DOCUMENT",
+                output_dimensionality=self.EMBEDDING_DIMENSION  # Optional, recommended
+            )
+        )
+        return [embedding_obj.values for embedding_obj in result.embeddings]
+    
+    def _normalize(self, values):
+        """Normalize for cosine similarity"""
+        embedding_values = np.array(values, dtype=float)
+        embedding_values = embedding_values / np.linalg.norm(embedding_values)
+        return embedding_values.tolist()
+    
     def query_past_conversations(self, query, conversations):
+        """
+        Answer a question from past conversations.
+        
+        A question within ANSWER_CACHE_THRESHOLD (cosine) of one already
+        answered from the same retrieved conversations reuses that answer
+        instead of calling the model.
+        
+        Args:
+            query (str): User question
+            conversations (QuerySet): Filtered conversations to search, all of them are ranked
+        
+        Returns:
+            tuple: (answer text, ranked Conversation instances used as context)
+        """
+        try:
+            query_embedding = self.generate_embedding(query)
+            relevant_conversations = self._retrieve(query, query_embedding, conversations)
+            context = self._conversation_context(relevant_conversations)
+
+            answer_key = self._answer_cache_key(context)
+            if self.answer_cache_enabled:
+                cached_answer = self.answer_cache.lookup(answer_key, query_embedding)
+                if cached_answer is not None:
+                    return cached_answer, relevant_conversations
+
+            started = time.perf_counter()
+            response = self.model.generate_content(
+                self._build_query_prompt(query, context),
+                generation_config=genai.types.GenerationConfig(**self.QUERY_GENERATION)
+            )
+
+            self._record_usage(response)
+            if self.answer_cache_enabled:
+                self.answer_cache.store(
+                    answer_key, query_embedding, response.text, time.perf_counter() - started
+                )
+            return response.text, relevant_conversations
+
+        except Exception as e:
+            logger.error(f"Error querying conversations: {str(e)}")
+            raise Exception(f"Failed to query conversations: {str(e)}")
+    
+    async def aquery_past_conversations(self, query, conversations):
+        """Async variant of query_past_conversations"""
         try:
-            # Perform semantic search (returns Conversation model instances)
-            relevant_conversations = self.semantic_search(query, conversations)
+            query_embedding = await self.agenerate_embedding(query)
+            relevant_conversations = await self._aretrieve(query, query_embedding, conversations)
+            context = self._conversation_context(relevant_conversations)
 
-            # Format top 5 for prompt context
-            context = self._format_conversations_for_query(relevant_conversations[:5])
+            answer_key = self._answer_cache_key(context)
+            if self.answer_cache_enabled:
+                cached_answer = await self.answer_cache.alookup(answer_key, query_embedding)
+                if cached_answer is not None:
+                    return cached_answer, relevant_conversations
+
+            started = time.perf_counter()
+            prompt = self._build_query_prompt(query, context)
+            generation_config = genai.types.GenerationConfig(**self.QUERY_GENERATION)
+            if hasattr(self.model, 'generate_content_async'):
+                response = await self.model.generate_content_async(
+                    prompt, generation_config=generation_config
+                )
+            else:
+                response = await asyncio.to_thread(
+                    self.model.generate_content, prompt, generation_config=generation_config
+                )
 
-            prompt = f"""You are an intelligent assistant analyzing past conversations.
+            self._record_usage(response)
+            if self.answer_cache_enabled:
+                await self.answer_cache.astore(
+                    answer_key, query_embedding, response.text, time.perf_counter() - started
+                )
+            return response.text, relevant_conversations
+
+        except Exception as e:
+            logger.error(f"Error querying conversations: {str(e)}")
+            raise Exception(f"Failed to query conversations: {str(e)}")
+    
+    QUERY_GENERATION = {'max_output_tokens': 1024, 'temperature': 0.4}
+    ANSWER_CONTEXT_SIZE = 5  # Conversations formatted into the query prompt
+    
+    def _answer_cache_key(self, context):
+        """
+        Answer cache key: everything in the query prompt except the question.
+        Any change to one of these conversations yields a new key.
+        """
+        return make_key(
+            'answer',
+            self.model_name,
+            self.QUERY_GENERATION,
+            context[:self.ANSWER_CONTEXT_SIZE]
+        )
+    
+    def retrieve_conversations(self, query, conversations, top_k=10):
+        """
+        Retrieval stage of query_past_conversations.
+        
+        Every conversation in the queryset is a candidate: only their ids are
+        read, vectors come from the shared embedding index. The top_k of the
+        hybrid ranking are then loaded in one query.
+        
+        Returns:
+            list: Conversation instances, most relevant first
+        """
+        return self._retrieve(query, self.generate_embedding(query), conversations, top_k)
+    
+    async def aretrieve_conversations(self, query, conversations, top_k=10):
+        """Async variant of retrieve_conversations"""
+        return await self._aretrieve(query, await self.agenerate_embedding(query), conversations, top_k)
+    
+    def _retrieve(self, query, query_embedding, conversations, top_k=10):
+        candidate_ids = list(conversations.values_list('id', flat=True))
+        ranked_ids = self._hybrid_rank(query, query_embedding, candidate_ids, top_k, conversations)
+        return self._load_ranked(conversations, ranked_ids, top_k)
+    
+    async def _aretrieve(self, query, query_embedding, conversations, top_k=10):
+        candidate_ids = [conv_id async for conv_id in conversations.values_list('id', flat=True)]
+        # The indexes may load from the DB on first use. ORM work goes through
+        # sync_to_async, whose threads have their connections closed by Django;
+        # bare to_thread workers would each keep one open
+        ranked_ids = await sync_to_async(self._hybrid_rank)(
+            query, query_embedding, candidate_ids, top_k, conversations
+        )
+        return await sync_to_async(self._load_ranked)(conversations, ranked_ids, top_k)
+    
+    RETRIEVAL_DEPTH = 50  # Candidates taken from each ranker before fusion
+    
+    def _hybrid_rank(self, query, query_embedding, candidate_ids, top_k, conversations=None):
+        """
+        Fuse the semantic and lexical rankings of the candidates with weighted
+        reciprocal rank fusion: embeddings catch paraphrases, the lexical
+        ranker catches exact identifiers such as ticket numbers.
+        
+        Returns:
+            list: Ranked ids, or None when neither ranker produced anything
+        """
+        semantic_ids = self._rank_ids(query_embedding, candidate_ids, self.RETRIEVAL_DEPTH)
+        lexical_ids = self._lexical_rank_ids(query, candidate_ids, conversations)
+        if semantic_ids is None and not lexical_ids:
+            return None
+        return reciprocal_rank_fusion(
+            [semantic_ids or [], lexical_ids],
+            k=self.config.get('RRF_K', 60),
+            weights=[
+                self.config.get('HYBRID_SEMANTIC_WEIGHT', 1.0),
+                self.config.get('HYBRID_LEXICAL_WEIGHT', 1.0),
+            ]
+        )[:top_k]
+    
+    def _lexical_rank_ids(self, query, candidate_ids, conversations=None):
+        if not candidate_ids:
+            return []
+        if self.config.get('LEXICAL_BACKEND', 'bm25') == 'fts':
+            if conversations is None:
+                conversations = Conversation.objects.filter(id__in=candidate_ids)
+            return rank_conversation_ids(conversations, query, limit=self.RETRIEVAL_DEPTH)
+        ranked = get_bm25_index().search(query, k=self.RETRIEVAL_DEPTH, candidate_ids=candidate_ids)
+        return [conv_id for conv_id, _ in ranked]
+    
+    def _rank_ids(self, query_embedding, candidate_ids, top_k):
+        """Candidate ids ordered by semantic similarity, or None without a query vector"""
+        if not query_embedding or not candidate_ids:
+            return None
+        ranked = get_embedding_index().search(query_embedding, k=top_k, candidate_ids=candidate_ids)
+        return [conv_id for conv_id, _ in ranked]
+    
+    def _load_ranked(self, conversations, ranked_ids, top_k):
+        conversations = conversations.defer('embedding', 'embedding_vector', 'context_summary')
+        if ranked_ids is None:
+            # No query embedding: fall back to the most recent conversations
+            return list(conversations.order_by('-created_at')[:top_k])
+        by_id = conversations.in_bulk(ranked_ids)
+        return [by_id[conv_id] for conv_id in ranked_ids if conv_id in by_id]
+    
+    def _conversation_context(self, conversations):
+        """Prompt fields of each conversation"""
+        return [
+            {
+                'id': conv.id,
+                'title': conv.title,
+                'created_at': conv.created_at.isoformat(),
+                'summary': conv.summary,
+                'key_topics': conv.key_topics,
+                'sentiment': conv.sentiment,
+                'duration_minutes': conv.get_duration()
+            }
+            for conv in conversations
+        ]
+    
+    def _build_query_prompt(self, query, relevant_conversations):
+        # Format the top conversations for prompt context
+        context = self._format_conversations_for_query(relevant_conversations[:self.ANSWER_CONTEXT_SIZE])
+
+        return f"""You are an intelligent assistant analyzing past conversations.
 
     Context from relevant conversations:
     {context}
@@ -223,38 +1004,23 @@ Be specific and extract actual content from the conversation."""
     5. If multiple conversations are relevant, synthesize the information
 
     Answer:"""
-
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=1024,
-                    temperature=0.4,
-                )
-            )
-
-            return response.text, relevant_conversations  # Always return models
-
-        except Exception as e:
-            logger.error(f"Error querying conversations: {str(e)}")
-            raise Exception(f"Failed to query conversations: {str(e)}")
-
-        
-        def _fallback_analysis(self, messages):
-            """Fallback analysis when AI parsing fails"""
-            return {
-                'summary': f"Conversation with {len(messages)} messages",
-                'key_topics': ['general discussion'],
-                'action_items': [],
-                'sentiment': 'neutral'
-            }
-        
+    
+    def _fallback_analysis(self, messages):
+        """Fallback analysis when AI parsing fails"""
+        return {
+            'summary': f"Conversation with {len(messages)} messages",
+            'key_topics': ['general discussion'],
+            'action_items': [],
+            'sentiment': 'neutral'
+        }
+    
     def _format_messages_for_analysis(self, messages):
         """Format messages for AI analysis"""
-        formatted = []
-        for msg in messages:
-            sender = "User" if msg['sender'] == 'user' else "AI"
-            formatted.append(f"{sender}: {msg['content']}")
-        return "\n\n".join(formatted)
+        return "\n\n".join(self._format_message(msg) for msg in messages)
+    
+    def _format_message(self, msg):
+        sender = "User" if msg['sender'] == 'user' else "AI"
+        return f"{sender}: {msg['content']}"
     
     def _format_conversations_for_query(self, conversations):
         """Format conversations for query context (dict-safe)"""
@@ -290,37 +1056,34 @@ Be specific and extract actual content from the conversation."""
         return "\n".join(formatted)
 
 
-    def semantic_search(self, query, conversations):
+    def semantic_search(self, query, conversations, top_k=10):
         """
-        Perform semantic search across conversations using cosine similarity.
-        Dict-safe version.
+        Hybrid (embedding + lexical) search across conversations using the
+        shared in-memory indexes. Dict-safe version: only the 'id' key of
+        each conversation is needed.
         """
         try:
             query_embedding = self.generate_embedding(query)
-            if not query_embedding:
-                return conversations[:10]
-
-            ranked_conversations = []
-
-            for conv in conversations:
-                conv_embedding = conv.get('embedding')
-                if not conv_embedding:
-                    continue
-
-                try:
-                    similarity = cosine_similarity([query_embedding], [conv_embedding])[0][0]
-                    ranked_conversations.append({
-                        'conversation': conv,
-                        'similarity_score': float(similarity)
-                    })
-                except Exception as e:
-                    conv_id = conv.get('id', 'N/A')
-                    logger.warning(f"Error calculating similarity for conv {conv_id}: {str(e)}")
-                    continue
-
-            ranked_conversations.sort(key=lambda x: x['similarity_score'], reverse=True)
-            return [item['conversation'] for item in ranked_conversations[:10]]
-
+            return self._rank_conversations(query, query_embedding, conversations, top_k)
         except Exception as e:
             logger.error(f"Error in semantic search: {str(e)}")
-            return conversations[:10]
+            return conversations[:top_k]
+    
+    async def asemantic_search(self, query, conversations, top_k=10):
+        """Async variant of semantic_search"""
+        try:
+            query_embedding = await self.agenerate_embedding(query)
+            # The indexes may load from the DB on first use (see _aretrieve)
+            return await sync_to_async(self._rank_conversations)(
+                query, query_embedding, conversations, top_k
+            )
+        except Exception as e:
+            logger.error(f"Error in semantic search: {str(e)}")
+            return conversations[:top_k]
+    
+    def _rank_conversations(self, query, query_embedding, conversations, top_k):
+        conversations_by_id = {conv.get('id'): conv for conv in conversations}
+        ranked_ids = self._hybrid_rank(query, query_embedding, list(conversations_by_id), top_k)
+        if ranked_ids is None:
+            return conversations[:top_k]
+        return [conversations_by_id[conv_id] for conv_id in ranked_ids]
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import time
+import numpy as np
+from types import SimpleNamespace
+
+
+class FakeResponse:
+    """
+    Mimics a google.generativeai GenerateContentResponse.
+
+    When streamed, iterating yields one chunk per configured piece of text,
+    sleeping chunk_delay between them; usage_metadata is available once the
+    stream is exhausted, as with the real client.
+    """
+
+    def __init__(self, chunks, first_chunk_delay=0.0, chunk_delay=0.0, stream=False):
+        self._chunks = list(chunks)
+        self._first_chunk_delay = first_chunk_delay
+        self._chunk_delay = chunk_delay
+        self._stream = stream
+        self.text = "".join(self._chunks)
+        self.usage_metadata = SimpleNamespace(
+            total_token_count=sum(len(chunk.split()) for chunk in self._chunks)
+        )
+
+    def __iter__(self):
+        if not self._stream:
+            yield self
+            return
+        for i, chunk in enumerate(self._chunks):
+            time.sleep(self._first_chunk_delay if i == 0 else self._chunk_delay)
+            yield SimpleNamespace(text=chunk)
+
+
+class FakeChatSession:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, generation_config=None, stream=False):
+        self.history.append({'role': 'user', 'parts': [content]})
+        return self.model.generate_content(content, generation_config=generation_config, stream=stream)
+
+    async def send_message_async(self, content, generation_config=None):
+        self.history.append({'role': 'user', 'parts': [content]})
+        return await self.model.generate_content_async(content, generation_config=generation_config)
+
+
+class FakeGenerativeModel:
+    """
+    Offline stand-in for genai.GenerativeModel, for tests and benchmarks.
+
+    Responses are built by `reply(prompt)` (default: echo a fixed answer)
+    and split into chunks of `words_per_chunk` words. `first_chunk_delay`
+    and `chunk_delay` (seconds) simulate time-to-first-token and
+    inter-token latency.
+
+        service = EnhancedAIService(model=FakeGenerativeModel(chunk_delay=0.05))
+    """
+
+    def __init__(self, reply=None, words_per_chunk=3, first_chunk_delay=0.0, chunk_delay=0.0):
+        self.reply = reply or (lambda prompt: "This is a simulated response from the fake model.")
+        self.words_per_chunk = words_per_chunk
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+
+    def _chunks(self, prompt):
+        words = self.reply(prompt).split(' ')
+        return [
+            ' '.join(words[i:i + self.words_per_chunk]) + (' ' if i + self.words_per_chunk < len(words) else '')
+            for i in range(0, len(words), self.words_per_chunk)
+        ]
+
+    def _total_delay(self, chunks):
+        return self.first_chunk_delay + self.chunk_delay * max(len(chunks) - 1, 0)
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        chunks = self._chunks(prompt)
+        if not stream:
+            time.sleep(self._total_delay(chunks))
+        return FakeResponse(
+            chunks,
+            first_chunk_delay=self.first_chunk_delay,
+            chunk_delay=self.chunk_delay,
+            stream=stream,
+        )
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        self.calls += 1
+        chunks = self._chunks(prompt)
+        await asyncio.sleep(self._total_delay(chunks))
+        return FakeResponse(chunks)
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+
+class FakeEmbedder:
+    """
+    Deterministic offline embedder: every text maps to a fixed pseudo-random
+    vector seeded from its SHA-256, so equal texts get equal embeddings.
+
+        service = EnhancedAIService(model=FakeGenerativeModel(), embedder=FakeEmbedder())
+    """
+
+    def __init__(self, dimension=768, delay=0.0):
+        self.dimension = dimension
+        self.delay = delay
+        self.calls = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        return np.random.default_rng(seed).standard_normal(self.dimension).tolist()
+
+    def embed(self, texts):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [self._vector(text) for text in texts]
+
+    async def aembed(self, texts):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return [self._vector(text) for text in texts]
@@ -0,0 +1,51 @@
+import base64
+import numpy as np
+from django.db import models
+
+
+class EmbeddingField(models.BinaryField):
+    """
+    Stores a vector as raw little-endian floats in a bytea column.
+
+    768 float32 values take 3 KB instead of ~15 KB of JSON text, and loading
+    is a zero-copy np.frombuffer over the driver's buffer instead of parsing
+    a list of Python floats. Values come back as read-only NumPy arrays;
+    lists and arrays are both accepted on assignment.
+    """
+
+    description = "Binary float vector"
+
+    def __init__(self, *args, dtype='float32', **kwargs):
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dtype != np.dtype('<f4'):
+            kwargs['dtype'] = self.dtype.name
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=self.dtype)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):
+            value = base64.b64decode(value.encode('ascii'))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return np.frombuffer(value, dtype=self.dtype)
+        return np.asarray(value, dtype=self.dtype)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        return np.asarray(value, dtype=self.dtype).tobytes()
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        if value is None:
+            return None
+        return base64.b64encode(self.get_prep_value(value)).decode('ascii')
@@ -0,0 +1,105 @@
+"""
+Process-wide Gemini client registry.
+
+genai.configure() drops every client the SDK has created, so configuring
+and building a GenerativeModel per request meant a new transport, and a new
+TCP/TLS connection, for every model call. Here the SDK is configured once
+per process and GenerativeModel objects are shared by all services: their
+client keeps one gRPC channel (or, with GEMINI_TRANSPORT='rest', one pooled
+keep-alive HTTP session) for the life of the process.
+
+Configuration is lazy (on the first model request), so management commands
+and tests that never call Gemini do not need an API key.
+"""
+import logging
+import threading
+
+import google.generativeai as genai
+from django.conf import settings
+from google.generativeai import client as genai_client
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_configured = False
+_models = {}
+
+
+def configure(transport=None, api_endpoint=None, api_key=None):
+    """
+    (Re)configure the SDK for this process and build its shared clients.
+
+    Arguments default to AI_CONFIG['GEMINI_TRANSPORT'],
+    AI_CONFIG['GEMINI_API_ENDPOINT'] and settings.GEMINI_API_KEY. Models
+    handed out before are discarded.
+    """
+    with _lock:
+        _configure(transport, api_endpoint, api_key)
+
+
+def _configure(transport=None, api_endpoint=None, api_key=None):
+    # Callers hold _lock
+    global _configured
+    config = settings.AI_CONFIG
+    transport = transport or config.get('GEMINI_TRANSPORT') or None
+    api_endpoint = api_endpoint or config.get('GEMINI_API_ENDPOINT') or None
+
+    genai.configure(
+        api_key=api_key or settings.GEMINI_API_KEY,
+        transport=transport,
+        client_options={'api_endpoint': api_endpoint} if api_endpoint else None,
+    )
+    # Built here, under the lock, so concurrent first calls share one client
+    _size_pool(
+        genai_client.get_default_generative_client(),
+        config.get('GEMINI_POOL_SIZE', 32)
+    )
+    _models.clear()
+    _configured = True
+
+
+def reset():
+    """Forget the configuration: the next get_model() configures from settings again"""
+    global _configured
+    with _lock:
+        _models.clear()
+        _configured = False
+
+
+def get_model(model_name=None):
+    """Shared GenerativeModel for model_name (default settings.GEMINI_MODEL)"""
+    model_name = model_name or settings.GEMINI_MODEL
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _lock:
+        # Checked under the lock: a second configure() would drop the
+        # client and models another thread just built
+        if not _configured:
+            _configure()
+        model = _models.get(model_name)
+        if model is None:
+            model = _models[model_name] = genai.GenerativeModel(model_name)
+    return model
+
+
+def _size_pool(client, size):
+    """
+    Let the REST transport keep up to `size` idle connections, enough for
+    the fan-out and worker threads (requests keeps 10 by default and closes
+    the rest after each call). The gRPC transport multiplexes one channel
+    and needs nothing.
+    """
+    try:
+        # Private SDK attributes: an SDK upgrade must not break configuration
+        session = getattr(getattr(client, '_transport', None), '_session', None)
+        if session is None:
+            return
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    except Exception as e:
+        logger.warning(f"Could not size the Gemini connection pool, using the SDK default: {str(e)}")
@@ -0,0 +1,97 @@
+"""
+Cross-process freshness for the in-memory search indexes.
+
+Every process holds its own embedding and BM25 index. Post-commit signal
+handlers keep a copy current with the writes made by the same process;
+writes by other web workers, by run_analysis_worker or by management
+commands are picked up by sync_with_db(), which get_embedding_index() and
+get_bm25_index() run at most every AI_CONFIG['INDEX_SYNC_INTERVAL'] seconds.
+
+A sync re-reads the conversations whose updated_at moved past the watermark
+of the previous sync (minus SYNC_LAG, for transactions that committed after
+that watermark was taken). Deletions leave nothing to read, so when the
+number of conversations the index should hold differs from its size, the
+ids are reconciled: deleted ones are dropped, missing ones read.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseSyncMixin:
+    """
+    Watermark refresh for an index. Subclasses provide stored_ids() (a flat
+    values_list of the conversation ids the index should hold),
+    indexed_ids(), refresh_conversations(ids), remove(id) and __len__, and
+    call mark_synced() when they load from the database.
+    """
+
+    SYNC_LAG = timedelta(seconds=60)
+    SYNC_BATCH = 2000
+
+    def _init_sync(self):
+        self._synced_at = None
+        self._next_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+    def mark_synced(self, watermark):
+        """Everything updated before `watermark` is in the index"""
+        self._synced_at = watermark
+        self._next_sync = 0.0
+
+    def maybe_sync(self, interval):
+        """sync_with_db() unless one ran (or is running) in the last `interval` seconds"""
+        if not interval or time.monotonic() < self._next_sync:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time.monotonic() + interval
+            self.sync_with_db()
+        except Exception as e:
+            logger.error(f"Search index sync failed: {str(e)}")
+        finally:
+            self._sync_lock.release()
+
+    def sync_with_db(self, full=False):
+        """
+        Catch up with the database. `full` reconciles the ids even when the
+        counts agree, e.g. for an index restored from a file.
+
+        Returns:
+            int: Conversations re-read
+        """
+        from .models import Conversation
+
+        started = timezone.now()
+        refreshed = 0
+        if self._synced_at is not None:
+            changed = list(
+                Conversation.objects
+                .filter(updated_at__gte=self._synced_at - self.SYNC_LAG)
+                .values_list('id', flat=True)
+            )
+            refreshed += self._refresh_batches(changed)
+
+        stored = self.stored_ids()
+        if full or self._synced_at is None or stored.count() != len(self):
+            stored_ids = set(stored)
+            indexed_ids = self.indexed_ids()
+            for conversation_id in indexed_ids - stored_ids:
+                self.remove(conversation_id)
+            refreshed += self._refresh_batches(list(stored_ids - indexed_ids))
+
+        self._synced_at = started
+        if refreshed:
+            logger.info(f"Synced {refreshed} conversations into {type(self).__name__}")
+        return refreshed
+
+    def _refresh_batches(self, conversation_ids):
+        for start in range(0, len(conversation_ids), self.SYNC_BATCH):
+            self.refresh_conversations(conversation_ids[start:start + self.SYNC_BATCH])
+        return len(conversation_ids)
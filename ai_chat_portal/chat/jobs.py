@@ -0,0 +1,325 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Conversation, AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisRetry(Exception):
+    """Raised when an analysis attempt produced incomplete results"""
+
+
+class AnalysisJobQueue:
+    """
+    In-process worker pool for end-of-conversation analysis.
+
+    Jobs live in the AnalysisJob table, so no external broker is needed and
+    several processes can share the queue: workers claim due jobs with
+    SELECT ... FOR UPDATE SKIP LOCKED. Failed attempts are retried with
+    exponential backoff; a job whose lease expires (worker died) is re-queued.
+
+    Web servers start the workers at boot (start_server_workers); with
+    `autostart` off they are left to run_analysis_worker processes.
+    """
+
+    STAGES = ('queue_wait', 'summary', 'embedding', 'total')
+
+    def __init__(self, workers=2, max_attempts=3, backoff_base=2.0,
+                 poll_interval=5.0, lease_seconds=600, service_factory=None, autostart=True):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.service_factory = service_factory
+        self.autostart = autostart
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {'succeeded': 0, 'failed': 0, 'retried': 0}
+        self._completions = deque(maxlen=10000)
+        self._latencies = {stage: deque(maxlen=1000) for stage in self.STAGES}
+
+    def start(self):
+        """Start the worker threads if they are not running yet"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"analysis-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.workers} analysis workers")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def enqueue(self, conversation):
+        """
+        Mark the conversation as ended and queue its analysis.
+
+        Returns:
+            AnalysisJob: The queued job
+        """
+        with transaction.atomic():
+            conversation.status = 'ended'
+            conversation.ended_at = timezone.now()
+            conversation.analysis_status = 'pending'
+            conversation.save(update_fields=['status', 'ended_at', 'analysis_status'])
+            job = AnalysisJob.objects.create(conversation=conversation)
+            transaction.on_commit(self._wakeup.set)
+
+        if self.autostart:
+            self.start()
+        return job
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.claim_next()
+                if job is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                self.run_job(job)
+            except Exception as e:
+                logger.error(f"Analysis worker error: {str(e)}")
+                time.sleep(self.poll_interval)
+            finally:
+                close_old_connections()
+
+    def claim_next(self):
+        """Atomically take the oldest due job, or None"""
+        now = timezone.now()
+        with transaction.atomic():
+            job = (
+                AnalysisJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    Q(status='queued', next_run_at__lte=now) |
+                    Q(status='running', lease_expires_at__lt=now)
+                )
+                .order_by('next_run_at')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = 'running'
+            job.attempts += 1
+            job.started_at = now
+            job.lease_expires_at = now + timedelta(seconds=self.lease_seconds)
+            job.save(update_fields=['status', 'attempts', 'started_at', 'lease_expires_at'])
+
+        Conversation.objects.filter(pk=job.conversation_id).update(
+            analysis_status='running', **Conversation.changed()
+        )
+        self._record('queue_wait', (now - job.created_at).total_seconds())
+        return job
+
+    def run_job(self, job):
+        """Run summary and embedding concurrently and store the results"""
+        started = time.perf_counter()
+        timings = {}
+        try:
+            conversation, analysis, embedding = self._analyze(job, timings)
+        except Exception as e:
+            self._fail(job, e, timings, started)
+            return
+
+        conversation.summary = analysis['summary']
+        conversation.key_topics = analysis['key_topics']
+        conversation.action_items = analysis['action_items']
+        conversation.sentiment = analysis['sentiment']
+        update_fields = ['summary', 'key_topics', 'action_items', 'sentiment', 'analysis_status']
+
+        if embedding is None:
+            # Keep the analysis; a retry only needs to fill in the embedding
+            conversation.analysis_status = 'failed' if job.attempts >= self.max_attempts else 'pending'
+            conversation.save(update_fields=update_fields)
+            self._fail(job, AnalysisRetry("Embedding generation failed"), timings, started)
+            return
+
+        conversation.embedding_vector = embedding
+        conversation.analysis_status = 'completed'
+        conversation.save(update_fields=update_fields + ['embedding_vector'])
+        self._finish(job, timings, started)
+
+    def _analyze(self, job, timings):
+        conversation = Conversation.objects.defer('embedding', 'embedding_vector').get(
+            pk=job.conversation_id
+        )
+        message_data = list(conversation.messages.values('sender', 'content'))
+        full_conversation_text = "\n".join([msg['content'] for msg in message_data])
+
+        service = self._get_service()
+        results = service.run_concurrently({
+            'summary': (self._timed, 'summary', timings, service.generate_conversation_summary, message_data),
+            'embedding': (self._timed, 'embedding', timings, service.generate_embedding, full_conversation_text),
+        })
+        if results['summary'] is None:
+            raise AnalysisRetry("Conversation summary missed the deadline")
+        return conversation, results['summary'], results['embedding']
+
+    def _timed(self, stage, timings, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            timings[stage] = time.perf_counter() - started
+            self._record(stage, timings[stage])
+
+    def _finish(self, job, timings, started):
+        timings['total'] = time.perf_counter() - started
+        self._record('total', timings['total'])
+        job.status = 'succeeded'
+        job.finished_at = timezone.now()
+        job.lease_expires_at = None
+        job.stage_timings = timings
+        job.last_error = ''
+        job.save(update_fields=['status', 'finished_at', 'lease_expires_at', 'stage_timings', 'last_error'])
+        with self._stats_lock:
+            self._counters['succeeded'] += 1
+            self._completions.append(time.monotonic())
+        logger.info(f"Analysis job {job.id} finished in {timings['total']:.2f}s")
+
+    def _fail(self, job, error, timings, started):
+        timings['total'] = time.perf_counter() - started
+        job.last_error = str(error)
+        job.stage_timings = timings
+        job.lease_expires_at = None
+        if job.attempts >= self.max_attempts:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+            Conversation.objects.filter(pk=job.conversation_id).update(
+                analysis_status='failed', **Conversation.changed()
+            )
+            counter = 'failed'
+            logger.error(f"Analysis job {job.id} failed after {job.attempts} attempts: {error}")
+        else:
+            delay = self.backoff_base * (2 ** (job.attempts - 1)) * (1 + random.random() / 2)
+            job.status = 'queued'
+            job.next_run_at = timezone.now() + timedelta(seconds=delay)
+            counter = 'retried'
+            logger.warning(f"Analysis job {job.id} attempt {job.attempts} failed, retrying in {delay:.1f}s: {error}")
+        job.save(update_fields=[
+            'status', 'finished_at', 'next_run_at', 'lease_expires_at', 'last_error', 'stage_timings'
+        ])
+        with self._stats_lock:
+            self._counters[counter] += 1
+
+    def _get_service(self):
+        if self.service_factory is not None:
+            return self.service_factory()
+        from .enhanced_ai_service import EnhancedAIService
+        return EnhancedAIService()
+
+    def _record(self, stage, seconds):
+        with self._stats_lock:
+            self._latencies[stage].append(seconds)
+
+    def stats(self):
+        """Throughput, queue depth and per-stage latency for this process"""
+        now = time.monotonic()
+        with self._stats_lock:
+            counters = dict(self._counters)
+            recent = sum(1 for finished in self._completions if now - finished <= 60)
+            latencies = {stage: list(samples) for stage, samples in self._latencies.items()}
+
+        stage_latency = {}
+        for stage, samples in latencies.items():
+            if samples:
+                stage_latency[stage] = {
+                    'count': len(samples),
+                    'p50': round(float(np.percentile(samples, 50)), 3),
+                    'p95': round(float(np.percentile(samples, 95)), 3),
+                    'max': round(max(samples), 3),
+                }
+
+        return {
+            'workers': len(self._threads),
+            'queue_depth': AnalysisJob.objects.filter(status='queued').count(),
+            'running': AnalysisJob.objects.filter(status='running').count(),
+            'processed': counters,
+            'throughput_per_minute': recent,
+            'stage_latency_seconds': stage_latency,
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide queue configured from AI_CONFIG"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                config = settings.AI_CONFIG
+                _queue = AnalysisJobQueue(
+                    workers=config.get('ANALYSIS_WORKERS', 2),
+                    max_attempts=config.get('ANALYSIS_MAX_ATTEMPTS', 3),
+                    backoff_base=config.get('ANALYSIS_RETRY_BACKOFF', 2.0),
+                    autostart=config.get('ANALYSIS_IN_PROCESS', True),
+                )
+    return _queue
+
+
+# Programs that serve requests; anything else (shell, migrate, tests) leaves the queue alone
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi')
+
+
+def is_server_process(argv=None):
+    """Whether this process serves requests, as opposed to running a management command"""
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    program = os.path.basename(argv[0])
+    if program in ('manage.py', 'django-admin'):
+        if len(argv) < 2 or argv[1] != 'runserver':
+            return False
+        # The autoreloader's parent process only watches files
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+    # Also matches `python -m gunicorn`, whose argv[0] is gunicorn/__main__.py
+    return any(name in argv[0] for name in SERVER_PROGRAMS)
+
+
+def start_server_workers(argv=None):
+    """
+    Start the in-process workers when a server boots, so jobs queued,
+    backing off or abandoned before a restart are picked up without
+    waiting for this process to enqueue one.
+    """
+    config = settings.AI_CONFIG
+    if not config.get('BACKGROUND_ANALYSIS') or not is_server_process(argv):
+        return False
+    queue = get_job_queue()
+    if not queue.autostart:
+        return False
+    queue.start()
+    return True
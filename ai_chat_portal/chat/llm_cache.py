@@ -0,0 +1,164 @@
+"""
+Content-addressed cache for model outputs.
+
+Keys are SHA-256 digests over the model name, the generation config and the
+normalized input, so they are identical in every worker process and two
+different inputs never share an entry. Lookups go through a bounded
+in-process LRU first and then, if configured, a shared Django cache
+(CACHES['llm'], e.g. file-based or database) that all workers see.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting-only differences share an entry"""
+    return ' '.join(str(text).split())
+
+
+def make_key(kind, model, config, payload):
+    """
+    Deterministic cache key.
+
+    Args:
+        kind (str): Namespace, e.g. 'chat' or 'embedding'
+        model (str): Model name
+        config (dict): Generation settings that change the output
+        payload: JSON-serializable input (already normalized)
+    """
+    material = json.dumps(
+        {'model': model, 'config': config, 'input': payload},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(',', ':'),
+        default=str
+    )
+    return f"llm:{kind}:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+
+class LLMCache:
+    """
+    Two-tier cache: thread-safe LRU with TTL, plus an optional shared backend.
+
+        value = llm_cache.get(key)
+        if value is None:
+            value = call_model()
+            llm_cache.set(key, value, ttl=3600)
+    """
+
+    def __init__(self, max_entries=2048, ttl=3600, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'sets': 0,
+        }
+
+    def get(self, key):
+        """Cached value or None"""
+        value = self._get_local(key)
+        if value is not None or self.shared is None:
+            return value
+        return self._remember_shared(key, self.shared.get(key))
+
+    async def aget(self, key):
+        value = self._get_local(key)
+        if value is not None or self.shared is None:
+            return value
+        return self._remember_shared(key, await self.shared.aget(key))
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        self._set_local(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    async def aset(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        self._set_local(key, value, ttl)
+        if self.shared is not None:
+            await self.shared.aset(key, value, ttl)
+
+    def clear(self):
+        """Drop the in-process tier (the shared tier is left alone)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['shared'] = self.shared is not None
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            if self.shared is None:
+                self._stats['misses'] += 1
+        return None
+
+    def _remember_shared(self, key, value):
+        with self._lock:
+            self._stats['misses' if value is None else 'shared_hits'] += 1
+        if value is not None:
+            # The shared backend does not expose the remaining TTL
+            self._set_local(key, value, self.ttl, count=False)
+        return value
+
+    def _set_local(self, key, value, ttl, count=True):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            if count:
+                self._stats['sets'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Process-wide cache configured from AI_CONFIG and CACHES['llm']"""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                try:
+                    shared = caches['llm']
+                except InvalidCacheBackendError:
+                    shared = None
+                _llm_cache = LLMCache(
+                    max_entries=settings.AI_CONFIG.get('LLM_CACHE_SIZE', 2048),
+                    ttl=settings.AI_CONFIG.get('LLM_CACHE_TTL', 3600),
+                    shared=shared,
+                )
+    return _llm_cache
@@ -0,0 +1,124 @@
+import json
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chat.models import Conversation, Message
+from chat.enhanced_ai_service import EnhancedAIService
+
+
+class Command(BaseCommand):
+    help = (
+        "Embed ended conversations in batches. By default only conversations "
+        "without an embedding are processed, so an interrupted run simply "
+        "continues. --all re-embeds everything (e.g. after an embedding model "
+        "change) and checkpoints its progress to resume after interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-embed conversations that already have a vector")
+        parser.add_argument('--batch-size', type=int, default=200, help="Conversations per database round trip")
+        parser.add_argument('--concurrency', type=int, default=None, help="Parallel embed requests")
+        parser.add_argument('--rpm', type=int, default=None, help="Embed requests per minute, 0 = unlimited")
+        parser.add_argument(
+            '--checkpoint',
+            default=str(Path(settings.BASE_DIR) / 'data' / 'embedding_backfill.json'),
+            help="File recording the last conversation id processed by --all"
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignore the --all checkpoint and start over")
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint'])
+        reembed_all = options['all']
+        last_id = self._read_checkpoint(checkpoint) if reembed_all and not options['restart'] else 0
+
+        pending = Conversation.objects.filter(status='ended', id__gt=last_id)
+        if not reembed_all:
+            pending = pending.filter(embedding_vector__isnull=True)
+        pending = pending.order_by('id').values_list('id', flat=True)
+
+        total = pending.count()
+        if last_id:
+            self.stdout.write(f"Resuming after conversation {last_id}")
+        self.stdout.write(f"Embedding {total} conversations")
+
+        service = EnhancedAIService()
+        embedded = failed = 0
+        started = time.perf_counter()
+        batch = []
+        for conversation_id in pending.iterator(chunk_size=options['batch_size']):
+            batch.append(conversation_id)
+            if len(batch) >= options['batch_size']:
+                done, errors = self._process(batch, service, options)
+                embedded, failed = embedded + done, failed + errors
+                if reembed_all:
+                    self._write_checkpoint(checkpoint, batch[-1])
+                self._progress(embedded, failed, total, started)
+                batch = []
+
+        if batch:
+            done, errors = self._process(batch, service, options)
+            embedded, failed = embedded + done, failed + errors
+            self._progress(embedded, failed, total, started)
+
+        # A completed run leaves nothing to resume
+        if reembed_all:
+            checkpoint.unlink(missing_ok=True)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedded {embedded} conversations in {elapsed:.1f}s "
+            f"({embedded / elapsed if elapsed else 0:.1f} conversations/sec), {failed} failed. "
+            f"Running processes pick them up at their next search index sync."
+        ))
+
+    def _process(self, conversation_ids, service, options):
+        """Embed one batch of conversations and store the vectors"""
+        texts = {conversation_id: [] for conversation_id in conversation_ids}
+        messages = (
+            Message.objects
+            .filter(conversation_id__in=conversation_ids)
+            .order_by('conversation_id', 'timestamp')
+            .values_list('conversation_id', 'content')
+        )
+        for conversation_id, content in messages.iterator(chunk_size=2000):
+            texts[conversation_id].append(content)
+
+        embeddings = service.generate_embeddings(
+            ["\n".join(texts[conversation_id]) for conversation_id in conversation_ids],
+            concurrency=options['concurrency'],
+            requests_per_minute=options['rpm'],
+        )
+
+        # updated_at moves so running processes pick the vectors up (chat.index_sync)
+        now = timezone.now()
+        updates = [
+            Conversation(id=conversation_id, embedding_vector=embedding, updated_at=now)
+            for conversation_id, embedding in zip(conversation_ids, embeddings)
+            if embedding is not None
+        ]
+        with transaction.atomic():
+            Conversation.objects.bulk_update(updates, ['embedding_vector', 'updated_at'])
+        return len(updates), len(conversation_ids) - len(updates)
+
+    def _progress(self, embedded, failed, total, started):
+        elapsed = time.perf_counter() - started
+        rate = embedded / elapsed if elapsed else 0
+        self.stdout.write(f"  {embedded + failed}/{total} ({rate:.1f} conversations/sec)")
+
+    def _read_checkpoint(self, path):
+        try:
+            return json.loads(path.read_text()).get('last_id', 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_checkpoint(self, path, last_id):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'last_id': last_id}))
+        os.replace(tmp_path, path)
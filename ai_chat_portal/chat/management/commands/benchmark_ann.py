@@ -0,0 +1,125 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from chat.embedding_index import EmbeddingIndex
+from chat.ann_index import IVFPQIndex
+
+
+def synthetic_embeddings(size, dimension, clusters, seed=0, latent_dimension=48):
+    """
+    Clustered, normalized vectors resembling conversation embeddings:
+    real embeddings occupy a low-dimensional manifold, so points are drawn
+    around cluster centres in a small latent space and projected up.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, latent_dimension)).astype(np.float32)
+    projection = rng.normal(size=(latent_dimension, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=size)
+    latent = centers[labels] + 0.5 * rng.normal(size=(size, latent_dimension)).astype(np.float32)
+    vectors = latent @ projection
+    vectors += 0.05 * np.abs(vectors).mean() * rng.normal(size=vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+class Command(BaseCommand):
+    help = "Measure recall@k and latency of the IVF-PQ index against the exact scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['synthetic', 'db'], default='synthetic')
+        parser.add_argument('--size', type=int, default=100000, help="Synthetic corpus size")
+        parser.add_argument('--dim', type=int, default=768)
+        parser.add_argument('--clusters', type=int, default=200)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--nlist', type=int, default=256)
+        parser.add_argument('--m', type=parse_int_list, default=[8, 16, 32])
+        parser.add_argument('--nprobe', type=parse_int_list, default=[1, 4, 8, 16, 32])
+        parser.add_argument('--rerank', type=parse_int_list, default=[0, 10])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        ids, vectors = self._load_vectors(options)
+        if len(ids) < IVFPQIndex.KSUB:
+            self.stderr.write(f"Need at least {IVFPQIndex.KSUB} embeddings, found {len(ids)}")
+            return
+
+        rng = np.random.default_rng(options['seed'] + 1)
+        query_rows = rng.choice(len(ids), min(options['queries'], len(ids)), replace=False)
+        queries = vectors[query_rows] + 0.02 * rng.normal(size=(len(query_rows), vectors.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        k = options['k']
+
+        exact = EmbeddingIndex()
+        exact.load(zip(ids.tolist(), vectors))
+        ground_truth, exact_latencies = self._run(exact.search, queries, k)
+        self.stdout.write(
+            f"{len(ids)} vectors, {len(queries)} queries, k={k}\n"
+            f"exact scan: p50 {np.percentile(exact_latencies, 50):.2f} ms, "
+            f"p95 {np.percentile(exact_latencies, 95):.2f} ms"
+        )
+
+        self.stdout.write(
+            f"{'m':>4} {'nprobe':>7} {'rerank':>7} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}"
+        )
+        for m in options['m']:
+            index = IVFPQIndex(
+                nlist=options['nlist'], m=m, rerank=max(options['rerank']), seed=options['seed']
+            )
+            started = time.perf_counter()
+            index.train(vectors)
+            index.add(ids, vectors)
+            build_seconds = time.perf_counter() - started
+            self.stdout.write(
+                f"-- m={m}: built in {build_seconds:.1f}s, "
+                f"{m} bytes/vector vs {vectors.shape[1] * 4} exact"
+            )
+
+            for nprobe in options['nprobe']:
+                for rerank in options['rerank']:
+                    results, latencies = self._run(
+                        lambda q, k: index.search(q, k=k, nprobe=nprobe, rerank=rerank),
+                        queries,
+                        k
+                    )
+                    recall = np.mean([
+                        len(set(found) & set(expected)) / len(expected)
+                        for found, expected in zip(results, ground_truth)
+                    ])
+                    self.stdout.write(
+                        f"{m:>4} {nprobe:>7} {rerank:>7} {recall:>9.3f} "
+                        f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f}"
+                    )
+
+    def _load_vectors(self, options):
+        if options['source'] == 'synthetic':
+            vectors = synthetic_embeddings(
+                options['size'], options['dim'], options['clusters'], options['seed']
+            )
+            return np.arange(len(vectors), dtype=np.int64), vectors
+
+        from chat.models import Conversation
+
+        rows = list(
+            Conversation.objects.filter(embedding_vector__isnull=False)
+            .values_list('id', 'embedding_vector')
+            .iterator(chunk_size=2000)
+        )
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = np.vstack([row[1] for row in rows]) if rows else np.empty((0, 0), dtype=np.float32)
+        return ids, vectors
+
+    def _run(self, search, queries, k):
+        results = []
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            found = search(query, k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            results.append([conversation_id for conversation_id, _ in found])
+        return results, latencies
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, AsyncClient, override_settings
+
+from chat.models import Conversation
+from chat.views import ConversationViewSet
+from chat.enhanced_ai_service import EnhancedAIService
+from chat.fake_gemini import FakeGenerativeModel, FakeEmbedder
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test send_message against a fake Gemini with artificial latency, "
+        "comparing a fixed pool of sync (WSGI-style) workers with the async views "
+        "(ASGI) in a single event loop"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.5, help="Seconds per fake model call")
+        parser.add_argument('--workers', type=int, default=8, help="Sync workers in WSGI mode")
+        parser.add_argument('--concurrency', type=int, default=50, help="In-flight requests in ASGI mode")
+        parser.add_argument('--mode', choices=['both', 'wsgi', 'asgi'], default='both')
+
+    def handle(self, *args, **options):
+        service = EnhancedAIService(
+            model=FakeGenerativeModel(first_chunk_delay=options['latency']),
+            embedder=FakeEmbedder(),
+        )
+
+        with mock.patch.object(ConversationViewSet, 'get_ai_service', lambda view: service), \
+                mock.patch.object(ConversationViewSet, 'throttle_classes', []), \
+                mock.patch('chat.async_views.get_ai_service', lambda: service), \
+                override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+            if options['mode'] in ('both', 'wsgi'):
+                self._report('WSGI', *self._run_wsgi(options))
+            if options['mode'] in ('both', 'asgi'):
+                self._report('ASGI', *self._run_asgi(options))
+
+    def _create_conversations(self, count):
+        return [
+            conversation.id for conversation in Conversation.objects.bulk_create(
+                Conversation(title='Load test') for _ in range(count)
+            )
+        ]
+
+    def _run_wsgi(self, options):
+        conversation_ids = self._create_conversations(options['requests'])
+
+        def send(index):
+            started = time.perf_counter()
+            response = Client().post(
+                f"/api/conversations/{conversation_ids[index]}/send_message/",
+                {'content': f"Load test question {index}"},
+                content_type='application/json',
+            )
+            return response.status_code, time.perf_counter() - started
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(send, range(len(conversation_ids))))
+            elapsed = time.perf_counter() - started
+        finally:
+            Conversation.objects.filter(id__in=conversation_ids).delete()
+        return results, elapsed, f"{options['workers']} workers"
+
+    def _run_asgi(self, options):
+        conversation_ids = self._create_conversations(options['requests'])
+
+        async def run():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def send(index):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        f"/api/async/conversations/{conversation_ids[index]}/send_message/",
+                        {'content': f"Load test question {index}"},
+                        content_type='application/json',
+                    )
+                    return response.status_code, time.perf_counter() - started
+
+            return await asyncio.gather(*(send(i) for i in range(len(conversation_ids))))
+
+        try:
+            started = time.perf_counter()
+            results = asyncio.run(run())
+            elapsed = time.perf_counter() - started
+        finally:
+            Conversation.objects.filter(id__in=conversation_ids).delete()
+        return results, elapsed, f"{options['concurrency']} in flight"
+
+    def _report(self, mode, results, elapsed, shape):
+        latencies = np.array([latency for _, latency in results]) * 1000
+        errors = sum(1 for status_code, _ in results if status_code != 201)
+        self.stdout.write(
+            f"{mode} ({shape}): {len(results)} requests in {elapsed:.2f}s = "
+            f"{len(results) / elapsed:.1f} req/s, "
+            f"p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms, "
+            f"errors {errors}"
+        )
@@ -0,0 +1,122 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google.generativeai as genai
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import gemini_client
+
+STUB_RESPONSE = json.dumps({
+    'candidates': [{
+        'content': {'parts': [{'text': 'Stub answer'}], 'role': 'model'},
+        'finishReason': 'STOP',
+        'index': 0,
+    }],
+    'usageMetadata': {'promptTokenCount': 4, 'candidatesTokenCount': 2, 'totalTokenCount': 6},
+}).encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every generateContent call with a fixed response, over keep-alive HTTP/1.1"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: with Nagle on, a reused
+    # connection waits for the client's delayed ACK (~40 ms) on every call
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(STUB_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(STUB_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.connections = 0
+        self._count_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._count_lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-call overhead of Gemini calls against a local stub server (REST "
+        "transport): configuring the SDK and building a model for every call "
+        "versus the shared client registry"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=300)
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent callers")
+        parser.add_argument('--latency', type=float, default=0.0, help="Stub server seconds per call")
+
+    def handle(self, *args, **options):
+        server = StubServer(options['latency'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+        def per_call():
+            genai.configure(api_key='benchmark', transport='rest', client_options={'api_endpoint': endpoint})
+            return genai.GenerativeModel(settings.GEMINI_MODEL)
+
+        def shared():
+            return gemini_client.get_model()
+
+        try:
+            for label, get_model in (('per-call client', per_call), ('shared registry', shared)):
+                if get_model is shared:
+                    gemini_client.configure(transport='rest', api_endpoint=endpoint, api_key='benchmark')
+                for threads in sorted({1, options['threads']}):
+                    server.connections = 0
+                    latencies, elapsed, failures = self._run(get_model, options['calls'], threads)
+                    self._report(label, threads, latencies, elapsed, failures, server.connections)
+        finally:
+            server.shutdown()
+            gemini_client.reset()
+
+    def _run(self, get_model, calls, threads):
+        def call(index):
+            started = time.perf_counter()
+            try:
+                get_model().generate_content(f"Benchmark prompt {index}")
+            except Exception as e:
+                return None, str(e)
+            return time.perf_counter() - started, None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(call, range(calls)))
+        elapsed = time.perf_counter() - started
+        failures = [error for latency, error in results if latency is None]
+        return [latency for latency, _ in results if latency is not None], elapsed, failures
+
+    def _report(self, label, threads, latencies, elapsed, failures, connections):
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f"{label}: every call failed, e.g. {failures[0]}"))
+            return
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{label:>16} x{threads:<2}  p50 {statistics.median(latencies) * 1000:6.2f} ms  "
+            f"p95 {p95 * 1000:6.2f} ms  {len(latencies) / elapsed:7.1f} calls/s  "
+            f"{connections:4d} connections  {len(failures)} failed"
+        )
@@ -0,0 +1,100 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from chat.context import estimate_tokens
+from chat.models import Conversation
+from chat.views import ConversationViewSet
+from chat.enhanced_ai_service import EnhancedAIService
+from chat.fake_gemini import FakeGenerativeModel, FakeEmbedder
+
+
+class PrefillCostModel(FakeGenerativeModel):
+    """Fake model whose latency grows with the prompt, like real prefill"""
+
+    def __init__(self, seconds_per_1k_tokens, **kwargs):
+        super().__init__(**kwargs)
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.history_sizes = []
+
+    def start_chat(self, history=None):
+        tokens = sum(estimate_tokens(part) for turn in history or [] for part in turn['parts'])
+        self.history_sizes.append((len(history or []), tokens))
+        time.sleep(self.seconds_per_1k_tokens * tokens / 1000)
+        return super().start_chat(history)
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate one long chat and report how per-turn latency, prompt size "
+        "and queries grow with conversation length, for the full transcript "
+        "versus the windowed context with a rolling summary"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=200)
+        parser.add_argument('--words', type=int, default=60, help="Words per user message and per reply")
+        parser.add_argument('--prefill', type=float, default=0.05, help="Fake model seconds per 1k prompt tokens")
+        parser.add_argument('--report-every', type=int, default=25)
+
+    def handle(self, *args, **options):
+        for label, window in (('full transcript', 0), ('windowed', None)):
+            ai_config = dict(settings.AI_CONFIG)
+            if window is not None:
+                ai_config['CONTEXT_WINDOW_MESSAGES'] = window
+            with override_settings(AI_CONFIG=ai_config):
+                self._run(label, options)
+
+    def _run(self, label, options):
+        words = options['words']
+        model = PrefillCostModel(
+            options['prefill'],
+            reply=lambda prompt: ' '.join(['answer'] * words),
+        )
+        service = EnhancedAIService(model=model, embedder=FakeEmbedder())
+        conversation = Conversation.objects.create(title='Context benchmark')
+        client = Client()
+
+        self.stdout.write(f"\n{label}")
+        self.stdout.write(f"{'turn':>6} {'latency ms':>11} {'history msgs':>13} {'prompt tokens':>14} {'queries':>8}")
+        total_tokens = 0
+        started = time.perf_counter()
+        try:
+            with mock.patch.object(ConversationViewSet, 'get_ai_service', lambda view: service), \
+                    mock.patch.object(ConversationViewSet, 'throttle_classes', []), \
+                    override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+                for turn in range(1, options['turns'] + 1):
+                    content = f"Question {turn} in chat {conversation.id}: " + ' '.join(['detail'] * words)
+                    turn_started = time.perf_counter()
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as queries:
+                        response = client.post(
+                            f"/api/conversations/{conversation.id}/send_message/",
+                            {'content': content},
+                            content_type='application/json',
+                        )
+                    latency = (time.perf_counter() - turn_started) * 1000
+                    if response.status_code != 201:
+                        self.stderr.write(f"Turn {turn} failed: {response.status_code} {response.content[:200]}")
+                        return
+
+                    history_messages, history_tokens = model.history_sizes[-1] if turn > 1 else (0, 0)
+                    prompt_tokens = history_tokens + estimate_tokens(content)
+                    total_tokens += prompt_tokens
+                    if turn == 1 or turn % options['report_every'] == 0:
+                        self.stdout.write(
+                            f"{turn:>6} {latency:>11.1f} {history_messages:>13} "
+                            f"{prompt_tokens:>14} {len(queries):>8}"
+                        )
+        finally:
+            conversation.delete()
+
+        self.stdout.write(
+            f"{options['turns']} turns in {time.perf_counter() - started:.1f}s, "
+            f"{total_tokens} prompt tokens in total"
+        )
@@ -0,0 +1,189 @@
+import random
+import statistics
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.bm25 import BM25Index, tokenize
+from chat.embedding_index import EmbeddingIndex
+from chat.search import reciprocal_rank_fusion
+
+# Each concept is a group of interchangeable words: conversations use some
+# of them, paraphrase queries use the others.
+CONCEPTS = [
+    ['billing', 'invoice', 'payment', 'charge'],
+    ['login', 'signin', 'authentication', 'credentials'],
+    ['slow', 'latency', 'sluggish', 'lag'],
+    ['crash', 'exception', 'failure', 'outage'],
+    ['refund', 'reimbursement', 'chargeback', 'repayment'],
+    ['migration', 'upgrade', 'transition', 'move'],
+    ['export', 'download', 'extract', 'backup'],
+    ['permissions', 'roles', 'access', 'privileges'],
+    ['email', 'mail', 'inbox', 'newsletter'],
+    ['mobile', 'phone', 'android', 'ios'],
+    ['report', 'dashboard', 'chart', 'analytics'],
+    ['subscription', 'plan', 'tier', 'renewal'],
+    ['search', 'lookup', 'query', 'find'],
+    ['upload', 'attachment', 'file', 'document'],
+    ['notification', 'alert', 'reminder', 'ping'],
+    ['password', 'passphrase', 'secret', 'passcode'],
+]
+FILLER = "please thanks issue customer team today again still problem help update".split()
+
+
+class ConceptEmbedder:
+    """
+    Offline stand-in for the embedding model: words of one concept share a
+    vector, so paraphrases land close together, while other tokens (ticket
+    ids included) only get a weak random direction.
+    """
+
+    def __init__(self, dimension=128, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dimension = dimension
+        self._vectors = {}
+        for words in CONCEPTS:
+            vector = rng.standard_normal(dimension)
+            for word in words:
+                self._vectors[word] = vector
+        self._rng_seed = seed
+
+    def embed(self, text):
+        vector = np.zeros(self.dimension)
+        for token in tokenize(text):
+            vector += self._vector(token)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+    def _vector(self, token):
+        vector = self._vectors.get(token)
+        if vector is None:
+            seed = abs(hash((self._rng_seed, token))) % (2 ** 32)
+            vector = 0.3 * np.random.default_rng(seed).standard_normal(self.dimension)
+            self._vectors[token] = vector
+        return vector
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline relevance benchmark of the conversation rankers: builds a "
+        "labelled synthetic corpus and reports MRR@10 and query latency for "
+        "semantic, BM25 and hybrid (weighted reciprocal rank fusion) ranking "
+        "on paraphrase, identifier and mixed queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=8, help="Messages per conversation")
+        parser.add_argument('--queries', type=int, default=200, help="Queries per query type")
+        parser.add_argument('--depth', type=int, default=50, help="Candidates per ranker before fusion")
+        parser.add_argument('--semantic-weight', type=float, default=None)
+        parser.add_argument('--lexical-weight', type=float, default=None)
+        parser.add_argument('--rrf-k', type=int, default=None)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        config = settings.AI_CONFIG
+        rng = random.Random(options['seed'])
+        embedder = ConceptEmbedder(seed=options['seed'])
+        weights = [
+            options['semantic_weight'] if options['semantic_weight'] is not None
+            else config.get('HYBRID_SEMANTIC_WEIGHT', 1.0),
+            options['lexical_weight'] if options['lexical_weight'] is not None
+            else config.get('HYBRID_LEXICAL_WEIGHT', 1.0),
+        ]
+        rrf_k = options['rrf_k'] if options['rrf_k'] is not None else config.get('RRF_K', 60)
+        depth = options['depth']
+
+        corpus = self._corpus(rng, options['conversations'], options['messages'])
+        queries = self._queries(rng, corpus, options['queries'])
+
+        started = time.perf_counter()
+        vectors = EmbeddingIndex()
+        vectors.load(
+            (conv_id, embedder.embed(' '.join([doc['title'], doc['summary']] + doc['messages'])))
+            for conv_id, doc in corpus.items()
+        )
+        bm25 = BM25Index(k1=config.get('BM25_K1', 1.2), b=config.get('BM25_B', 0.75))
+        bm25.load(
+            ((conv_id, doc['title'], doc['summary'], doc['topics']) for conv_id, doc in corpus.items()),
+            ((conv_id, content) for conv_id, doc in corpus.items() for content in doc['messages'])
+        )
+        self.stdout.write(
+            f"Indexed {len(corpus)} conversations in {time.perf_counter() - started:.1f}s; "
+            f"hybrid weights semantic={weights[0]} lexical={weights[1]}, k={rrf_k}"
+        )
+
+        def semantic(text):
+            return [conv_id for conv_id, _ in vectors.search(embedder.embed(text), k=depth)]
+
+        def lexical(text):
+            return [conv_id for conv_id, _ in bm25.search(text, k=depth)]
+
+        def hybrid(text):
+            return reciprocal_rank_fusion([semantic(text), lexical(text)], k=rrf_k, weights=weights)
+
+        rankers = [('semantic', semantic), ('bm25', lexical), ('hybrid', hybrid)]
+        self.stdout.write(f"\n{'ranker':<10} {'queries':<12} {'MRR@10':>7} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, ranker in rankers:
+            for kind, labelled in queries.items():
+                mrr, p50, p95 = self._evaluate(ranker, labelled)
+                self.stdout.write(f"{name:<10} {kind:<12} {mrr:>7.3f} {p50:>8.2f} {p95:>8.2f}")
+
+    def _corpus(self, rng, count, messages_per_conversation):
+        """Conversations about two concepts each, one with a unique ticket id"""
+        corpus = {}
+        for conv_id in range(1, count + 1):
+            concepts = rng.sample(range(len(CONCEPTS)), 2)
+            # Conversations only use the first two words of each concept
+            words = [word for concept in concepts for word in CONCEPTS[concept][:2]]
+            messages = []
+            for _ in range(messages_per_conversation):
+                messages.append(' '.join(rng.choice(words + FILLER) for _ in range(12)))
+            ticket = f"TKT-{conv_id:05d}"
+            messages[rng.randrange(len(messages))] += f" see {ticket}"
+            corpus[conv_id] = {
+                'title': ' '.join(CONCEPTS[concept][0] for concept in concepts),
+                'summary': f"Customer asked about {words[0]} and {words[2]}.",
+                'topics': [CONCEPTS[concept][0] for concept in concepts],
+                'messages': messages,
+                'concepts': concepts,
+                'ticket': ticket,
+            }
+        return corpus
+
+    def _queries(self, rng, corpus, count):
+        """
+        Labelled (query, relevant conversation ids) pairs:
+        paraphrase - synonyms never used in the corpus, any conversation
+                     about both concepts is relevant
+        identifier - a bare ticket id, exactly one conversation is relevant
+        mixed      - a paraphrase plus the ticket id
+        """
+        by_concepts = {}
+        for conv_id, doc in corpus.items():
+            by_concepts.setdefault(frozenset(doc['concepts']), set()).add(conv_id)
+
+        queries = {'paraphrase': [], 'identifier': [], 'mixed': []}
+        for conv_id in rng.sample(sorted(corpus), min(count, len(corpus))):
+            doc = corpus[conv_id]
+            paraphrase = ' '.join(rng.choice(CONCEPTS[concept][2:]) for concept in doc['concepts'])
+            queries['paraphrase'].append((f"problem with {paraphrase}", by_concepts[frozenset(doc['concepts'])]))
+            queries['identifier'].append((doc['ticket'], {conv_id}))
+            queries['mixed'].append((f"{paraphrase} {doc['ticket']}", {conv_id}))
+        return queries
+
+    def _evaluate(self, ranker, labelled):
+        reciprocal_ranks = []
+        latencies = []
+        for text, relevant in labelled:
+            started = time.perf_counter()
+            ranked = ranker(text)[:10]
+            latencies.append((time.perf_counter() - started) * 1000)
+            rank = next((position for position, conv_id in enumerate(ranked, 1) if conv_id in relevant), None)
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return statistics.mean(reciprocal_ranks), statistics.median(latencies), p95
@@ -0,0 +1,263 @@
+import itertools
+import json
+import platform
+import time
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from chat.context import ConversationContext
+from chat.bm25 import BM25Index
+from chat.embedding_index import EmbeddingIndex
+from chat.enhanced_ai_service import EnhancedAIService
+from chat.fake_gemini import FakeEmbedder, FakeGenerativeModel
+from chat.management.commands.benchmark_ann import parse_int_list, synthetic_embeddings
+from chat.models import Conversation, Message
+from chat.serializers import ConversationDetailSerializer, ConversationListSerializer
+from chat.views import ConversationViewSet
+
+TOPICS = ['python', 'billing', 'deployment', 'database', 'login', 'performance', 'mobile', 'security']
+SENTIMENTS = ['positive', 'neutral', 'negative']
+HOT_MESSAGES = 200  # Messages in the conversation used by the per-conversation components
+
+
+class Command(BaseCommand):
+    help = (
+        "Component benchmarks (semantic search and the bare embedding index "
+        "scan behind it, list/detail serialization and "
+        "endpoints, the send_message write path, summary prompts, chat history) "
+        "at several corpus sizes, against a deterministic fake Gemini. Results "
+        "can be saved as a JSON baseline and later runs compared to it; the "
+        "command fails when a component's p50 regresses beyond --tolerance. "
+        "Fixtures are created in a transaction that is rolled back."
+    )
+
+    COMPONENTS = [
+        'semantic_search',
+        'embedding_index_scan',
+        'serialize_list',
+        'list_endpoint',
+        'serialize_detail',
+        'detail_endpoint',
+        'send_message',
+        'summary_prompt',
+        'history',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=parse_int_list, default=[1000, 100000],
+            help="Conversation counts, e.g. 1000,100000,1000000"
+        )
+        parser.add_argument('--components', type=lambda value: value.split(','), default=self.COMPONENTS)
+        parser.add_argument('--iterations', type=int, default=200, help="Timed runs per component")
+        parser.add_argument('--max-seconds', type=float, default=5.0, help="Time cap per component")
+        parser.add_argument('--save', help="Write the results to this JSON baseline")
+        parser.add_argument('--compare', help="Baseline JSON to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p50 slowdown, 0.25 = 25%%")
+        parser.add_argument(
+            '--dim', type=int, default=768,
+            help="Embedding dimension; 1M x 768 vectors need ~3 GB, plus as much again to generate them"
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        unknown = set(options['components']) - set(self.COMPONENTS)
+        if unknown:
+            raise CommandError(f"Unknown components: {', '.join(sorted(unknown))}")
+
+        self.service = EnhancedAIService(model=FakeGenerativeModel(), embedder=FakeEmbedder(options['dim']))
+        self.client = Client()
+        self.indexes = {}
+        results = {}
+
+        # The service ranks with the fixture's indexes, not the process-wide ones
+        with mock.patch.multiple(
+                    'chat.enhanced_ai_service',
+                    get_embedding_index=lambda: self.indexes['embedding'],
+                    get_bm25_index=lambda: self.indexes['bm25'],
+                ), \
+                mock.patch.object(ConversationViewSet, 'get_ai_service', lambda view: self.service), \
+                mock.patch.object(ConversationViewSet, 'throttle_classes', []), \
+                override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+            for size in options['sizes']:
+                self.stdout.write(f"\n{size} conversations")
+                with transaction.atomic():
+                    fixture = self._seed(size, options['dim'], options['seed'])
+                    self.stdout.write(
+                        f"{'component':>20} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'runs':>6}"
+                    )
+                    for name in self.COMPONENTS:
+                        if name not in options['components']:
+                            continue
+                        operation = getattr(self, f'_build_{name}')(fixture)
+                        result = self._measure(operation, options['iterations'], options['max_seconds'])
+                        results[f'{name}@{size}'] = result
+                        self.stdout.write(
+                            f"{name:>20} {result['ops_per_sec']:>10.1f} {result['p50_ms']:>9.3f} "
+                            f"{result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['runs']:>6}"
+                        )
+                    transaction.set_rollback(True)
+
+        if options['save']:
+            self._save(options['save'], results, options)
+        if options['compare']:
+            self._compare(options['compare'], results, options['tolerance'])
+
+    def _seed(self, size, dimension, seed):
+        """Ended conversations with summaries and topics, plus one long active conversation"""
+        rng = np.random.default_rng(seed)
+        started = time.perf_counter()
+        batch_size = 5000
+        conversation_ids = []
+        for offset in range(0, size, batch_size):
+            count = min(batch_size, size - offset)
+            topic_picks = rng.integers(0, len(TOPICS), size=(count, 2))
+            conversations = []
+            for i in range(count):
+                topics = sorted({TOPICS[t] for t in topic_picks[i]})
+                conversations.append(Conversation(
+                    title=f"Conversation {offset + i}",
+                    status='ended',
+                    ended_at=timezone.now(),
+                    summary=f"Discussed {' and '.join(topics)} with the assistant.",
+                    key_topics=topics,
+                    topic_index=topics,
+                    sentiment=SENTIMENTS[(offset + i) % len(SENTIMENTS)],
+                    message_count=int(rng.integers(2, 40)),
+                ))
+            conversation_ids.extend(c.id for c in Conversation.objects.bulk_create(conversations))
+
+        hot = Conversation.objects.create(title='Benchmark conversation')
+        Message.objects.bulk_create(
+            Message(
+                conversation=hot,
+                sender='user' if i % 2 == 0 else 'ai',
+                content=f"Message {i} about {TOPICS[i % len(TOPICS)]}: " + 'details ' * 30,
+            )
+            for i in range(HOT_MESSAGES)
+        )
+        Conversation.recount_messages([hot.id])
+        hot.refresh_from_db()
+
+        vectors = synthetic_embeddings(size, dimension, clusters=200, seed=seed)
+        index = EmbeddingIndex()
+        index.load(zip(conversation_ids, vectors))
+        bm25 = BM25Index()
+        bm25.load_from_db()
+        self.indexes = {'embedding': index, 'bm25': bm25}
+        queries = vectors[rng.choice(size, min(size, 64), replace=False)]
+
+        self.stdout.write(f"  fixtures ready in {time.perf_counter() - started:.1f}s")
+        return {'hot': hot, 'index': index, 'queries': queries}
+
+    def _build_semantic_search(self, fixture):
+        """The whole retrieval path: query embedding, both rankers and their fusion"""
+        candidates = list(Conversation.objects.filter(status='ended').values('id', 'title'))
+        calls = itertools.count()
+
+        def search():
+            # A new question every call, so the embedding cache never answers
+            n = next(calls)
+            self.service.semantic_search(f"{TOPICS[n % len(TOPICS)]} question {n}", candidates, top_k=10)
+        return search
+
+    def _build_embedding_index_scan(self, fixture):
+        queries = fixture['queries']
+        calls = itertools.count()
+        return lambda: fixture['index'].search(queries[next(calls) % len(queries)], k=10)
+
+    def _build_serialize_list(self, fixture):
+        page = list(Conversation.objects.defer('embedding', 'embedding_vector', 'search_vector')
+                    .order_by('-created_at', '-id')[:20])
+        return lambda: ConversationListSerializer(page, many=True).data
+
+    def _build_list_endpoint(self, fixture):
+        return lambda: self._get('/api/conversations/')
+
+    def _build_serialize_detail(self, fixture):
+        conversation = Conversation.objects.prefetch_related('messages').get(pk=fixture['hot'].pk)
+        return lambda: ConversationDetailSerializer(conversation).data
+
+    def _build_detail_endpoint(self, fixture):
+        return lambda: self._get(f"/api/conversations/{fixture['hot'].pk}/")
+
+    def _build_send_message(self, fixture):
+        url = f"/api/conversations/{fixture['hot'].pk}/send_message/"
+        calls = itertools.count()
+
+        def send():
+            response = self.client.post(url, {'content': f"Question {next(calls)}"}, content_type='application/json')
+            if response.status_code != 201:
+                raise CommandError(f"send_message failed: {response.status_code} {response.content[:200]}")
+        return send
+
+    def _build_summary_prompt(self, fixture):
+        messages = list(fixture['hot'].messages.order_by('timestamp').values('sender', 'content'))
+        return lambda: self.service._build_summary_prompt(messages)
+
+    def _build_history(self, fixture):
+        conversation = fixture['hot']
+        return lambda: ConversationContext(conversation).load().history()
+
+    def _get(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} failed: {response.status_code}")
+
+    def _measure(self, operation, iterations, max_seconds):
+        for _ in range(3):
+            operation()
+
+        latencies = []
+        deadline = time.perf_counter() + max_seconds
+        while len(latencies) < iterations and time.perf_counter() < deadline:
+            started = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - started)
+
+        milliseconds = np.array(latencies) * 1000
+        return {
+            'runs': len(latencies),
+            'ops_per_sec': round(len(latencies) / sum(latencies), 2),
+            'p50_ms': round(float(np.percentile(milliseconds, 50)), 4),
+            'p95_ms': round(float(np.percentile(milliseconds, 95)), 4),
+            'p99_ms': round(float(np.percentile(milliseconds, 99)), 4),
+        }
+
+    def _save(self, path, results, options):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            'created_at': timezone.now().isoformat(),
+            'machine': platform.node(),
+            'python': platform.python_version(),
+            'iterations': options['iterations'],
+            'results': results,
+        }, indent=2, sort_keys=True))
+        self.stdout.write(self.style.SUCCESS(f"\nSaved baseline to {path}"))
+
+    def _compare(self, path, results, tolerance):
+        baseline = json.loads(Path(path).read_text())['results']
+        self.stdout.write(f"\nCompared with {path} (p50, tolerance {tolerance:.0%})")
+
+        regressions = []
+        for key in sorted(set(results) & set(baseline)):
+            ratio = results[key]['p50_ms'] / baseline[key]['p50_ms'] if baseline[key]['p50_ms'] else 1.0
+            flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+            if flag:
+                regressions.append(key)
+            self.stdout.write(
+                f"{key:>28} {baseline[key]['p50_ms']:>9.3f} -> {results[key]['p50_ms']:>9.3f} ms "
+                f"{ratio:>6.2f}x {flag}"
+            )
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} component(s) slower than the baseline: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
@@ -0,0 +1,61 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Move legacy JSON embeddings into the binary embedding_vector column "
+        "and clear the JSON copy. Safe to re-run; already converted rows are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = (
+            Conversation.objects
+            .filter(embedding__isnull=False)
+            .only('id', 'embedding')
+            .order_by('id')
+        )
+        total = pending.count()
+        self.stdout.write(f"Converting {total} embeddings")
+
+        converted = 0
+        started = time.perf_counter()
+        batch = []
+        for conversation in pending.iterator(chunk_size=batch_size):
+            vector = np.asarray(conversation.embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            conversation.embedding_vector = vector / norm if norm else vector
+            conversation.embedding = None
+            batch.append(conversation)
+
+            if len(batch) >= batch_size:
+                converted += self._flush(batch)
+                batch = []
+                self.stdout.write(f"  {converted}/{total}")
+
+        if batch:
+            converted += self._flush(batch)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {converted} embeddings in {elapsed:.1f}s. "
+            f"Running processes pick them up at their next search index sync."
+        ))
+
+    def _flush(self, batch):
+        # updated_at moves so running processes pick the vectors up (chat.index_sync)
+        now = timezone.now()
+        for conversation in batch:
+            conversation.updated_at = now
+        with transaction.atomic():
+            Conversation.objects.bulk_update(batch, ['embedding_vector', 'embedding', 'updated_at'])
+        return len(batch)
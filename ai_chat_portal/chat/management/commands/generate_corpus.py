@@ -0,0 +1,303 @@
+import io
+import multiprocessing
+import os
+import time
+from collections import Counter
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from chat import analytics
+from chat.models import Conversation, Message, Topic
+from chat.search import conversation_vector, message_vector
+
+WORDS = (
+    "python billing deployment database login performance mobile security search "
+    "export import upload email notification report dashboard subscription refund "
+    "migration backup permissions api webhook cache latency timeout invoice pricing "
+    "onboarding docker kubernetes logging metrics alerts frontend backend testing "
+    "release analytics storage network"
+).split()
+FILLER = (
+    "please could you explain how we should handle the issue with again today "
+    "it seems that after the update our team still sees this when we try to"
+).split()
+REPLIES = (
+    "here is what I recommend first check the configuration then verify that "
+    "the settings match and retry if the problem persists consider updating"
+).split()
+SENTIMENTS = ['positive', 'neutral', 'negative']
+SENTIMENT_WEIGHTS = [0.5, 0.35, 0.15]
+LATENT_DIMENSION = 48
+
+CONVERSATION_COLUMNS = (
+    'id', 'title', 'status', 'created_at', 'ended_at', 'summary', 'key_topics', 'action_items',
+    'topic_index', 'sentiment', 'analysis_status', 'message_count', 'total_tokens',
+    'last_message_at', 'context_summary', 'embedding_vector', 'version', 'updated_at',
+)
+MESSAGE_COLUMNS = ('conversation_id', 'sender', 'content', 'timestamp', 'tokens_used')
+
+
+def topic_vocabulary(size):
+    """`size` distinct topic names: single words first, then two-word combinations"""
+    names = list(WORDS)
+    for first in WORDS:
+        for second in WORDS:
+            if len(names) >= size:
+                return names[:size]
+            if first != second:
+                names.append(f"{first} {second}")
+    return names[:size]
+
+
+def _array(values):
+    return '{' + ','.join(f'"{value}"' for value in values) + '}'
+
+
+def _timestamps(seconds):
+    """Epoch seconds -> timestamptz literals, vectorized"""
+    return [
+        f'{value}+00' for value in
+        np.datetime_as_string((np.asarray(seconds) * 1e6).astype('datetime64[us]'), unit='us')
+    ]
+
+
+def _generate_chunk(task):
+    """
+    Rows for one chunk of conversations, as COPY text buffers. Depends only
+    on the seed and the chunk index, so the corpus is the same whatever the
+    number of workers.
+    """
+    options = task['options']
+    count = task['count']
+    first_id = task['first_id']
+    rng = np.random.default_rng([options['seed'], task['chunk']])
+    topics = task['topics']
+
+    # Conversation length: log-normal around the mean, at least one exchange
+    sigma = options['length_sigma']
+    mu = np.log(options['mean_messages']) - sigma ** 2 / 2
+    lengths = np.clip(np.rint(rng.lognormal(mu, sigma, count)), 2, options['max_messages']).astype(int)
+
+    # Topics: Zipf-skewed popularity, 1-4 per conversation
+    topic_counts = rng.integers(1, 5, count)
+    topic_picks = rng.choice(len(topics), size=(count, 4), p=task['topic_weights'])
+    ended = rng.random(count) >= options['active_fraction']
+    sentiments = rng.choice(len(SENTIMENTS), count, p=SENTIMENT_WEIGHTS)
+
+    # Embeddings cluster by the primary topic
+    vectors = None
+    if options['dim']:
+        clusters = topic_picks[:, 0] % options['clusters']
+        latent = task['centers'][clusters] + 0.5 * rng.standard_normal((count, LATENT_DIMENSION)).astype(np.float32)
+        vectors = latent @ task['projection']
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    # Message times: exponential gaps (mean 2 minutes) from the creation
+    # time, which is drawn so that every conversation ends before `now`
+    total_messages = int(lengths.sum())
+    gaps = rng.exponential(120.0, total_messages)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    elapsed = np.cumsum(gaps)
+    since_creation = elapsed - np.repeat(elapsed[offsets] - gaps[offsets], lengths)
+    durations = since_creation[offsets + lengths - 1]
+    created = task['now'] - 60 - durations - rng.random(count) * options['days'] * 86400
+    times = np.repeat(created, lengths) + since_creation
+    last_times = times[offsets + lengths - 1]
+    message_stamps = _timestamps(times)
+    created_stamps = _timestamps(created)
+    last_stamps = _timestamps(last_times)
+    ended_stamps = _timestamps(last_times + 60)
+    words_per_message = rng.integers(6, 40, total_messages)
+    filler_picks = rng.integers(0, len(FILLER), total_messages)
+
+    conversation_rows = io.StringIO()
+    message_rows = io.StringIO()
+    topic_totals = Counter()
+    position = 0
+    for i in range(count):
+        names = list(dict.fromkeys(topics[t] for t in topic_picks[i, :topic_counts[i]]))
+        topic_totals.update(names)
+        n = lengths[i]
+        conversation_id = first_id + i
+
+        tokens = 0
+        subject = ' and '.join(names)
+        for j in range(n):
+            k = position + j
+            words = words_per_message[k]
+            if j % 2 == 0:
+                sender = 'user'
+                content = f"{' '.join(FILLER[filler_picks[k]:filler_picks[k] + 6])} {subject}"
+                used = 0
+            else:
+                sender = 'ai'
+                content = f"About {subject}: {' '.join(REPLIES[:words % len(REPLIES) + 1])}"
+                used = int(words * 1.3)
+                tokens += used
+            message_rows.write(f"{conversation_id}\t{sender}\t{content}\t{message_stamps[k]}\t{used}\n")
+        position += n
+
+        if ended[i]:
+            status, ended_at = 'ended', ended_stamps[i]
+            summary = f"The user asked about {subject} and the assistant walked through the options."
+            sentiment = SENTIMENTS[sentiments[i]]
+            actions = [f"Follow up on {names[0]}"] if sentiments[i] else []
+            analysis = 'completed'
+            embedding = '\\\\x' + vectors[i].astype('<f4').tobytes().hex() if vectors is not None else '\\N'
+        else:
+            status, ended_at, summary, sentiment, actions, analysis, embedding = (
+                'active', '\\N', '', '', [], '', '\\N'
+            )
+        conversation_rows.write('\t'.join(map(str, (
+            conversation_id, f"{names[0].title()} question {task['offset'] + i + 1}", status,
+            created_stamps[i], ended_at, summary, _array(names), _array(actions),
+            _array(names), sentiment, analysis, n, tokens, last_stamps[i], '', embedding,
+            0, ended_at if ended[i] else last_stamps[i],
+        ))) + '\n')
+
+    conversation_rows.seek(0)
+    message_rows.seek(0)
+    return conversation_rows, message_rows, total_messages, topic_totals
+
+
+def _load_chunk(task):
+    """Worker: generate a chunk and COPY it in, with its search vectors, in one transaction"""
+    started = time.perf_counter()
+    conversation_rows, message_rows, total_messages, topic_totals = _generate_chunk(task)
+    generated = time.perf_counter()
+
+    last_id = task['first_id'] + task['count'] - 1
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {Conversation._meta.db_table} ({', '.join(CONVERSATION_COLUMNS)}) FROM STDIN",
+            conversation_rows
+        )
+        cursor.copy_expert(
+            f"COPY {Message._meta.db_table} ({', '.join(MESSAGE_COLUMNS)}) FROM STDIN",
+            message_rows
+        )
+        vectors_started = time.perf_counter()
+        if task['options']['search_vectors']:
+            Conversation.objects.filter(id__range=(task['first_id'], last_id)).update(
+                search_vector=conversation_vector()
+            )
+            Message.objects.filter(conversation_id__gte=task['first_id'], conversation_id__lte=last_id).update(
+                search_vector=message_vector()
+            )
+        vectors = time.perf_counter() - vectors_started
+    return {
+        'conversations': task['count'],
+        'messages': total_messages,
+        'topics': topic_totals,
+        'generate': generated - started,
+        'copy': time.perf_counter() - generated - vectors,
+        'vectors': vectors,
+    }
+
+
+def _worker_init():
+    # Connections must not be shared with the parent process
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic corpus for scale testing: conversations with "
+        "summaries, topics, sentiments and normalized embeddings, and their "
+        "messages, loaded with COPY from several processes. Reproducible for a "
+        "given --seed and --batch-size (on a given day). Counters are filled in directly; search "
+        "vectors, Topic counts and the analytics rollups are brought up to date "
+        "unless skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=100000)
+        parser.add_argument('--mean-messages', type=float, default=10.0, help="Mean conversation length")
+        parser.add_argument('--length-sigma', type=float, default=0.8, help="Log-normal spread of lengths")
+        parser.add_argument('--max-messages', type=int, default=500)
+        parser.add_argument('--topics', type=int, default=200, help="Topic vocabulary size")
+        parser.add_argument('--topic-skew', type=float, default=1.1, help="Zipf exponent of topic popularity")
+        parser.add_argument('--clusters', type=int, default=100, help="Embedding clusters")
+        parser.add_argument('--dim', type=int, default=768, help="Embedding dimension, 0 = no embeddings")
+        parser.add_argument('--active-fraction', type=float, default=0.1, help="Conversations left active")
+        parser.add_argument('--days', type=int, default=365, help="Spread of creation dates")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=10000, help="Conversations per COPY chunk")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-search-vectors', dest='search_vectors', action='store_false')
+        parser.add_argument('--no-rollups', dest='rollups', action='store_false',
+                            help="Skip the Topic counts and the analytics rebuild")
+
+    def handle(self, *args, **options):
+        total = options['conversations']
+        if total <= 0:
+            raise CommandError("--conversations must be positive")
+
+        rng = np.random.default_rng(options['seed'])
+        topics = topic_vocabulary(options['topics'])
+        weights = 1.0 / np.arange(1, len(topics) + 1) ** options['topic_skew']
+        shared = {
+            'options': {key: options[key] for key in (
+                'seed', 'mean_messages', 'length_sigma', 'max_messages', 'active_fraction',
+                'days', 'dim', 'clusters', 'search_vectors',
+            )},
+            'topics': topics,
+            'topic_weights': weights / weights.sum(),
+            'centers': rng.standard_normal((options['clusters'], LATENT_DIMENSION)).astype(np.float32),
+            'projection': rng.standard_normal((LATENT_DIMENSION, max(options['dim'], 1))).astype(np.float32),
+            # Dates end at today's midnight (UTC), so a seed gives the same corpus all day
+            'now': time.time() // 86400 * 86400,
+        }
+
+        first_id = self._reserve_ids(total)
+        tasks = [
+            dict(
+                shared, chunk=chunk, offset=offset, first_id=first_id + offset,
+                count=min(options['batch_size'], total - offset)
+            )
+            for chunk, offset in enumerate(range(0, total, options['batch_size']))
+        ]
+
+        started = time.perf_counter()
+        totals = Counter()
+        topic_totals = Counter()
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(options['workers'], initializer=_worker_init) as pool:
+            for result in pool.imap_unordered(_load_chunk, tasks):
+                topic_totals.update(result.pop('topics'))
+                totals.update(result)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"  {totals['conversations']}/{total} conversations, {totals['messages']} messages, "
+                    f"{(totals['conversations'] + totals['messages']) / elapsed:,.0f} rows/s"
+                )
+        loaded = time.perf_counter() - started
+
+        if options['rollups']:
+            Topic.adjust(topic_totals)
+            analytics.rebuild()
+        finished = time.perf_counter() - started
+
+        rows = totals['conversations'] + totals['messages']
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {totals['conversations']} conversations (ids {first_id}-{first_id + total - 1}) and "
+            f"{totals['messages']} messages in {loaded:.1f}s, {rows / loaded:,.0f} rows/s; "
+            f"{finished:.1f}s with rollups"
+        ))
+        self.stdout.write(
+            f"Worker time: generate {totals['generate']:.1f}s, COPY {totals['copy']:.1f}s, "
+            f"search vectors {totals['vectors']:.1f}s"
+        )
+
+    def _reserve_ids(self, count):
+        """Advance the conversation id sequence past `count` ids and return the first one"""
+        table = Conversation._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s)",
+                [table, table, count - 1]
+            )
+            last_id = cursor.fetchone()[0]
+        return last_id - count + 1
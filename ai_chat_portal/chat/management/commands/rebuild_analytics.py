@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily analytics rollups from conversations, messages "
+        "and queries, e.g. after bulk imports or when first deploying them"
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        days = analytics.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt analytics for {days} days in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.embedding_index import create_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Retrain the IVF-PQ index on the stored conversation embeddings and "
+        "save it to AI_CONFIG['ANN_INDEX_PATH']. Running processes keep their "
+        "current index until they restart or retrain on their own."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help="Output file, defaults to ANN_INDEX_PATH")
+
+    def handle(self, *args, **options):
+        index = create_index('ivfpq')
+        index.path = options['path'] or settings.AI_CONFIG.get('ANN_INDEX_PATH')
+        if not index.path:
+            self.stderr.write("No --path given and ANN_INDEX_PATH is empty")
+            return
+
+        started = time.perf_counter()
+        index.rebuild()
+        if not index.is_trained:
+            self.stderr.write(f"Need at least {index.KSUB} embeddings to train, found {len(index)}")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained on {index._trained_size} vectors, indexed {len(index)} "
+            f"in {time.perf_counter() - started:.1f}s; saved to {index.path}"
+        ))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.models import Conversation, Message
+from chat.search import update_conversation_vectors, update_message_vectors
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the full-text search vectors of conversations and messages, "
+        "e.g. after bulk imports or a change of FTS_CONFIG"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--missing', action='store_true', help="Only rows that have no vector yet")
+
+    def handle(self, *args, **options):
+        self._rebuild('conversations', Conversation.objects, update_conversation_vectors, options)
+        self._rebuild('messages', Message.objects, update_message_vectors, options)
+
+    def _rebuild(self, label, manager, update, options):
+        rows = manager.all()
+        if options['missing']:
+            rows = rows.filter(search_vector__isnull=True)
+        ids = rows.order_by('id').values_list('id', flat=True)
+
+        updated = 0
+        started = time.perf_counter()
+        batch = []
+        for row_id in ids.iterator(chunk_size=options['batch_size']):
+            batch.append(row_id)
+            if len(batch) >= options['batch_size']:
+                updated += update(batch)
+                batch = []
+        if batch:
+            updated += update(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {updated} {label} vectors in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,53 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Conversation, Topic, normalize_topics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the normalized topic_index of every conversation and the "
+        "per-topic conversation counts, e.g. after bulk imports or when first "
+        "adding the index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = Counter()
+        updated = 0
+        batch = []
+
+        rows = Conversation.objects.order_by('id').values_list('id', 'key_topics', 'topic_index')
+        for conversation_id, key_topics, topic_index in rows.iterator(chunk_size=options['batch_size']):
+            normalized = normalize_topics(key_topics)
+            counts.update(normalized)
+            if normalized != topic_index:
+                batch.append(Conversation(id=conversation_id, topic_index=normalized))
+            if len(batch) >= options['batch_size']:
+                updated += self._save(batch)
+                batch = []
+        if batch:
+            updated += self._save(batch)
+
+        with transaction.atomic():
+            Topic.objects.all().delete()
+            Topic.objects.bulk_create(
+                [Topic(name=name, conversation_count=count) for name, count in counts.items()],
+                batch_size=options['batch_size']
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {updated} conversations and counted {len(counts)} topics "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def _save(self, conversations):
+        # bulk_update bypasses save(), so Topic counts are rebuilt above
+        Conversation.objects.bulk_update(conversations, ['topic_index'])
+        return len(conversations)
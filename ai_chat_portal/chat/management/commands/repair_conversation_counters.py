@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized message_count, total_tokens and "
+        "last_message_at of conversations from their messages, e.g. after "
+        "bulk imports, message deletions or when first adding the columns"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        ids = Conversation.objects.order_by('id').values_list('id', flat=True)
+
+        updated = 0
+        started = time.perf_counter()
+        batch = []
+        for conversation_id in ids.iterator(chunk_size=options['batch_size']):
+            batch.append(conversation_id)
+            if len(batch) >= options['batch_size']:
+                updated += Conversation.recount_messages(batch)
+                batch = []
+        if batch:
+            updated += Conversation.recount_messages(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recounted {updated} conversations in {time.perf_counter() - started:.1f}s"
+        ))
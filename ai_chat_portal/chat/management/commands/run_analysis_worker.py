@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.jobs import AnalysisJobQueue, get_job_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Run analysis workers outside the web process. Jobs are claimed with "
+        "SKIP LOCKED, so any number of these can run next to the web servers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Defaults to AI_CONFIG['ANALYSIS_WORKERS']")
+        parser.add_argument('--stats-interval', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        queue = get_job_queue()
+        if options['workers']:
+            queue = AnalysisJobQueue(
+                workers=options['workers'],
+                max_attempts=queue.max_attempts,
+                backoff_base=queue.backoff_base,
+            )
+        queue.start()
+        self.stdout.write(f"Running {queue.workers} analysis workers, Ctrl+C to stop")
+
+        try:
+            while True:
+                time.sleep(options['stats_interval'])
+                stats = queue.stats()
+                self.stdout.write(
+                    f"queued {stats['queue_depth']}, running {stats['running']}, "
+                    f"{stats['throughput_per_minute']}/min, processed {stats['processed']}"
+                )
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers")
+            queue.stop(timeout=30)
@@ -0,0 +1,336 @@
+"""
+In-process metrics: latency histograms, counters and per-request timings.
+
+EnhancedAIService methods (wrapped by `instrument`), database queries and
+every request (MetricsMiddleware) record into a process-wide registry that
+`GET /metrics` renders in the Prometheus text format. Cache hit ratios are
+read from the LLM and answer caches at scrape time.
+
+While a request is being served, the same measurements are also summed into
+a RequestTimings bound to a context variable, which becomes the response's
+Server-Timing header (database time and query count, time and calls per
+service method, tokens, total).
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Request latency by endpoint"),
+    'http_request_db_queries': ('histogram', "Database queries per request"),
+    'http_request_db_seconds': ('histogram', "Database time per request"),
+    'http_request_tokens_total': ('counter', "Model tokens spent by requests"),
+    'ai_service_call_seconds': ('histogram', "EnhancedAIService method latency"),
+    'ai_service_errors_total': ('counter', "EnhancedAIService methods that raised"),
+    'llm_tokens_total': ('counter', "Tokens reported by the model"),
+    'db_queries_total': ('counter', "Database queries executed"),
+    'db_query_seconds_total': ('counter', "Time spent executing database queries"),
+    'llm_cache_lookups_total': ('counter', "Model response cache lookups by result"),
+    'llm_cache_hit_ratio': ('gauge', "Model response cache hit ratio"),
+    'llm_cache_entries': ('gauge', "Entries in the in-process model response cache"),
+    'answer_cache_lookups_total': ('counter', "Semantic answer cache lookups by result"),
+    'answer_cache_hit_ratio': ('gauge', "Semantic answer cache hit ratio"),
+    'answer_cache_saved_seconds_total': ('counter', "Model time saved by answer cache hits"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe labelled histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = defaultdict(float)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        samples = defaultdict(list)
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    samples[name].append((f'{name}_bucket', labels + (('le', _number(bound)),), cumulative))
+                samples[name].append((f'{name}_bucket', labels + (('le', '+Inf'),), histogram.count))
+                samples[name].append((f'{name}_sum', labels, histogram.sum))
+                samples[name].append((f'{name}_count', labels, histogram.count))
+            for (name, labels), value in self._counters.items():
+                samples[name].append((name, labels, value))
+        for name, labels, value in _cache_samples():
+            samples[name].append((name, labels, value))
+
+        lines = []
+        for name in sorted(samples):
+            kind, description = METRICS.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample, labels, value in sorted(samples[name], key=lambda s: (s[1], s[0])):
+                lines.append(f'{sample}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _cache_samples():
+    from .answer_cache import get_answer_cache
+    from .llm_cache import get_llm_cache
+
+    llm = get_llm_cache().stats()
+    answers = get_answer_cache().stats()
+    return [
+        ('llm_cache_lookups_total', (('result', 'hit'),), llm['hits']),
+        ('llm_cache_lookups_total', (('result', 'shared_hit'),), llm['shared_hits']),
+        ('llm_cache_lookups_total', (('result', 'miss'),), llm['misses']),
+        ('llm_cache_hit_ratio', (), llm['hit_rate']),
+        ('llm_cache_entries', (), llm['size']),
+        ('answer_cache_lookups_total', (('result', 'hit'),), answers['hits']),
+        ('answer_cache_lookups_total', (('result', 'miss'),), answers['misses']),
+        ('answer_cache_hit_ratio', (), answers['hit_rate']),
+        ('answer_cache_saved_seconds_total', (), answers['saved_seconds']),
+    ]
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    """The process-wide registry"""
+    return _registry
+
+
+class RequestTimings:
+    """Durations and counts summed over one request, for Server-Timing"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.tokens = 0
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+
+    def add_tokens(self, tokens):
+        with self._lock:
+            self.tokens += tokens
+
+    def header(self, total):
+        with self._lock:
+            entries = [f'db;dur={self.seconds["db"] * 1000:.1f};desc="{self.calls["db"]} queries"']
+            entries += [
+                f'{name};dur={seconds * 1000:.1f};desc="{self.calls[name]} calls"'
+                for name, seconds in sorted(self.seconds.items()) if name != 'db'
+            ]
+            if self.tokens:
+                entries.append(f'tokens;desc="{self.tokens}"')
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def current_timings():
+    """RequestTimings of the request being served, or None"""
+    return _current.get()
+
+
+def record_tokens(tokens, model=''):
+    """Count model tokens for the process and the current request"""
+    if not tokens:
+        return
+    _registry.inc('llm_tokens_total', tokens, model=model)
+    timings = _current.get()
+    if timings is not None:
+        timings.add_tokens(tokens)
+
+
+def time_query(execute, sql, params, many, context):
+    """connection.execute_wrapper timing every query"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        _registry.inc('db_queries_total')
+        _registry.inc('db_query_seconds_total', elapsed)
+        timings = _current.get()
+        if timings is not None:
+            timings.add('db', elapsed)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver adding time_query to every connection"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def instrument(cls):
+    """
+    Class decorator timing every public method (sync, async or generator)
+    into ai_service_call_seconds{method} and the current request's timings.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(func):
+            continue
+        setattr(cls, name, _timed(name, func))
+    return cls
+
+
+def _observe(method, started, failed):
+    elapsed = time.perf_counter() - started
+    _registry.observe('ai_service_call_seconds', elapsed, method=method)
+    if failed:
+        _registry.inc('ai_service_errors_total', method=method)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(method, elapsed)
+
+
+def _timed(method, func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _observe(method, started, failed)
+    elif inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Timed until the stream is exhausted
+            started = time.perf_counter()
+            failed = True
+            try:
+                yield from func(*args, **kwargs)
+                failed = False
+            finally:
+                _observe(method, started, failed)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _observe(method, started, failed)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Times every request into the http_request_* metrics, labelled with the
+    URL name (one per viewset action), and adds the Server-Timing header
+    when settings.SERVER_TIMING is on. Works under WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'SERVER_TIMING', True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - started)
+
+    async def _acall(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - started)
+
+    def _finish(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = (match.url_name or match.view_name) if match else 'unmatched'
+        labels = {'endpoint': endpoint, 'method': request.method}
+
+        _registry.observe(
+            'http_request_duration_seconds', total, status=str(response.status_code), **labels
+        )
+        _registry.observe('http_request_db_queries', timings.calls['db'], buckets=COUNT_BUCKETS, **labels)
+        _registry.observe('http_request_db_seconds', timings.seconds['db'], **labels)
+        if timings.tokens:
+            _registry.inc('http_request_tokens_total', timings.tokens, **labels)
+
+        if self.server_timing:
+            response['Server-Timing'] = timings.header(total)
+        return response
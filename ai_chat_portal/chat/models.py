@@ -1,7 +1,25 @@
+from collections import Counter
+
 from django.db import models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 
+from .fields import EmbeddingField
+
+
+def normalize_topics(topics):
+    """Lowercased, whitespace-collapsed topics without duplicates, in first-seen order"""
+    normalized = []
+    for topic in topics or []:
+        topic = ' '.join(str(topic).lower().split())[:100]
+        if topic and topic not in normalized:
+            normalized.append(topic)
+    return normalized
+
 
 class Conversation(models.Model):
     """
@@ -33,29 +51,175 @@ class Conversation(models.Model):
         default=list,
         help_text="Extracted action items"
     )
+    # Normalized copy of key_topics for indexed topic filters, kept in step
+    # by save(); `manage.py rebuild_topic_index` repairs it after bulk writes
+    topic_index = ArrayField(
+        models.CharField(max_length=100),
+        blank=True,
+        default=list,
+        editable=False
+    )
     sentiment = models.CharField(
         max_length=20,
         blank=True,
         help_text="Overall conversation sentiment"
     )
     
-    # For semantic search - store embedding as JSON
-    embedding = models.JSONField(
+    ANALYSIS_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    analysis_status = models.CharField(
+        max_length=10,
+        choices=ANALYSIS_STATUS_CHOICES,
+        blank=True,
+        help_text="State of the background summary/embedding job"
+    )
+    
+    # Denormalized from the messages so lists and activity sorting stay on
+    # this table. Maintained by record_message() as messages are created;
+    # `manage.py repair_conversation_counters` recomputes them.
+    message_count = models.PositiveIntegerField(default=0)
+    total_tokens = models.PositiveBigIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    
+    # Rolling summary of the turns that slid out of the chat context window
+    context_summary = models.TextField(
+        blank=True,
+        help_text="Running summary of older turns, sent in place of the full transcript"
+    )
+    context_summarized_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Timestamp of the last message folded into context_summary"
+    )
+    
+    # Validators for conditional GETs (ETag / Last-Modified): bumped by
+    # save(), record_message() and every queryset.update() of a field the
+    # API returns, through changed()
+    version = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+    
+    # Full-text search over title, topics and summary, maintained by chat.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    # For semantic search - normalized float32 vector in a bytea column
+    embedding_vector = EmbeddingField(
         null=True,
         blank=True,
         help_text="Vector embedding for semantic search"
     )
     
+    # Legacy JSON embedding, superseded by embedding_vector.
+    # Emptied by `manage.py convert_embeddings`.
+    embedding = models.JSONField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Deprecated: JSON vector embedding"
+    )
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['-created_at']),
+            models.Index(fields=['-created_at', '-id']),
             models.Index(fields=['status']),
+            models.Index(fields=['ended_at']),
+            models.Index(fields=['updated_at']),  # Search index sync watermark
+            models.Index(
+                F('last_message_at').desc(nulls_last=True),
+                name='conversation_last_message_idx'
+            ),
+            GinIndex(fields=['search_vector']),
+            GinIndex(fields=['topic_index']),
         ]
     
     def __str__(self):
         return f"{self.title or 'Untitled'} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored topics so save() can adjust the Topic counts
+        if 'topic_index' in field_names:
+            instance._stored_topic_index = instance.topic_index
+        # ...and the stored outcome, so the analytics rollups can move it
+        if Conversation.OUTCOME_FIELDS.issubset(field_names):
+            instance._stored_outcome = instance.outcome()
+        return instance
+    
+    # Maintained with queryset.update() (record_message, recount_messages, the
+    # context folds). save() without update_fields leaves them out, so a full
+    # save of an instance loaded earlier cannot write back stale copies over
+    # concurrent updates; name them in update_fields to write them.
+    UPDATE_ONLY_FIELDS = frozenset({
+        'message_count', 'total_tokens', 'last_message_at', 'context_summary', 'context_summarized_until'
+    })
+    
+    # Fields behind outcome()
+    OUTCOME_FIELDS = frozenset({'status', 'created_at', 'ended_at', 'sentiment', 'topic_index'})
+    
+    def outcome(self):
+        """
+        What this conversation contributes to the daily analytics rollups:
+        (day ended, duration in minutes, sentiment, topics), or None while
+        it has not ended.
+        """
+        if self.status != 'ended' or self.ended_at is None:
+            return None
+        return (
+            timezone.localdate(self.ended_at),
+            (self.ended_at - self.created_at).total_seconds() / 60,
+            self.sentiment,
+            tuple(self.topic_index),
+        )
+    
+    @staticmethod
+    def changed():
+        """update() kwargs that bump the conditional-GET validators"""
+        return {'version': F('version') + 1, 'updated_at': timezone.now()}
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.UPDATE_ONLY_FIELDS
+                and field.attname not in deferred
+            ]
+        if update_fields is not None:
+            update_fields = kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
+        topics_written = (
+            'key_topics' not in self.get_deferred_fields() and
+            (update_fields is None or 'key_topics' in update_fields)
+        )
+        if not topics_written:
+            return super().save(*args, **kwargs)
+        
+        if self._state.adding:
+            stored = []
+        elif hasattr(self, '_stored_topic_index'):
+            stored = self._stored_topic_index
+        else:
+            stored = Conversation.objects.filter(pk=self.pk).values_list('topic_index', flat=True).first() or []
+        self.topic_index = normalize_topics(self.key_topics)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'topic_index'}
+        super().save(*args, **kwargs)
+        
+        Topic.adjust(
+            added=set(self.topic_index) - set(stored),
+            removed=set(stored) - set(self.topic_index)
+        )
+        self._stored_topic_index = self.topic_index
+    
     def get_duration(self):
         """Calculate conversation duration in minutes"""
         if self.ended_at:
@@ -64,8 +228,42 @@ class Conversation(models.Model):
         return None
     
     def get_message_count(self):
-        """Get total message count"""
-        return self.messages.count()
+        """Get total message count (denormalized, no query)"""
+        return self.message_count
+    
+    @classmethod
+    def record_message(cls, message):
+        """
+        Add a newly created message to its conversation's counters with one
+        atomic UPDATE, so concurrent writers never lose an increment. A
+        conversation instance cached on the message (the one the caller
+        created it with) is updated in memory to match.
+        """
+        cls.objects.filter(pk=message.conversation_id).update(
+            message_count=F('message_count') + 1,
+            total_tokens=F('total_tokens') + message.tokens_used,
+            # GREATEST skips NULL, so the first message sets the value
+            last_message_at=Greatest('last_message_at', Value(message.timestamp)),
+            **cls.changed()
+        )
+        if Message.conversation.is_cached(message):
+            conversation = message.conversation
+            conversation.message_count += 1
+            conversation.total_tokens += message.tokens_used
+            conversation.version += 1
+            if conversation.last_message_at is None or conversation.last_message_at < message.timestamp:
+                conversation.last_message_at = message.timestamp
+    
+    @classmethod
+    def recount_messages(cls, conversation_ids):
+        """Recompute the counters from the messages; returns the number of rows updated"""
+        messages = Message.objects.filter(conversation=OuterRef('pk')).order_by().values('conversation')
+        return cls.objects.filter(pk__in=conversation_ids).update(
+            message_count=Coalesce(Subquery(messages.annotate(total=Count('id')).values('total')), 0),
+            total_tokens=Coalesce(Subquery(messages.annotate(total=Sum('tokens_used')).values('total')), 0),
+            last_message_at=Subquery(messages.annotate(last=Max('timestamp')).values('last')),
+            **cls.changed()
+        )
 
 
 class Message(models.Model):
@@ -91,16 +289,82 @@ class Message(models.Model):
     # Optional: store tokens used for cost tracking
     tokens_used = models.IntegerField(default=0, help_text="Tokens used for this message")
     
+    # Full-text search over content, maintained by chat.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     class Meta:
         ordering = ['timestamp']
         indexes = [
-            models.Index(fields=['conversation', 'timestamp']),
+            models.Index(fields=['conversation', 'timestamp', 'id']),
+            GinIndex(fields=['search_vector']),
         ]
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        content_written = (
+            'content' not in self.get_deferred_fields() and
+            (update_fields is None or 'content' in update_fields)
+        )
+        if not content_written:
+            return super().save(*args, **kwargs)
+        
+        from .search import message_vector
+        
+        # Computed by the same INSERT/UPDATE instead of a second statement per message
+        self.search_vector = message_vector(self.content)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_vector'}
+        super().save(*args, **kwargs)
+        # Holds the expression, not its result: load the vector on access
+        del self.search_vector
+    
     def __str__(self):
         return f"{self.sender}: {self.content[:50]}..."
 
 
+class Topic(models.Model):
+    """
+    A normalized topic and the number of conversations tagged with it,
+    maintained as conversations are saved and deleted.
+    """
+    
+    name = models.CharField(max_length=100, unique=True)
+    conversation_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-conversation_count', 'name']
+        indexes = [
+            models.Index(fields=['-conversation_count', 'name']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.conversation_count})"
+    
+    @classmethod
+    def adjust(cls, added=(), removed=()):
+        """
+        Count conversations into or out of topics. Each argument is an
+        iterable of topic names, or a Counter of name -> conversations.
+        """
+        for amount, names in _group_by_count(removed):
+            cls.objects.filter(name__in=names).update(
+                conversation_count=Greatest(F('conversation_count') - amount, Value(0))
+            )
+        added = Counter(added)
+        if added:
+            cls.objects.bulk_create([cls(name=name) for name in added], ignore_conflicts=True)
+        for amount, names in _group_by_count(added):
+            cls.objects.filter(name__in=names).update(conversation_count=F('conversation_count') + amount)
+
+
+def _group_by_count(names):
+    """(amount, [names]) pairs, so equal adjustments share one UPDATE"""
+    groups = {}
+    for name, amount in Counter(names).items():
+        groups.setdefault(amount, []).append(name)
+    return groups.items()
+
+
 class ConversationQuery(models.Model):
     """
     Stores user queries about past conversations for analytics.
@@ -128,4 +392,113 @@ class ConversationQuery(models.Model):
         verbose_name_plural = "Conversation Queries"
     
     def __str__(self):
-        return f"Query: {self.query_text[:50]}..."
\ No newline at end of file
+        return f"Query: {self.query_text[:50]}..."
+    
+    def add_relevant_conversations(self, conversations):
+        """Link conversations to this query with a single INSERT"""
+        through = self.relevant_conversations.through
+        through.objects.bulk_create(
+            [through(conversationquery=self, conversation=conv) for conv in conversations],
+            ignore_conflicts=True
+        )
+    
+    async def aadd_relevant_conversations(self, conversations):
+        through = self.relevant_conversations.through
+        await through.objects.abulk_create(
+            [through(conversationquery=self, conversation=conv) for conv in conversations],
+            ignore_conflicts=True
+        )
+
+
+class AnalysisJob(models.Model):
+    """
+    Background job that summarizes and embeds an ended conversation.
+    Claimed by worker threads with SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='analysis_jobs'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_run_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="A running job past this time is assumed abandoned and re-queued"
+    )
+    last_error = models.TextField(blank=True)
+    stage_timings = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Seconds spent per stage in the last attempt"
+    )
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_run_at']),
+        ]
+    
+    def __str__(self):
+        return f"Analysis job {self.id} for conversation {self.conversation_id} ({self.status})"
+
+
+class DailyStats(models.Model):
+    """
+    Per-day rollup behind the analytics endpoint, maintained by chat.analytics.
+    
+    Activity counters (conversations started, messages, tokens, queries) are
+    incremented as rows are written. Outcome fields describe the conversations
+    that ended that day; a save moves the conversation's old outcome out and
+    its new one in, so analysis retries never double count.
+    """
+    
+    date = models.DateField(unique=True)
+    
+    conversations_started = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    tokens = models.PositiveBigIntegerField(default=0)
+    
+    queries = models.PositiveIntegerField(default=0)
+    query_time_total = models.FloatField(default=0, help_text="Sum of query execution times in seconds")
+    query_time_max = models.FloatField(default=0)
+    
+    conversations_ended = models.PositiveIntegerField(default=0)
+    duration_minutes_total = models.FloatField(default=0)
+    sentiment_counts = models.JSONField(default=dict, blank=True, help_text="Ended conversations per sentiment")
+    
+    class Meta:
+        ordering = ['date']
+        verbose_name_plural = "Daily stats"
+    
+    def __str__(self):
+        return f"Stats for {self.date}"
+
+
+class DailyTopicCount(models.Model):
+    """Number of conversations ended on a day that discussed a topic"""
+    
+    date = models.DateField()
+    topic = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'topic'], name='unique_daily_topic'),
+        ]
+    
+    def __str__(self):
+        return f"{self.topic} on {self.date}: {self.count}"
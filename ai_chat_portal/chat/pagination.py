@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ConversationCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the newest-first conversation list.
+
+    Each page is a range scan of the (-created_at, -id) index from the
+    cursor position, so deep pages cost the same as the first one and no
+    COUNT(*) is run.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class MessageCursorPagination(CursorPagination):
+    """Oldest-first pages of one conversation's messages, on the (conversation, timestamp) index"""
+
+    ordering = ('timestamp', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -0,0 +1,127 @@
+"""
+PostgreSQL full-text search over conversations and messages.
+
+Conversations keep a stored tsvector of title, topics (weight A) and summary
+(weight B); messages keep one of their content. Both columns have GIN
+indexes. Conversation vectors are refreshed by the signals in chat.signals
+whenever the source fields are written; a message's is computed by the
+INSERT or UPDATE that writes its content (Message.save). Rows written with
+bulk_create / bulk_update / queryset.update() can be refreshed with
+`manage.py rebuild_search_vectors`.
+"""
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, Func, Max, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+from .models import Conversation, Message
+
+
+def search_config():
+    return settings.AI_CONFIG.get('FTS_CONFIG', 'english')
+
+
+def conversation_vector():
+    config = search_config()
+    topics = Func(F('key_topics'), Value(' '), function='array_to_string', output_field=TextField())
+    return (
+        SearchVector('title', weight='A', config=config) +
+        SearchVector(topics, weight='A', config=config) +
+        SearchVector('summary', weight='B', config=config)
+    )
+
+
+def message_vector(content=None):
+    """
+    The message content vector. Given the `content` itself it reads no
+    column, so it can be written by the INSERT that creates the row.
+    """
+    source = 'content' if content is None else Value(content, output_field=TextField())
+    return SearchVector(source, weight='C', config=search_config())
+
+
+def update_conversation_vectors(conversation_ids):
+    """Recompute stored vectors; returns the number of rows updated"""
+    return Conversation.objects.filter(pk__in=conversation_ids).update(search_vector=conversation_vector())
+
+
+def update_message_vectors(message_ids):
+    return Message.objects.filter(pk__in=message_ids).update(search_vector=message_vector())
+
+
+def parse_query(text, match_any=False):
+    """
+    Web-search syntax: quoted phrases, OR, -exclusion. With match_any, a
+    natural-language question matches on any of its words instead of all.
+    """
+    if match_any:
+        terms = re.findall(r'\w+', text)
+        return SearchQuery(' | '.join(terms) or "''", search_type='raw', config=search_config())
+    return SearchQuery(text, search_type='websearch', config=search_config())
+
+
+def search_conversations(queryset, text, include_messages=True, match_any=False):
+    """
+    Filter conversations matching `text` and annotate `search_rank`.
+
+    A conversation matches on its own vector or, with include_messages, on
+    any of its messages; the best message rank is added to its own rank.
+    The result is ordered by rank, newest first on ties.
+    """
+    query = parse_query(text, match_any=match_any)
+    match = Q(search_vector=query)
+    rank = Coalesce(SearchRank(F('search_vector'), query), Value(0.0), output_field=FloatField())
+
+    if include_messages:
+        matching_messages = Message.objects.filter(search_vector=query)
+        best_message_rank = (
+            matching_messages
+            .filter(conversation=OuterRef('pk'))
+            .values('conversation')
+            .annotate(best=Max(SearchRank(F('search_vector'), query)))
+            .values('best')
+        )
+        match |= Q(pk__in=matching_messages.values('conversation_id'))
+        rank = rank + Coalesce(Subquery(best_message_rank, output_field=FloatField()), Value(0.0))
+
+    return (
+        queryset
+        .filter(match)
+        .annotate(search_rank=rank)
+        .order_by('-search_rank', '-created_at')
+    )
+
+
+def search_messages(queryset, text):
+    query = parse_query(text)
+    return (
+        queryset
+        .filter(search_vector=query)
+        .annotate(search_rank=SearchRank(F('search_vector'), query))
+        .order_by('-search_rank', '-timestamp')
+    )
+
+
+def rank_conversation_ids(queryset, text, limit=50):
+    """Lexical ranking for retrieval: conversation ids, best match first"""
+    return list(
+        search_conversations(queryset, text, match_any=True)
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """
+    Merge ranked id lists: list i contributes weights[i] / (k + rank) per id.
+
+    Returns:
+        list: ids ordered by fused score
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
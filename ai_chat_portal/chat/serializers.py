@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from drf_yasg.utils import swagger_serializer_method
 from .models import Conversation, Message, ConversationQuery
 from django.utils import timezone 
 
@@ -26,10 +27,15 @@ class ConversationListSerializer(serializers.ModelSerializer):
             'created_at',
             'ended_at',
             'message_count',
+            'total_tokens',
+            'last_message_at',
             'duration_minutes',
             'key_topics',
-            'sentiment'
+            'sentiment',
+            'analysis_status'
         ]
+        # Maintained by the message counters and the analysis jobs
+        read_only_fields = ['total_tokens', 'last_message_at', 'analysis_status']
 
 
 class ConversationDetailSerializer(serializers.ModelSerializer):
@@ -51,10 +57,15 @@ class ConversationDetailSerializer(serializers.ModelSerializer):
             'key_topics',
             'action_items',
             'sentiment',
+            'analysis_status',
             'message_count',
+            'total_tokens',
+            'last_message_at',
             'duration_minutes',
             'messages'
         ]
+        # Maintained by the message counters and the analysis jobs
+        read_only_fields = ['total_tokens', 'last_message_at', 'analysis_status']
 
 
 class ConversationCreateSerializer(serializers.ModelSerializer):
@@ -116,7 +127,12 @@ class ConversationQuerySerializer(serializers.Serializer):
     topics = serializers.ListField(
         child=serializers.CharField(),
         required=False,
-        help_text="Filter by specific topics"
+        help_text="Filter by specific topics (case-insensitive)"
+    )
+    topics_match = serializers.ChoiceField(
+        choices=['all', 'any'],
+        default='all',
+        help_text="Require all of the topics or any of them"
     )
     
     def validate(self, data):
@@ -132,7 +148,7 @@ class ConversationQuerySerializer(serializers.Serializer):
 class ConversationQueryResponseSerializer(serializers.ModelSerializer):
     """Serializer for conversation query responses"""
     
-    relevant_conversations = ConversationListSerializer(many=True, read_only=True)
+    relevant_conversations = serializers.SerializerMethodField()
     
     class Meta:
         model = ConversationQuery
@@ -143,4 +159,13 @@ class ConversationQueryResponseSerializer(serializers.ModelSerializer):
             'relevant_conversations',
             'execution_time',
             'created_at'
-        ]
\ No newline at end of file
+        ]
+    
+    @swagger_serializer_method(serializer_or_field=ConversationListSerializer(many=True))
+    def get_relevant_conversations(self, obj):
+        # Views pass the ranked conversations they already hold, which keeps
+        # relevance order and saves reading them back through the M2M table
+        conversations = self.context.get('relevant_conversations')
+        if conversations is None:
+            conversations = obj.relevant_conversations.all()
+        return ConversationListSerializer(conversations, many=True).data
\ No newline at end of file
@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Conversation, ConversationQuery, Message, Topic
+from . import analytics
+from .commit_hooks import on_commit_batched
+from .embedding_index import update_embedding_index, remove_from_embedding_index
+from .search import update_conversation_vectors
+from .bm25 import update_bm25_fields, add_bm25_message, reindex_bm25_conversation, remove_from_bm25_index
+
+SEARCHABLE_CONVERSATION_FIELDS = {'title', 'summary', 'key_topics'}
+OUTCOME_CONVERSATION_FIELDS = {'status', 'ended_at', 'sentiment', 'key_topics'}
+
+
+@receiver(post_save, sender=Conversation)
+def sync_conversation_embedding(sender, instance, update_fields=None, **kwargs):
+    """
+    Keep the in-memory embedding index in step with saved conversations,
+    once the write commits (a rollback must not leave the vector searchable)
+    """
+    if update_fields is not None and 'embedding_vector' not in update_fields:
+        return
+    if 'embedding_vector' in instance.get_deferred_fields():
+        return
+    conversation_id, embedding = instance.id, instance.embedding_vector
+    transaction.on_commit(lambda: update_embedding_index(conversation_id, embedding))
+
+
+@receiver(post_delete, sender=Conversation)
+def drop_conversation_embedding(sender, instance, **kwargs):
+    on_commit_batched('search_index_removals', [instance.id], remove_from_search_indexes)
+
+
+def remove_from_search_indexes(conversation_ids):
+    remove_from_embedding_index(conversation_ids)
+    remove_from_bm25_index(conversation_ids)
+
+
+@receiver(post_save, sender=Conversation)
+def sync_conversation_search_vector(sender, instance, update_fields=None, **kwargs):
+    """Refresh the stored tsvector when a searchable field was written"""
+    if update_fields is not None and not SEARCHABLE_CONVERSATION_FIELDS.intersection(update_fields):
+        return
+    update_conversation_vectors([instance.pk])
+    # The in-memory BM25 index only learns about committed writes
+    if not instance.get_deferred_fields().intersection(SEARCHABLE_CONVERSATION_FIELDS):
+        fields = (instance.pk, instance.title, instance.summary, instance.key_topics)
+        transaction.on_commit(lambda: update_bm25_fields(*fields))
+    else:
+        conversation_id = instance.pk
+        transaction.on_commit(lambda: reindex_bm25_conversation(conversation_id))
+
+
+@receiver(post_save, sender=Message)
+def count_new_message(sender, instance, created, raw=False, **kwargs):
+    """Maintain the conversation's denormalized message counters and the daily rollup"""
+    if created and not raw:
+        Conversation.record_message(instance)
+        analytics.record_message(instance)
+
+
+@receiver(pre_save, sender=Conversation)
+@receiver(pre_delete, sender=Conversation)
+def remember_conversation_outcome(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Read the stored outcome of instances that were not loaded with it (from_db remembers it)"""
+    if raw or instance._state.adding or hasattr(instance, '_stored_outcome'):
+        return
+    if update_fields is not None and not OUTCOME_CONVERSATION_FIELDS.intersection(update_fields):
+        return
+    stored = Conversation.objects.filter(pk=instance.pk).values(*Conversation.OUTCOME_FIELDS).first()
+    instance._stored_outcome = Conversation(**stored).outcome() if stored else None
+
+
+@receiver(post_save, sender=Conversation)
+def update_conversation_rollups(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        analytics.record_conversation_started(instance)
+    if update_fields is not None and not OUTCOME_CONVERSATION_FIELDS.intersection(update_fields):
+        return
+    outcome = instance.outcome()
+    analytics.record_outcome_change(None if created else instance._stored_outcome, outcome)
+    instance._stored_outcome = outcome
+
+
+@receiver(post_delete, sender=Conversation)
+def drop_conversation_topics(sender, instance, **kwargs):
+    if instance.topic_index:
+        on_commit_batched('topic_removals', instance.topic_index, lambda removed: Topic.adjust(removed=removed))
+
+
+@receiver(post_delete, sender=Conversation)
+def drop_conversation_outcomes(sender, instance, **kwargs):
+    analytics.record_outcome_change(instance._stored_outcome, None)
+
+
+@receiver(post_save, sender=ConversationQuery)
+def count_new_query(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        analytics.record_query(instance)
+
+
+@receiver(post_save, sender=Message)
+def sync_message_bm25(sender, instance, created, update_fields=None, **kwargs):
+    """The tsvector is written by Message.save(); the BM25 index learns about committed messages"""
+    if not created and update_fields is not None and 'content' not in update_fields:
+        return
+    conversation_id, content, message_id = instance.conversation_id, instance.content, instance.pk
+    if created:
+        transaction.on_commit(lambda: add_bm25_message(conversation_id, content, message_id))
+    else:
+        transaction.on_commit(lambda: reindex_bm25_conversation(conversation_id, full=True))
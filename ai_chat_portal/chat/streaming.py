@@ -0,0 +1,39 @@
+import json
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework.utils.encoders import JSONEncoder
+
+_EXHAUSTED = object()
+
+
+def sse_event(event, data):
+    """Encode one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, cls=JSONEncoder)}\n\n".encode('utf-8')
+
+
+async def iterate_in_thread(iterator):
+    """
+    Drive a blocking iterator from async code, one next() call per hop to
+    the request's sync thread, so every chunk is flushed as soon as it exists.
+    """
+    iterator = iter(iterator)
+    next_item = sync_to_async(next, thread_sensitive=True)
+    while True:
+        item = await next_item(iterator, _EXHAUSTED)
+        if item is _EXHAUSTED:
+            break
+        yield item
+
+
+def streaming_body(request, iterator):
+    """
+    Adapt a blocking iterator to the server in use.
+
+    Under ASGI, Django buffers synchronous iterators completely before
+    sending, so they are wrapped in an async iterator; WSGI servers stream
+    synchronous iterators natively.
+    """
+    django_request = getattr(request, '_request', request)
+    if isinstance(django_request, ASGIRequest):
+        return iterate_in_thread(iterator)
+    return iterator
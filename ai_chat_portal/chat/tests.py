@@ -1,3 +1,1741 @@
-from django.test import TestCase
+import asyncio
+import json
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from io import StringIO
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.throttling import BaseThrottle
+
+from . import analytics, gemini_client
+from .ann_index import IVFPQIndex
+from .ai_utils import schedule_title_generation
+from .answer_cache import SemanticAnswerCache
+from .bm25 import BM25Index, tokenize
+from .context import ConversationContext, estimate_tokens
+from .embedding_index import EmbeddingIndex, create_index
+from .enhanced_ai_service import EnhancedAIService, RateLimiter
+from .fake_gemini import FakeEmbedder, FakeGenerativeModel
+from .fields import EmbeddingField
+from .jobs import AnalysisJobQueue, is_server_process, start_server_workers
+from .llm_cache import LLMCache, get_llm_cache, make_key, normalize_text
+from .management.commands.benchmark_ann import synthetic_embeddings
+from .metrics import get_metrics
+from .models import AnalysisJob, Conversation, ConversationQuery, DailyStats, Message, Topic
+from .topics import filter_by_topics
+from .search import (
+    rank_conversation_ids, reciprocal_rank_fusion, search_conversations, update_conversation_vectors,
+    update_message_vectors,
+)
+from .serializers import ConversationQueryResponseSerializer
+from .views import ConversationViewSet
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class QueryCountTests(TestCase):
+    """
+    The number of queries per request must not grow with the number of rows
+    on the page (or messages in a conversation): each endpoint is requested
+    with a small and a large fixture and both must cost the same.
+    """
+
+    def create_conversations(self, count, messages_each=3):
+        conversations = Conversation.objects.bulk_create(
+            Conversation(title=f"Conversation {i}") for i in range(count)
+        )
+        messages = Message.objects.bulk_create(
+            Message(conversation=conversation, sender='user', content=f"Message {i}")
+            for conversation in conversations
+            for i in range(messages_each)
+        )
+        # bulk_create skips the signals that maintain the search vectors and counters
+        update_message_vectors([message.id for message in messages])
+        Conversation.recount_messages([conversation.id for conversation in conversations])
+        return conversations
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return len(queries)
+
+    def assertConstantQueries(self, url, grow):
+        """Request url, call grow() to add rows, request again and compare"""
+        before = self.count_queries(url)
+        grow()
+        after = self.count_queries(url)
+        self.assertEqual(before, after, f"{url} went from {before} to {after} queries")
+
+    def test_list(self):
+        self.create_conversations(2)
+        self.assertConstantQueries('/api/conversations/', lambda: self.create_conversations(15))
+
+    def test_list_search(self):
+        self.create_conversations(2)
+        self.assertConstantQueries(
+            '/api/conversations/?search=message',
+            lambda: self.create_conversations(15)
+        )
+
+    def test_list_search_results(self):
+        self.create_conversations(3)
+        response = self.client.get('/api/conversations/?search=message')
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(response.json()['results'][0]['message_count'], 3)
+
+    def test_list_message_counts(self):
+        conversation = self.create_conversations(1, messages_each=4)[0]
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.json()['results'][0]['message_count'], 4)
+        self.assertEqual(response.json()['results'][0]['id'], conversation.id)
+
+    def test_detail(self):
+        conversation = self.create_conversations(1, messages_each=2)[0]
+
+        def add_messages():
+            Message.objects.bulk_create(
+                Message(conversation=conversation, sender='ai', content=f"Reply {i}")
+                for i in range(20)
+            )
+            Conversation.recount_messages([conversation.id])
+
+        url = f'/api/conversations/{conversation.id}/'
+        self.assertConstantQueries(url, add_messages)
+        data = self.client.get(url).json()
+        self.assertEqual(data['message_count'], 22)
+        self.assertEqual(len(data['messages']), 22)
+
+    def test_query_response_relevant_conversations(self):
+        query = ConversationQuery.objects.create(query_text='q', response='r')
+
+        def serialize(conversations):
+            with CaptureQueriesContext(connection) as queries:
+                data = ConversationQueryResponseSerializer(
+                    query, context={'relevant_conversations': conversations}
+                ).data
+            return data, len(queries)
+
+        def ranked(conversations):
+            # As loaded by the retrieval stage
+            return list(Conversation.objects.filter(id__in=[c.id for c in conversations]))
+
+        _, before = serialize(ranked(self.create_conversations(2)))
+        data, after = serialize(ranked(self.create_conversations(10)))
+        self.assertEqual(before, after)
+        self.assertEqual([c['message_count'] for c in data['relevant_conversations']], [3] * 10)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class CursorPaginationTests(TestCase):
+
+    def walk(self, url):
+        """Follow `next` links; returns the ids of every page's results"""
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        return pages
+
+    def test_conversation_list(self):
+        conversations = Conversation.objects.bulk_create(
+            Conversation(title=f"Conversation {i}") for i in range(25)
+        )
+        pages = self.walk('/api/conversations/?page_size=10')
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        # Bulk-created rows share created_at, so order falls back to -id
+        expected = sorted((c.id for c in conversations), reverse=True)
+        self.assertEqual([conv_id for page in pages for conv_id in page], expected)
+
+    def test_page_numbers_still_available(self):
+        Conversation.objects.bulk_create(Conversation(title=f"Conversation {i}") for i in range(3))
+        data = self.client.get('/api/conversations/?page=1').json()
+        self.assertEqual(data['count'], 3)
+
+    def test_messages(self):
+        conversation = Conversation.objects.create(title='Long')
+        messages = Message.objects.bulk_create(
+            Message(conversation=conversation, sender='user', content=f"Message {i}")
+            for i in range(120)
+        )
+        pages = self.walk(f'/api/conversations/{conversation.id}/messages/')
+        self.assertEqual([len(page) for page in pages], [50, 50, 20])
+        self.assertEqual([m_id for page in pages for m_id in page], [m.id for m in messages])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/conversations/{conversation.id}/messages/?page_size=100')
+        self.assertEqual(len(queries), 2)
+
+    def test_messages_missing_conversation(self):
+        self.assertEqual(self.client.get('/api/conversations/999999/messages/').status_code, 404)
+
+
+class MessageCounterTests(TestCase):
+
+    def test_created_messages_update_counters(self):
+        conversation = Conversation.objects.create(title='Counters')
+        Message.objects.create(conversation=conversation, sender='user', content='Hi')
+        last = Message.objects.create(conversation=conversation, sender='ai', content='Hello', tokens_used=7)
+
+        # The instance the messages were created with is kept in step
+        self.assertEqual(conversation.message_count, 2)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual(conversation.total_tokens, 7)
+        self.assertEqual(conversation.last_message_at, last.timestamp)
+
+    def test_recount_repairs_drift(self):
+        conversation = Conversation.objects.create(title='Counters')
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender='user', content='Hi', tokens_used=3),
+            Message(conversation=conversation, sender='ai', content='Hello', tokens_used=5),
+        ])
+        empty = Conversation.objects.create(title='Empty', message_count=9, total_tokens=9)
+
+        self.assertEqual(Conversation.recount_messages([conversation.id, empty.id]), 2)
+        conversation.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.total_tokens), (2, 8))
+        self.assertIsNotNone(conversation.last_message_at)
+        self.assertEqual((empty.message_count, empty.total_tokens, empty.last_message_at), (0, 0, None))
+
+    def test_full_save_keeps_concurrent_increments(self):
+        conversation = Conversation.objects.create(title='Counters')
+        stale = Conversation.objects.get(pk=conversation.pk)
+        Message.objects.create(conversation=conversation, sender='ai', content='Hello', tokens_used=7)
+
+        stale.title = 'Renamed'
+        stale.save()
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.title, conversation.message_count, conversation.total_tokens), ('Renamed', 1, 7))
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    @mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+    def test_patch_cannot_write_counters(self):
+        conversation = Conversation.objects.create(title='Counters')
+        response = self.client.patch(
+            f'/api/conversations/{conversation.id}/',
+            {'title': 'Renamed', 'total_tokens': 999, 'analysis_status': 'completed'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.title, conversation.total_tokens, conversation.analysis_status), ('Renamed', 0, ''))
+
+
+class InlineExecutor:
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+@mock.patch('chat.context._fold_pool', InlineExecutor())
+@mock.patch('chat.context.close_old_connections', lambda: None)
+class ConversationContextTests(TestCase):
+
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title='Long chat')
+        for i in range(30):
+            sender = 'user' if i % 2 == 0 else 'ai'
+            Message.objects.create(conversation=self.conversation, sender=sender, content=f'm{i}')
+        self.messages = list(self.conversation.messages.order_by('timestamp'))
+        self.folded = []
+
+    def context(self, **kwargs):
+        self.conversation.refresh_from_db()
+        return ConversationContext(self.conversation, **{'window': 4, 'summary_every': 8, **kwargs}).load()
+
+    def service(self, fail_on=None):
+        def update_rolling_summary(previous, messages):
+            if len(self.folded) + 1 == fail_on:
+                raise ValueError('model unavailable')
+            self.folded.append([msg['content'] for msg in messages])
+            return ' '.join(filter(None, [previous, messages[-1]['content']]))
+        return SimpleNamespace(update_rolling_summary=update_rolling_summary)
+
+    def test_window_and_token_budget(self):
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            context_summary='Earlier things', context_summarized_until=self.messages[23].timestamp
+        )
+        history = self.context().history()
+        self.assertEqual(history[0]['parts'], ['Summary of our conversation so far: Earlier things'])
+        self.assertEqual([h['parts'][0] for h in history[2:]], [f'm{i}' for i in range(24, 30)])
+
+        # Each message costs 1 token, the summary 4: two messages fit a budget of 6
+        history = self.context(token_budget=6).history()
+        self.assertEqual([h['parts'][0] for h in history[2:]], ['m28', 'm29'])
+
+        history = self.context(window=0, token_budget=6).history()
+        self.assertEqual([h['parts'][0] for h in history], [f'm{i}' for i in range(30)])
+
+    def test_fold_covers_everything_after_the_cursor(self):
+        with mock.patch.object(ConversationContext, 'FOLD_BATCH', 10):
+            context = self.context()
+            self.assertEqual(len(context.messages), 30)
+            # The second batch fails: only the first is saved and passed by the cursor
+            self.assertEqual(context.fold_in_background(self.service(fail_on=2)).result(), 'm9')
+            self.conversation.refresh_from_db()
+        self.assertEqual(self.folded, [[f'm{i}' for i in range(10)]])
+        self.assertEqual(self.conversation.context_summarized_until, self.messages[9].timestamp)
+        self.assertEqual(self.conversation.context_summary, 'm9')
+
+        with mock.patch.object(ConversationContext, 'FOLD_BATCH', 10):
+            context = self.context()
+            self.assertEqual(len(context.messages), 20)
+            self.assertEqual(context.fold_in_background(self.service()).result(), 'm9 m19 m25')
+        self.assertEqual(sum(self.folded, []), [f'm{i}' for i in range(26)])
+        self.assertEqual(self.context().messages, self.messages[26:])
+        self.assertIsNone(self.context().fold_in_background(self.service()))
+
+    def test_fold_never_splits_a_timestamp(self):
+        tied = [msg.pk for msg in self.messages[24:27]]
+        Message.objects.filter(pk__in=tied).update(timestamp=self.messages[26].timestamp)
+        context = self.context()
+        self.assertEqual([msg['content'] for msg in context.fold_batches()[-1][0]][-1], 'm23')
+
+        context.fold_in_background(self.service())
+        self.assertEqual(len(self.context().messages), 6)
+
+    def test_concurrent_fold_wins(self):
+        context = self.context()
+        # Another fold moved the cursor after this context was loaded
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            context_summarized_until=self.messages[0].timestamp
+        )
+        self.assertIsNone(context.fold_in_background(self.service()).result())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.context_summarized_until, self.messages[0].timestamp)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class AnalyticsTests(TestCase):
+
+    def end(self, conversation, sentiment, topics):
+        conversation.status = 'ended'
+        conversation.ended_at = timezone.now()
+        conversation.save(update_fields=['status', 'ended_at'])
+        # Analysis lands in a second save, as with the background workers
+        conversation.sentiment = sentiment
+        conversation.key_topics = topics
+        conversation.save(update_fields=['sentiment', 'key_topics'])
+
+    def populate(self):
+        # Outcome rollups are refreshed on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self._populate()
+
+    def _populate(self):
+        for i in range(3):
+            conversation = Conversation.objects.create(title=f"Conversation {i}")
+            Message.objects.create(conversation=conversation, sender='user', content='Hi')
+            Message.objects.create(conversation=conversation, sender='ai', content='Hello', tokens_used=10)
+            self.end(conversation, 'positive' if i else 'negative', ['Python', 'django'][:i + 1])
+        ConversationQuery.objects.create(query_text='q', response='r', execution_time=0.5)
+        ConversationQuery.objects.create(query_text='q', response='r', execution_time=1.5)
+
+    def test_incremental_rollups_match_rebuild(self):
+        self.populate()
+        incremental = self.client.get('/api/conversations/analytics/').json()
+        analytics.rebuild()
+        self.assertEqual(self.client.get('/api/conversations/analytics/').json(), incremental)
+
+        self.assertEqual(incremental['total_conversations'], 3)
+        self.assertEqual(incremental['total_messages'], 6)
+        self.assertEqual(incremental['total_tokens'], 30)
+        self.assertEqual(incremental['sentiment_distribution'], {'positive': 2, 'negative': 1})
+        self.assertEqual(incremental['top_topics'][0], {'topic': 'python', 'count': 3})
+        self.assertEqual(incremental['topics_discussed'], 2)
+        self.assertEqual(incremental['queries'], {'count': 2, 'average_seconds': 1.0, 'max_seconds': 1.5})
+
+    def test_deleting_conversations_refreshes_outcomes(self):
+        self.populate()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Conversation.objects.filter(sentiment='positive').delete()
+        # One batch each of topic counts and search index removals and one
+        # refresh of the day, not one per conversation
+        self.assertEqual(len(callbacks), 3)
+        data = self.client.get('/api/conversations/analytics/').json()
+        self.assertEqual(data['ended_conversations'], 1)
+        self.assertEqual(data['sentiment_distribution'], {'negative': 1})
+
+    def test_outcome_changes_move_counts_without_rescanning(self):
+        self.populate()
+        conversation = Conversation.objects.get(sentiment='negative')
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            conversation.sentiment = 'positive'
+            conversation.key_topics = ['Rust']
+            conversation.save(update_fields=['sentiment', 'key_topics'])
+        scans = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertFalse([sql for sql in scans if '"chat_conversation"' in sql])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reopened = Conversation.objects.get(title='Conversation 2')
+            reopened.status = 'active'
+            reopened.save()
+        incremental = self.client.get('/api/conversations/analytics/').json()
+        self.assertEqual(incremental['ended_conversations'], 2)
+        self.assertEqual(incremental['sentiment_distribution'], {'positive': 2})
+        self.assertEqual(
+            {row['topic']: row['count'] for row in incremental['top_topics']}, {'python': 1, 'django': 1, 'rust': 1}
+        )
+        analytics.rebuild()
+        self.assertEqual(self.client.get('/api/conversations/analytics/').json(), incremental)
+
+    def test_date_range(self):
+        self.populate()
+        today = timezone.localdate()
+        data = self.client.get(f'/api/conversations/analytics/?date_from={today}&date_to={today}').json()
+        self.assertEqual(data['total_conversations'], 3)
+        data = self.client.get(f'/api/conversations/analytics/?date_to={today - timedelta(days=1)}').json()
+        self.assertEqual(data['total_conversations'], 0)
+        self.assertEqual(self.client.get('/api/conversations/analytics/?date_from=soon').status_code, 400)
+
+    def test_reads_only_rollups(self):
+        self.populate()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/conversations/analytics/')
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"chat_message"', tables)
+        self.assertNotIn('"chat_conversation"', tables)
+        self.assertEqual(DailyStats.objects.count(), 1)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class TopicIndexTests(TestCase):
+
+    def counts(self):
+        return dict(Topic.objects.filter(conversation_count__gt=0).values_list('name', 'conversation_count'))
+
+    def test_normalized_on_save(self):
+        conversation = Conversation.objects.create(title='a', key_topics=['Python', ' python ', 'Web  Dev'])
+        self.assertEqual(conversation.topic_index, ['python', 'web dev'])
+
+        conversation = Conversation.objects.get(pk=conversation.pk)
+        conversation.key_topics = ['Django', 'Python']
+        conversation.save(update_fields=['key_topics'])
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.topic_index, ['django', 'python'])
+        self.assertEqual(self.counts(), {'python': 1, 'django': 1})
+
+    def test_counts_follow_saves_and_deletes(self):
+        first = Conversation.objects.create(title='a', key_topics=['Python', 'SQL'])
+        Conversation.objects.create(title='b', key_topics=['python'])
+        self.assertEqual(self.counts(), {'python': 2, 'sql': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.counts(), {'python': 1})
+
+    def test_filters(self):
+        both = Conversation.objects.create(title='both', key_topics=['Python', 'Django'])
+        python = Conversation.objects.create(title='python', key_topics=['python'])
+        Conversation.objects.create(title='other', key_topics=['Go'])
+
+        def titles(topics, match):
+            return set(filter_by_topics(Conversation.objects.all(), topics, match).values_list('title', flat=True))
+
+        self.assertEqual(titles(['PYTHON', 'django'], 'all'), {both.title})
+        self.assertEqual(titles(['django', 'python'], 'any'), {both.title, python.title})
+        response = self.client.get('/api/conversations/?topics=Python,Django')
+        self.assertEqual([row['title'] for row in response.json()['results']], [both.title])
+
+    def test_top_topics(self):
+        for topics in (['Python', 'SQL'], ['python'], ['Go']):
+            Conversation.objects.create(title='t', key_topics=topics)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/conversations/top_topics/?limit=2').json()
+        self.assertEqual(data, [
+            {'name': 'python', 'conversation_count': 2},
+            {'name': 'go', 'conversation_count': 1},
+        ])
+        self.assertNotIn('"chat_conversation"', ' '.join(query['sql'] for query in queries.captured_queries))
+
+    def test_rebuild_command(self):
+        conversation = Conversation.objects.create(title='a', key_topics=['Python'])
+        Conversation.objects.filter(pk=conversation.pk).update(key_topics=['Rust', 'rust'], topic_index=[])
+        call_command('rebuild_topic_index', stdout=StringIO())
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.topic_index, ['rust'])
+        self.assertEqual(self.counts(), {'rust': 1})
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def fresh_indexes():
+    """Search indexes loaded now, so the process-wide ones do not leak between tests"""
+    embeddings, bm25 = EmbeddingIndex(), BM25Index()
+    embeddings.load_from_db()
+    bm25.load_from_db()
+    return mock.patch.multiple(
+        'chat.enhanced_ai_service', get_embedding_index=lambda: embeddings, get_bm25_index=lambda: bm25
+    )
+
+
+class EmbeddingFieldTests(TestCase):
+
+    def test_float32_round_trip(self):
+        vector = unit(3, 4, 12)
+        conversation = Conversation.objects.create(title='Stored', embedding_vector=vector.tolist())
+        stored = Conversation.objects.get(pk=conversation.pk).embedding_vector
+        self.assertEqual(stored.dtype, np.dtype('<f4'))
+        np.testing.assert_array_equal(stored, vector)
+        self.assertFalse(stored.flags.writeable)  # A view over the driver's buffer
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT octet_length(embedding_vector) FROM chat_conversation WHERE id = %s', [conversation.pk]
+            )
+            self.assertEqual(cursor.fetchone()[0], 12)
+
+    def test_float16_round_trip(self):
+        field = EmbeddingField(dtype='float16')
+        vector = np.array([0.5, -0.25, 0.125], dtype=np.float32)
+        stored = field.get_prep_value(vector)
+        self.assertEqual(len(stored), 6)
+        loaded = field.from_db_value(memoryview(stored), None, connection)
+        self.assertEqual(loaded.dtype, np.dtype('<f2'))
+        np.testing.assert_array_equal(loaded, vector)
+        self.assertEqual(field.deconstruct()[3]['dtype'], 'float16')
+        self.assertNotIn('dtype', EmbeddingField().deconstruct()[3])
+
+        # Serialized (dumpdata/loaddata) as base64 of the same bytes
+        obj = SimpleNamespace(vector=vector)
+        field.attname = 'vector'
+        np.testing.assert_array_equal(field.to_python(field.value_to_string(obj)), vector)
+
+    def test_none_and_empty(self):
+        conversation = Conversation.objects.create(title='Unanalyzed')
+        self.assertIsNone(Conversation.objects.get(pk=conversation.pk).embedding_vector)
+        field = Conversation._meta.get_field('embedding_vector')
+        self.assertIsNone(field.get_prep_value(None))
+        self.assertIsNone(field.value_to_string(conversation))
+
+        Conversation.objects.filter(pk=conversation.pk).update(embedding_vector=[])
+        self.assertEqual(Conversation.objects.get(pk=conversation.pk).embedding_vector.shape, (0,))
+        index = EmbeddingIndex()
+        index.load_from_db()
+        self.assertEqual(len(index), 0)  # Nothing to rank on
+
+    def test_dimension_mismatch(self):
+        first = Conversation.objects.create(title='3d', embedding_vector=unit(1, 0, 0))
+        other = Conversation.objects.create(title='2d', embedding_vector=unit(1, 0))
+        np.testing.assert_array_equal(Conversation.objects.get(pk=other.pk).embedding_vector, unit(1, 0))
+        index = EmbeddingIndex()
+        index.load([(first.pk, unit(1, 0, 0)), (other.pk, unit(1, 0))])
+        self.assertEqual(index.indexed_ids(), {first.pk})  # The odd vector is skipped
+        self.assertEqual(index.search(unit(1, 0), k=5), [])
+
+    def test_convert_embeddings(self):
+        legacy = Conversation.objects.create(title='Legacy', embedding=[3.0, 4.0])
+        converted = Conversation.objects.create(title='Converted', embedding_vector=unit(0, 1))
+        before = Conversation.objects.get(pk=legacy.pk).updated_at
+
+        out = StringIO()
+        call_command('convert_embeddings', batch_size=1, stdout=out)
+        self.assertIn('Converted 1 embeddings', out.getvalue())
+
+        legacy = Conversation.objects.get(pk=legacy.pk)
+        self.assertIsNone(legacy.embedding)
+        np.testing.assert_allclose(legacy.embedding_vector, [0.6, 0.8], rtol=1e-6)  # Normalized on the way
+        self.assertGreater(legacy.updated_at, before)  # So running index syncs pick it up
+        np.testing.assert_array_equal(Conversation.objects.get(pk=converted.pk).embedding_vector, unit(0, 1))
+
+        call_command('convert_embeddings', stdout=out)  # Nothing left to do
+        self.assertIn('Converting 0 embeddings', out.getvalue())
+
+
+class EmbeddingIndexTests(TestCase):
+
+    def test_exact_search(self):
+        index = EmbeddingIndex()
+        index.load([(1, unit(1, 0, 0)), (2, unit(1, 1, 0)), (3, unit(0, 0, 1))])
+        self.assertEqual([i for i, _ in index.search(unit(1, 0.1, 0), k=2)], [1, 2])
+        self.assertEqual([i for i, _ in index.search(unit(1, 0, 0), k=3, candidate_ids=[2, 3])], [2, 3])
+
+        index.remove(1)  # Swaps the last row into its place
+        index.upsert(3, unit(1, 0, 0))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search(unit(1, 0, 0), k=1)[0][0], 3)
+
+    def test_ivfpq_recall_and_persistence(self):
+        vectors = synthetic_embeddings(600, 32, clusters=12, seed=1)
+        exact = EmbeddingIndex()
+        exact.load(enumerate(vectors))
+        index = IVFPQIndex(nlist=8, m=4, nprobe=4, rerank=4)
+        index.load(enumerate(vectors))
+        self.assertTrue(index.is_trained)
+
+        queries = vectors[:20]
+        recall = np.mean([
+            len({i for i, _ in index.search(q, k=10)} & {i for i, _ in exact.search(q, k=10)}) / 10
+            for q in queries
+        ])
+        self.assertGreater(recall, 0.8)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            index.save(path)
+            restored = IVFPQIndex(nlist=8, m=4, nprobe=4, rerank=4)
+            restored.load_file(path)
+        self.assertEqual(restored.search(queries[0], k=5), index.search(queries[0], k=5))
+
+    def test_ivfpq_trains_once_enough_vectors_arrive(self):
+        vectors = synthetic_embeddings(300, 32, clusters=8, seed=2)
+        index = IVFPQIndex(nlist=4, m=4, nprobe=4, rerank=4)
+        index.load([])
+        for i in range(IVFPQIndex.KSUB - 1):
+            index.upsert(i, vectors[i])
+        self.assertFalse(index.is_trained)
+        self.assertEqual(index.search(vectors[5], k=1)[0][0], 5)  # Exact while untrained
+
+        index.upsert(IVFPQIndex.KSUB - 1, vectors[IVFPQIndex.KSUB - 1])
+        self.assertTrue(index.is_trained)
+        index.upsert(299, vectors[299])
+        self.assertEqual(len(index), IVFPQIndex.KSUB + 1)
+        self.assertEqual(index.search(vectors[299], k=1)[0][0], 299)
+        self.assertEqual({i for i, _ in index.search(vectors[5], k=3, candidate_ids=[7, 9])}, {7, 9})
+
+        index.remove(299)
+        self.assertNotIn(299, index.indexed_ids())
+        self.assertNotEqual(index.search(vectors[299], k=1)[0][0], 299)
+
+    def test_ivfpq_file_is_reconciled_with_the_database(self):
+        vectors = synthetic_embeddings(300, 32, clusters=8, seed=3)
+        conversations = Conversation.objects.bulk_create([
+            Conversation(title=f'c{i}', embedding_vector=vector) for i, vector in enumerate(vectors)
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            saved = IVFPQIndex(nlist=4, m=4, nprobe=4, rerank=4, path=path)
+            saved.ensure_loaded()
+            self.assertTrue(os.path.exists(path))
+
+            # Written while the file was on disk
+            Conversation.objects.filter(pk=conversations[0].pk).delete()
+            added = Conversation.objects.create(title='Added')
+            Conversation.objects.filter(pk=added.pk).update(embedding_vector=vectors[0], **Conversation.changed())
+
+            restored = IVFPQIndex(nlist=4, m=4, nprobe=4, rerank=4, path=path)
+            restored.ensure_loaded()
+        self.assertTrue(restored.is_trained)
+        self.assertEqual(restored.indexed_ids(), set(Conversation.objects.values_list('id', flat=True)))
+        self.assertEqual(restored.search(vectors[0], k=1)[0][0], added.id)
+
+    def test_ivfpq_retrains_once_it_outgrows_its_training_set(self):
+        vectors = synthetic_embeddings(600, 32, clusters=8, seed=4)
+        Conversation.objects.bulk_create([
+            Conversation(title=f'c{i}', embedding_vector=vector) for i, vector in enumerate(vectors)
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            index = IVFPQIndex(nlist=4, m=4, nprobe=4, rerank=4, path=path, retrain_growth=2)
+            with mock.patch.object(IVFPQIndex, '_maybe_rebuild'):
+                index.load([])
+                for i in range(IVFPQIndex.KSUB):
+                    index.upsert(i, vectors[i])
+            self.assertEqual(index._trained_size, IVFPQIndex.KSUB)
+            self.assertTrue(os.path.exists(path))  # Saved as soon as it trained
+            self.assertFalse(index.needs_retraining)
+
+            with mock.patch.object(IVFPQIndex, '_maybe_rebuild'):
+                for i in range(IVFPQIndex.KSUB, 2 * IVFPQIndex.KSUB):
+                    index.upsert(i, vectors[i])
+            self.assertTrue(index.needs_retraining)
+
+            with mock.patch.object(threading.Thread, 'start') as start:
+                index.upsert(599, vectors[599])
+                index.upsert(598, vectors[598])
+            start.assert_called_once()  # A single rebuild in flight
+
+            index._rebuilding = False
+            index.rebuild()
+            self.assertEqual(index._trained_size, 600)
+            self.assertFalse(index.needs_retraining)
+            self.assertEqual(index.indexed_ids(), set(Conversation.objects.values_list('id', flat=True)))
+
+            restored = IVFPQIndex(nlist=4, m=4, nprobe=4, rerank=4)
+            restored.load_file(path)
+        self.assertEqual(restored._trained_size, 600)
+        self.assertEqual(len(restored), 600)
+
+    def test_create_index(self):
+        self.assertIsInstance(create_index('exact'), EmbeddingIndex)
+        self.assertIsInstance(create_index('ivfpq'), IVFPQIndex)
+        with self.assertRaises(ValueError):
+            create_index('faiss')
+
+    def test_sync_picks_up_other_processes_writes(self):
+        first = Conversation.objects.create(title='First', embedding_vector=unit(1, 0, 0))
+        index = EmbeddingIndex()
+        index.load_from_db()
+        self.assertEqual(index.indexed_ids(), {first.id})
+
+        # Queryset writes skip this process's signals, like writes made elsewhere
+        second = Conversation.objects.create(title='Second')
+        Conversation.objects.filter(pk=second.pk).update(embedding_vector=unit(0, 1, 0), **Conversation.changed())
+        Conversation.objects.filter(pk=first.pk).update(embedding_vector=unit(0, 0, 1), **Conversation.changed())
+        index.sync_with_db()
+        self.assertEqual(index.search(unit(0, 1, 0), k=1)[0][0], second.id)
+        self.assertEqual(index.search(unit(0, 0, 1), k=1)[0][0], first.id)
+
+        Conversation.objects.filter(pk=first.pk).delete()
+        index.sync_with_db()
+        self.assertEqual(index.indexed_ids(), {second.id})
+
+    def test_signal_updates_wait_for_commit(self):
+        index = EmbeddingIndex()
+        index.load([])
+        with mock.patch('chat.embedding_index._index', index):
+            with self.captureOnCommitCallbacks(execute=True):
+                kept = Conversation.objects.create(title='Kept', embedding_vector=unit(1, 0, 0))
+                self.assertEqual(len(index), 0)
+            self.assertEqual(index.indexed_ids(), {kept.id})
+
+            with self.assertRaises(ValueError), transaction.atomic():
+                Conversation.objects.create(title='Rolled back', embedding_vector=unit(0, 1, 0))
+                raise ValueError
+            self.assertEqual(index.indexed_ids(), {kept.id})
+
+
+class BM25IndexTests(TestCase):
+
+    def test_tokenize_keeps_identifiers(self):
+        self.assertEqual(tokenize('What is JIRA-4821 about?'), ['jira-4821', 'jira', '4821'])
+
+    def test_ranking_and_incremental_updates_match_load(self):
+        index = BM25Index()
+        index.load(
+            [(1, 'Billing', '', ['invoices']), (2, 'Deploys', 'rollback failed', []), (3, 'Misc', '', [])],
+            [(1, 'Where is my invoice?'), (3, 'The deploy rollback of JIRA-4821')],
+        )
+        self.assertEqual([i for i, _ in index.search('rollback')], [2, 3])
+        self.assertEqual([i for i, _ in index.search('JIRA-4821')], [3])
+        self.assertEqual([i for i, _ in index.search('rollback', candidate_ids=[3])], [3])
+
+        index.add_message(1, 'A rollback of the invoice run')
+        index.set_fields(3, 'Deploy rollback', '', [])
+        index.remove(2)
+        rebuilt = BM25Index()
+        rebuilt.load(
+            [(1, 'Billing', '', ['invoices']), (3, 'Deploy rollback', '', [])],
+            [(1, 'Where is my invoice?'), (3, 'The deploy rollback of JIRA-4821'), (1, 'A rollback of the invoice run')],
+        )
+        self.assertEqual(index.search('rollback invoice'), rebuilt.search('rollback invoice'))
+
+    def test_sync_picks_up_other_processes_writes(self):
+        first = Conversation.objects.create(title='Kubernetes upgrade')
+        index = BM25Index()
+        index.load_from_db()
+
+        # Queryset writes skip this process's signals, like writes made elsewhere
+        second = Conversation.objects.create(title='Untitled')
+        Conversation.objects.filter(pk=second.pk).update(title='Postgres vacuum', **Conversation.changed())
+        Message.objects.bulk_create([Message(conversation=first, sender='user', content='helm chart')])
+        Conversation.objects.filter(pk=first.pk).update(**Conversation.changed())
+        index.sync_with_db()
+        self.assertEqual([i for i, _ in index.search('vacuum')], [second.id])
+        self.assertEqual([i for i, _ in index.search('helm')], [first.id])
+
+        Conversation.objects.filter(pk=first.pk).delete()
+        index.sync_with_db()
+        self.assertEqual(index.indexed_ids(), {second.id})
+        self.assertEqual(index.search('kubernetes'), [])
+
+    def test_sync_only_tokenizes_unseen_messages(self):
+        conversation = Conversation.objects.create(title='Incident')
+        first = Message.objects.create(conversation=conversation, sender='user', content='disk full on db01')
+        index = BM25Index()
+        index.load_from_db()
+
+        def add(content):
+            message = Message(conversation=conversation, sender='ai', content=content)
+            Message.objects.bulk_create([message])
+            return message
+
+        # Another process writes one message, then this one writes the next
+        elsewhere = add('rotated the logs')
+        here = add('added a volume alert')
+        index.add_message(conversation.id, here.content, message_id=here.id)
+        Conversation.objects.filter(pk=conversation.pk).update(**Conversation.changed())
+
+        with mock.patch('chat.bm25.tokenize', wraps=tokenize) as tokenized:
+            index.sync_with_db()
+            index.sync_with_db()  # Still within SYNC_LAG: only the fields are read again
+        texts = [call.args[0] for call in tokenized.call_args_list]
+        self.assertEqual(texts.count(elsewhere.content), 1)
+        self.assertNotIn(first.content, texts)
+        self.assertNotIn(here.content, texts)
+
+        rebuilt = BM25Index()
+        rebuilt.load_from_db()
+        for query in ('logs', 'volume alert', 'disk db01', 'incident'):
+            self.assertEqual(index.search(query), rebuilt.search(query))
+
+    def test_signal_updates_wait_for_commit(self):
+        index = BM25Index()
+        index.load([])
+        with mock.patch('chat.bm25._bm25', index):
+            with self.captureOnCommitCallbacks(execute=True):
+                kept = Conversation.objects.create(title='Kept')
+                message = Message.objects.create(conversation=kept, sender='user', content='terraform plan')
+                self.assertEqual(len(index), 0)
+            self.assertEqual([i for i, _ in index.search('terraform')], [kept.id])
+
+            # An edited message rebuilds the document
+            message.content = 'pulumi preview'
+            with self.captureOnCommitCallbacks(execute=True):
+                message.save(update_fields=['content'])
+            self.assertEqual(index.search('terraform'), [])
+            self.assertEqual([i for i, _ in index.search('pulumi')], [kept.id])
+
+            with self.assertRaises(ValueError), transaction.atomic():
+                Message.objects.create(conversation=kept, sender='user', content='ansible playbook')
+                raise ValueError
+            self.assertEqual(index.search('ansible'), [])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                kept.delete()
+            self.assertEqual(len(index), 0)
+
+
+class FullTextSearchTests(TestCase):
+
+    def setUp(self):
+        self.billing = Conversation.objects.create(title='Billing question', key_topics=['invoices'])
+        self.deploy = Conversation.objects.create(title='Deploy help', summary='Rolled back a failed release')
+        Message.objects.create(conversation=self.deploy, sender='user', content='The invoice service will not start')
+        self.other = Conversation.objects.create(title='Weekend plans')
+
+    def titles(self, text, **kwargs):
+        return [c.title for c in search_conversations(Conversation.objects.all(), text, **kwargs)]
+
+    def test_vectors_follow_saves(self):
+        self.assertEqual(self.titles('invoices'), ['Billing question', 'Deploy help'])
+        self.assertEqual(self.titles('invoices', include_messages=False), ['Billing question'])
+        self.deploy.summary = 'Weekend rollback'
+        self.deploy.save(update_fields=['summary'])
+        self.assertEqual(self.titles('weekend'), ['Weekend plans', 'Deploy help'])
+
+    def test_message_vector_is_written_by_the_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            message = Message.objects.create(conversation=self.other, sender='user', content='Packing for the hike')
+        writes = [q['sql'] for q in queries.captured_queries if '"chat_message"' in q['sql']]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+        self.assertIn("'hike'", Message.objects.get(pk=message.pk).search_vector)
+        self.assertIn("'hike'", message.search_vector)  # Loaded on access
+        self.assertEqual(self.titles('hike'), ['Weekend plans'])
+
+        message.content = 'Packing for the beach'
+        message.save(update_fields=['content'])
+        self.assertEqual(self.titles('hike'), [])
+        self.assertEqual(self.titles('beach'), ['Weekend plans'])
+        message.tokens_used = 3
+        message.save(update_fields=['tokens_used'])
+        self.assertEqual(self.titles('beach'), ['Weekend plans'])
+
+    def test_websearch_syntax(self):
+        self.assertEqual(self.titles('invoice -billing'), ['Deploy help'])
+        self.assertEqual(self.titles('"failed release" OR weekend'), ['Weekend plans', 'Deploy help'])
+        self.assertEqual(self.titles('invoice weekend'), [])
+        # Retrieval matches a question on any of its words
+        ranked = rank_conversation_ids(Conversation.objects.all(), 'invoice weekend?')
+        self.assertEqual(set(ranked), {self.billing.id, self.deploy.id, self.other.id})
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    @mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+    def test_list_search_parameter(self):
+        response = self.client.get('/api/conversations/?search=invoices')
+        self.assertEqual([row['title'] for row in response.json()['results']], ['Billing question', 'Deploy help'])
+
+
+class DenyThrottle(BaseThrottle):
+
+    def allow_request(self, request, view):
+        return False
+
+    def wait(self):
+        return 30
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.model = FakeGenerativeModel(reply=lambda prompt: 'Ticket JIRA-4821 was the failed deploy.')
+        self.service = EnhancedAIService(model=self.model, embedder=FakeEmbedder(dimension=16))
+        self.service.cache = LLMCache()
+        self.service.answer_cache = SemanticAnswerCache(LLMCache())
+        patcher = mock.patch('chat.async_views.get_ai_service', lambda: self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, url, data):
+        return async_to_sync(self.async_client.post)(url, data, content_type='application/json')
+
+    def ended(self, title, summary):
+        return Conversation.objects.create(
+            title=title, summary=summary, status='ended',
+            embedding_vector=self.service.generate_embedding(f"{title} {summary}")
+        )
+
+    def test_send_message(self):
+        conversation = Conversation.objects.create(title='Async')
+        response = self.post(f'/api/async/conversations/{conversation.pk}/send_message/', {'content': 'Hello'})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['user_message']['content'], 'Hello')
+        self.assertEqual(data['ai_message']['content'], 'Ticket JIRA-4821 was the failed deploy.')
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 2)
+
+        ended = Conversation.objects.create(title='Ended', status='ended')
+        self.assertEqual(self.post(f'/api/async/conversations/{ended.pk}/send_message/', {'content': 'Hi'}).status_code, 400)
+        self.assertEqual(self.post('/api/async/conversations/0/send_message/', {'content': 'Hi'}).status_code, 404)
+        response = async_to_sync(self.async_client.get)(f'/api/async/conversations/{conversation.pk}/send_message/')
+        self.assertEqual(response.status_code, 405)
+
+    def test_query_conversations(self):
+        deploy = self.ended('Deploy failure', 'Rollback of JIRA-4821')
+        self.ended('Billing', 'Refund for a duplicate invoice')
+        Conversation.objects.create(title='Still active', summary='JIRA-4821 again')
+        with fresh_indexes():
+            response = self.post('/api/async/conversations/query_conversations/', {'query': 'What was JIRA-4821?'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['response'], 'Ticket JIRA-4821 was the failed deploy.')
+        self.assertEqual(data['relevant_conversations'][0]['id'], deploy.id)
+        self.assertEqual(len(data['relevant_conversations']), 2)  # Active conversations are not searched
+        self.assertEqual(ConversationQuery.objects.get().relevant_conversations.count(), 2)
+
+    def test_async_retrieval_matches_sync(self):
+        for i in range(5):
+            self.ended(f'Conversation {i}', f'Topic {i} JIRA-{i}')
+        conversations = Conversation.objects.filter(status='ended')
+        with fresh_indexes():
+            expected = self.service.retrieve_conversations('JIRA-3 topic', conversations, top_k=3)
+            retrieved = async_to_sync(self.service.aretrieve_conversations)('JIRA-3 topic', conversations, top_k=3)
+            rows = list(conversations.values('id', 'title'))
+            semantic = async_to_sync(self.service.asemantic_search)('JIRA-3 topic', rows, top_k=3)
+            self.assertEqual(semantic, self.service.semantic_search('JIRA-3 topic', rows, top_k=3))
+        self.assertEqual(retrieved, expected)
+        self.assertEqual(retrieved[0].title, 'Conversation 3')
+        self.assertEqual([row['id'] for row in semantic], [conv.id for conv in retrieved])
+
+    def test_viewset_throttles_and_permissions_apply(self):
+        conversation = Conversation.objects.create(title='Limited')
+        url = f'/api/async/conversations/{conversation.pk}/send_message/'
+        with mock.patch.object(ConversationViewSet, 'throttle_classes', [DenyThrottle]):
+            response = self.post(url, {'content': 'Hi'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '30')
+        with mock.patch.object(ConversationViewSet, 'permission_classes', [IsAuthenticated]):
+            self.assertEqual(self.post(url, {'content': 'Hi'}).status_code, 403)
+            response = self.post('/api/async/conversations/query_conversations/', {'query': 'q'})
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.model.calls, 0)
+        self.assertFalse(Message.objects.exists())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class StreamingTests(TestCase):
+
+    def setUp(self):
+        self.model = FakeGenerativeModel(
+            reply=lambda prompt: 'one two three four five six', words_per_chunk=2,
+            first_chunk_delay=0.05, chunk_delay=0.05
+        )
+        service = EnhancedAIService(model=self.model, embedder=FakeEmbedder())
+        service.cache = LLMCache()
+        patcher = mock.patch.object(ConversationViewSet, 'get_ai_service', lambda view: service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conversation = Conversation.objects.create(title='Streaming')
+        self.url = f'/api/conversations/{self.conversation.pk}/send_message_stream/'
+
+    def parse(self, frames):
+        events = []
+        for frame in b''.join(frames).decode('utf-8').split('\n\n')[:-1]:
+            event, data = frame.split('\n')
+            self.assertTrue(event.startswith('event: ') and data.startswith('data: '))
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_chunks_arrive_before_completion(self):
+        started = time.perf_counter()
+        response = self.client.post(self.url, {'content': 'Count to six'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        frames = iter(response.streaming_content)
+        first = [next(frames), next(frames)]  # user_message, then the first chunk
+        first_chunk = time.perf_counter() - started
+        rest = list(frames)
+        total = time.perf_counter() - started
+        # Three chunks at 50 ms each: the first is out after roughly a third of that
+        self.assertLess(first_chunk, total - 0.08)
+
+        events = self.parse(first + rest)
+        self.assertEqual([name for name, _ in events], ['user_message', 'chunk', 'chunk', 'chunk', 'ai_message'])
+        self.assertEqual(events[0][1]['content'], 'Count to six')
+        self.assertEqual([data['text'] for _, data in events[1:4]], ['one two ', 'three four ', 'five six'])
+
+        ai_message = Message.objects.get(sender='ai')
+        self.assertEqual(events[-1][1]['id'], ai_message.id)
+        self.assertEqual(ai_message.content, 'one two three four five six')
+        self.assertEqual(ai_message.tokens_used, 6)
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.message_count, self.conversation.total_tokens), (2, 6))
+
+    def test_asgi_stream_matches(self):
+        async def collect():
+            response = await self.async_client.post(self.url, {'content': 'Count'}, content_type='application/json')
+            return [frame async for frame in response.streaming_content]
+
+        events = self.parse(async_to_sync(collect)())
+        self.assertEqual([name for name, _ in events], ['user_message', 'chunk', 'chunk', 'chunk', 'ai_message'])
+        self.assertEqual(Message.objects.get(sender='ai').content, 'one two three four five six')
+
+    def test_model_failure_is_an_error_event(self):
+        self.model.reply = mock.Mock(side_effect=ValueError('quota exceeded'))
+        response = self.client.post(self.url, {'content': 'Hi'}, content_type='application/json')
+        events = self.parse(response.streaming_content)
+        self.assertEqual([name for name, _ in events], ['user_message', 'error'])
+        self.assertIn('quota exceeded', events[1][1]['error'])
+        self.assertFalse(Message.objects.filter(sender='ai').exists())
+
+
+ANALYSIS_REPLY = json.dumps({
+    'summary': 'Fixed the deploy.', 'key_topics': ['deploy'], 'action_items': [], 'sentiment': 'positive',
+})
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class AnalysisJobTests(TestCase):
+
+    def setUp(self):
+        model = FakeGenerativeModel(reply=lambda prompt: ANALYSIS_REPLY)
+        self.service = EnhancedAIService(model=model, embedder=FakeEmbedder())
+        self.service.cache = LLMCache()
+        self.queue = AnalysisJobQueue(max_attempts=2, backoff_base=10, service_factory=lambda: self.service)
+        self.conversation = Conversation.objects.create(title='Deploy', status='ended')
+        Message.objects.create(conversation=self.conversation, sender='user', content='The deploy failed')
+        Message.objects.create(conversation=self.conversation, sender='ai', content='Roll it back')
+
+    def job(self, **fields):
+        return AnalysisJob.objects.create(conversation=self.conversation, **fields)
+
+    def test_claim_order_and_lease_expiry(self):
+        now = timezone.now()
+        self.job(next_run_at=now + timedelta(minutes=1))
+        self.job(status='running', attempts=1, lease_expires_at=now + timedelta(minutes=1))
+        abandoned = self.job(status='running', attempts=1, lease_expires_at=now - timedelta(seconds=1))
+        due = self.job(next_run_at=now - timedelta(seconds=1))
+
+        self.assertEqual(self.queue.claim_next().pk, due.pk)
+        claimed = self.queue.claim_next()
+        self.assertEqual((claimed.pk, claimed.attempts), (abandoned.pk, 2))
+        self.assertGreater(claimed.lease_expires_at, timezone.now() + timedelta(seconds=590))
+        self.assertIsNone(self.queue.claim_next())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.analysis_status, 'running')
+
+    def test_success(self):
+        self.job()
+        self.queue.run_job(self.queue.claim_next())
+        job = AnalysisJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('succeeded', 1, ''))
+        self.assertEqual(set(job.stage_timings), {'summary', 'embedding', 'total'})
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, 'Fixed the deploy.')
+        self.assertEqual(self.conversation.analysis_status, 'completed')
+        self.assertIsNotNone(self.conversation.embedding_vector)
+
+    def test_retry_with_backoff_then_fail(self):
+        self.job()
+        with mock.patch.object(self.service, 'generate_conversation_summary', side_effect=ValueError('model down')):
+            before = timezone.now()
+            self.queue.run_job(self.queue.claim_next())
+            job = AnalysisJob.objects.get()
+            self.assertEqual((job.status, job.attempts, job.last_error), ('queued', 1, 'model down'))
+            # backoff_base * 2 ** (attempts - 1), plus up to 50% jitter
+            self.assertGreaterEqual(job.next_run_at, before + timedelta(seconds=10))
+            self.assertLessEqual(job.next_run_at, timezone.now() + timedelta(seconds=15))
+            self.assertIsNone(self.queue.claim_next())
+
+            AnalysisJob.objects.update(next_run_at=timezone.now())
+            self.queue.run_job(self.queue.claim_next())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNotNone(job.finished_at)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.analysis_status, 'failed')
+        self.assertEqual(self.queue.stats()['processed'], {'succeeded': 0, 'failed': 1, 'retried': 1})
+
+    def test_missing_embedding_keeps_analysis_and_retries(self):
+        self.job()
+        with mock.patch.object(self.service, 'generate_embedding', return_value=None):
+            self.queue.run_job(self.queue.claim_next())
+        self.assertEqual(AnalysisJob.objects.get().status, 'queued')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, 'Fixed the deploy.')
+        self.assertEqual(self.conversation.analysis_status, 'pending')
+
+    @override_settings(AI_CONFIG={**settings.AI_CONFIG, 'BACKGROUND_ANALYSIS': True})
+    def test_end_conversation_is_accepted(self):
+        Conversation.objects.filter(pk=self.conversation.pk).update(status='active')
+        url = f'/api/conversations/{self.conversation.pk}/end_conversation/'
+        with mock.patch('chat.views.get_job_queue', lambda: self.queue), mock.patch.object(self.queue, 'start') as start:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()['status'], response.json()['analysis_status']), ('ended', 'pending'))
+        start.assert_called_once()
+        self.assertEqual(AnalysisJob.objects.get().status, 'queued')
+
+        self.queue.run_job(self.queue.claim_next())
+        data = self.client.get(f'/api/conversations/{self.conversation.pk}/').json()
+        self.assertEqual((data['analysis_status'], data['summary']), ('completed', 'Fixed the deploy.'))
+
+    def test_end_needs_two_messages_from_the_counter(self):
+        short = Conversation.objects.create(title='Short')
+        Message.objects.create(conversation=short, sender='user', content='Hi')
+        for url in (f'/api/conversations/{short.pk}/end_conversation/',
+                    f'/api/async/conversations/{short.pk}/end_conversation/'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse([q for q in queries.captured_queries if '"chat_message"' in q['sql']])
+        short.refresh_from_db()
+        self.assertEqual(short.status, 'active')
+
+    def test_only_server_processes_start_workers(self):
+        self.assertTrue(is_server_process(['/venv/bin/gunicorn', 'config.wsgi']))
+        self.assertTrue(is_server_process(['/venv/lib/uvicorn/__main__.py', 'config.asgi:application']))
+        self.assertTrue(is_server_process(['manage.py', 'runserver', '--noreload']))
+        self.assertFalse(is_server_process(['manage.py', 'migrate']))
+        self.assertFalse(is_server_process(['manage.py', 'run_analysis_worker']))
+        with mock.patch.dict(os.environ, {'RUN_MAIN': 'true'}):
+            self.assertTrue(is_server_process(['manage.py', 'runserver']))
+        with mock.patch.dict(os.environ, {'RUN_MAIN': ''}):
+            self.assertFalse(is_server_process(['manage.py', 'runserver']))  # Autoreloader parent
+
+        server = ['/venv/bin/gunicorn', 'config.wsgi']
+        with mock.patch('chat.jobs.get_job_queue', lambda: self.queue), mock.patch.object(self.queue, 'start') as start:
+            with override_settings(AI_CONFIG={**settings.AI_CONFIG, 'BACKGROUND_ANALYSIS': True}):
+                self.assertFalse(start_server_workers(['manage.py', 'test']))
+                self.assertTrue(start_server_workers(server))
+                self.queue.autostart = False  # ANALYSIS_IN_PROCESS off: run_analysis_worker does the work
+                self.assertFalse(start_server_workers(server))
+            with override_settings(AI_CONFIG={**settings.AI_CONFIG, 'BACKGROUND_ANALYSIS': False}):
+                self.queue.autostart = True
+                self.assertFalse(start_server_workers(server))
+        start.assert_called_once()
+
+
+class AnalysisJobClaimTests(TransactionTestCase):
+
+    def test_claim_skips_locked_jobs(self):
+        conversation = Conversation.objects.create(title='Deploy', status='ended')
+        now = timezone.now()
+        first = AnalysisJob.objects.create(conversation=conversation, next_run_at=now - timedelta(seconds=2))
+        second = AnalysisJob.objects.create(conversation=conversation, next_run_at=now - timedelta(seconds=1))
+        queue = AnalysisJobQueue()
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_first():
+            # Another worker in the middle of claiming the oldest job
+            try:
+                with transaction.atomic():
+                    list(AnalysisJob.objects.select_for_update().filter(pk=first.pk))
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=hold_first)
+        worker.start()
+        try:
+            self.assertTrue(locked.wait(5))
+            self.assertEqual(queue.claim_next().pk, second.pk)
+            self.assertIsNone(queue.claim_next())
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(queue.claim_next().pk, first.pk)
+
+
+class HeldExecutor:
+    """Queues submitted calls until run() executes them"""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, func, *args):
+        future = Future()
+        self.queued.append((future, func, args))
+        return future
+
+    def run(self):
+        queued, self.queued = self.queued, []
+        for future, func, args in queued:
+            future.set_result(func(*args))
+
+
+@mock.patch('chat.ai_utils.close_old_connections', lambda: None)
+class DeferredTitleTests(TestCase):
+
+    def setUp(self):
+        self.model = FakeGenerativeModel(reply=lambda prompt: 'Rolling Back A Deploy')
+        self.conversation = Conversation.objects.create()
+        for i in range(4):
+            Message.objects.create(conversation=self.conversation, sender='user', content=f'Message {i}')
+        self.conversation.refresh_from_db()
+
+    @override_settings(AI_CONFIG={**settings.AI_CONFIG, 'DEFERRED_TITLE': True})
+    def test_one_title_call_per_conversation(self):
+        executor = HeldExecutor()
+        view = ConversationViewSet()
+        service = SimpleNamespace(model=self.model)
+        with mock.patch('chat.ai_utils._title_pool', executor):
+            with CaptureQueriesContext(connection) as queries:
+                view._maybe_generate_title(self.conversation, service)
+            self.assertEqual(len(queries), 0)  # Messages are read off the request path
+            Message.objects.create(conversation=self.conversation, sender='ai', content='Message 4')
+            view._maybe_generate_title(self.conversation, service)
+            self.assertEqual(len(executor.queued), 1)
+
+            executor.run()
+            self.assertEqual(self.model.calls, 1)
+            self.conversation.refresh_from_db()
+            self.assertEqual(self.conversation.title, 'Rolling Back A Deploy')
+
+            # Released once done: a failed title can be retried later
+            view._maybe_generate_title(SimpleNamespace(id=self.conversation.id, message_count=6, title=''), service)
+            self.assertEqual(len(executor.queued), 1)
+
+    def test_user_title_is_kept(self):
+        executor = HeldExecutor()
+        with mock.patch('chat.ai_utils._title_pool', executor):
+            future = schedule_title_generation(self.conversation.id, 'Message 0', model=self.model)
+            Conversation.objects.filter(pk=self.conversation.pk).update(title='Mine')
+            executor.run()
+        self.assertEqual(future.result(), 'Rolling Back A Deploy')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'Mine')
+
+
+class FanOutDeadlineTests(TestCase):
+
+    def setUp(self):
+        self.service = EnhancedAIService(model=FakeGenerativeModel(), embedder=FakeEmbedder())
+
+    def test_calls_missing_the_deadline_return_none(self):
+        release = threading.Event()
+        started = time.monotonic()
+        results = self.service.run_concurrently({
+            'fast': (lambda: 'done',),
+            'slow': (release.wait, 5),
+        }, timeout=0.1)
+        release.set()
+        self.assertEqual(results, {'fast': 'done', 'slow': None})
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_async_calls_missing_the_deadline_are_cancelled(self):
+        async def answer(value, delay):
+            await asyncio.sleep(delay)
+            return value
+
+        async def run():
+            return await self.service.arun_concurrently({
+                'fast': (answer, 'done', 0),
+                'slow': (answer, 'late', 5),
+            }, timeout=0.1)
+
+        started = time.monotonic()
+        self.assertEqual(async_to_sync(run)(), {'fast': 'done', 'slow': None})
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class LLMCacheTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('chat.llm_cache.time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_are_stable(self):
+        key = make_key('chat', 'gemini', {'temperature': 0.7, 'top_p': 0.9}, ['hello'])
+        material = '{"config":{"temperature":0.7,"top_p":0.9},"input":["hello"],"model":"gemini"}'
+        # The same digest in every process, whatever the dict order
+        self.assertEqual(key, 'llm:chat:' + hashlib.sha256(material.encode('utf-8')).hexdigest())
+        self.assertEqual(key, make_key('chat', 'gemini', {'top_p': 0.9, 'temperature': 0.7}, ['hello']))
+        self.assertEqual(normalize_text(' hello \n  world '), 'hello world')
+        self.assertEqual(len({
+            key,
+            make_key('summary', 'gemini', {'temperature': 0.7, 'top_p': 0.9}, ['hello']),
+            make_key('chat', 'gemini-pro', {'temperature': 0.7, 'top_p': 0.9}, ['hello']),
+            make_key('chat', 'gemini', {'temperature': 0.2, 'top_p': 0.9}, ['hello']),
+            make_key('chat', 'gemini', {'temperature': 0.7, 'top_p': 0.9}, ['hello!']),
+        }), 5)
+
+    def test_lru_eviction(self):
+        cache = LLMCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # b is now the least recently used
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+
+    def test_ttl_expiry(self):
+        cache = LLMCache(ttl=60)
+        cache.set('default', 'x')
+        cache.set('short', 'y', ttl=10)
+        self.now += 30
+        self.assertEqual((cache.get('default'), cache.get('short')), ('x', None))
+        self.now += 31
+        self.assertIsNone(cache.get('default'))
+        stats = cache.stats()
+        self.assertEqual((stats['expirations'], stats['size']), (2, 0))
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'llm': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'llm-tests'},
+    })
+    def test_shared_tier(self):
+        with mock.patch('chat.llm_cache._llm_cache', None):
+            writer = get_llm_cache()
+        self.assertTrue(writer.stats()['shared'])
+        # A second process: its own LRU, the same CACHES['llm']
+        reader = LLMCache(shared=writer.shared)
+
+        writer.set('key', {'response': 'cached'})
+        self.assertEqual(reader.get('key'), {'response': 'cached'})
+        self.assertEqual(reader.get('key'), {'response': 'cached'})
+        async_to_sync(writer.aset)('other', 'value')
+        self.assertEqual(async_to_sync(reader.aget)('other'), 'value')
+        self.assertIsNone(reader.get('missing'))
+
+        stats = reader.stats()
+        self.assertEqual((stats['hits'], stats['shared_hits'], stats['misses']), (1, 2, 1))
+        self.assertEqual(stats['hit_rate'], 0.75)
+        self.assertEqual(stats['sets'], 0)
+
+    def test_stats(self):
+        cache = LLMCache(max_entries=10)
+        self.assertEqual(cache.stats()['hit_rate'], 0.0)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.get('c')
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'shared_hits': 0, 'misses': 2, 'evictions': 0, 'expirations': 0, 'sets': 1,
+            'size': 1, 'max_entries': 10, 'shared': False, 'hit_rate': 0.3333,
+        })
+
+
+class BatchEmbeddingTests(TestCase):
+
+    def setUp(self):
+        self.embedder = FakeEmbedder(dimension=8)
+        self.service = EnhancedAIService(model=FakeGenerativeModel(), embedder=self.embedder)
+        self.service.cache = LLMCache()
+        self.service.config = {**self.service.config, 'EMBED_REQUESTS_PER_MINUTE': 0}
+        self.batches = []
+        embed = self.embedder.embed
+
+        def recording_embed(texts):
+            self.batches.append(list(texts))
+            if any('poison' in text for text in texts):
+                raise ValueError('batch rejected')
+            return embed(texts)
+
+        self.embedder.embed = recording_embed
+
+    def expected(self, text):
+        vector = np.array(self.embedder._vector(text))
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def test_batches_dedupe_and_cache(self):
+        texts = [f'text {i}' for i in range(25)] + ['text 3', 'text  3 ']
+        embeddings = self.service.generate_embeddings(texts, batch_size=10, concurrency=2)
+        self.assertEqual(sorted(len(batch) for batch in self.batches), [5, 10, 10])
+        self.assertEqual(embeddings[:25], [self.expected(text) for text in texts[:25]])
+        self.assertEqual(embeddings[25], embeddings[3])
+        self.assertEqual(embeddings[26], embeddings[3])  # Same text after whitespace normalization
+
+        again = self.service.generate_embeddings(texts[:5] + ['new'])
+        self.assertEqual(again, embeddings[:5] + [self.expected('new')])
+        self.assertEqual(self.batches[-1], ['new'])
+        self.assertEqual(self.service.generate_embedding('text 7'), embeddings[7])
+
+    def test_failed_batch_is_none_and_retried(self):
+        texts = ['a', 'b', 'poison', 'c']
+        embeddings = self.service.generate_embeddings(texts, batch_size=2)
+        self.assertEqual(embeddings[:2], [self.expected('a'), self.expected('b')])
+        self.assertEqual(embeddings[2:], [None, None])
+
+        self.embedder.embed = lambda batch: [self.embedder._vector(text) for text in batch]
+        self.assertEqual(self.service.generate_embeddings(texts, batch_size=2)[3], self.expected('c'))
+
+    def test_rate_limiter_spaces_requests(self):
+        limiter = RateLimiter(per_minute=1200)
+        started = time.perf_counter()
+        for _ in range(3):
+            limiter.wait()
+        self.assertGreaterEqual(time.perf_counter() - started, 0.1)
+
+    def test_backfill_command(self):
+        pending = Conversation.objects.create(title='Pending', status='ended')
+        Message.objects.create(conversation=pending, sender='user', content='first')
+        Message.objects.create(conversation=pending, sender='ai', content='second')
+        vector = unit(1, 0, 0, 0, 0, 0, 0, 0)
+        done = Conversation.objects.create(title='Done', status='ended', embedding_vector=vector)
+        Conversation.objects.create(title='Active')
+
+        with mock.patch('chat.management.commands.backfill_embeddings.EnhancedAIService', lambda: self.service):
+            call_command('backfill_embeddings', batch_size=1, stdout=StringIO())
+        pending.refresh_from_db()
+        np.testing.assert_allclose(pending.embedding_vector, self.expected('first\nsecond'), rtol=1e-6)
+        self.assertEqual(self.batches, [['first\nsecond']])
+        done.refresh_from_db()
+        np.testing.assert_array_equal(done.embedding_vector, vector)
+
+
+class HybridRankingTests(TestCase):
+
+    def setUp(self):
+        self.service = EnhancedAIService(model=FakeGenerativeModel(), embedder=FakeEmbedder(dimension=16))
+        self.service.cache = LLMCache()
+        query_vector = self.service.generate_embedding('JIRA-4821 status')
+        # Mentions the ticket but is semantically unrelated
+        self.ticket = self.ended('Deploy incident', 'Rollback for JIRA-4821', 'unrelated text')
+        # Semantically the query itself, no shared words
+        self.paraphrase = self.ended('Release problems', 'Production went down', query_vector)
+        self.other = self.ended('Billing', 'Refund for a duplicate invoice', 'billing text')
+        self.conversations = Conversation.objects.filter(status='ended')
+
+    def ended(self, title, summary, embedding):
+        if isinstance(embedding, str):
+            embedding = self.service.generate_embedding(embedding)
+        return Conversation.objects.create(title=title, summary=summary, status='ended', embedding_vector=embedding)
+
+    def ranked(self, query, conversations=None, **config):
+        self.service.config = {**settings.AI_CONFIG, **config}
+        with fresh_indexes():
+            return self.service.retrieve_conversations(query, conversations or self.conversations, top_k=2)
+
+    def test_reciprocal_rank_fusion(self):
+        self.assertEqual(reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60), [1, 3, 2])
+        self.assertEqual(reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60, weights=[1.0, 0.0]), [1, 2, 3])
+        self.assertEqual(reciprocal_rank_fusion([[1, 2], [2, 1]], k=60, weights=[1.0, 2.0]), [2, 1])
+
+    def test_identifier_and_paraphrase_both_rank(self):
+        self.assertEqual(self.ranked('JIRA-4821 status'), [self.ticket, self.paraphrase])
+        self.assertEqual(self.ranked('JIRA-4821 status', LEXICAL_BACKEND='fts'), [self.ticket, self.paraphrase])
+        self.assertEqual(self.ranked('JIRA-4821 status', HYBRID_LEXICAL_WEIGHT=0.0)[0], self.paraphrase)
+
+    def test_candidates_limit_ranking(self):
+        candidates = self.conversations.exclude(pk=self.ticket.pk)
+        self.assertEqual(self.ranked('JIRA-4821 status', candidates)[0], self.paraphrase)
+
+    def test_fallbacks_without_embedding(self):
+        with mock.patch.object(self.service, 'generate_embedding', return_value=None):
+            self.assertEqual(self.ranked('JIRA-4821'), [self.ticket])
+            # Neither ranker has anything: newest conversations first
+            self.assertEqual(self.ranked('nothing matches'), [self.other, self.paraphrase])
+
+
+class SemanticAnswerCacheTests(TestCase):
+
+    def setUp(self):
+        self.model = FakeGenerativeModel(reply=lambda prompt: 'We chose PostgreSQL.', first_chunk_delay=0.01)
+        self.service = EnhancedAIService(model=self.model, embedder=FakeEmbedder())
+        self.service.answer_cache = SemanticAnswerCache(LLMCache())
+        self.conversation = Conversation.objects.create(
+            title='Database choice', status='ended', summary='Compared databases', key_topics=['db']
+        )
+
+    def ask(self, query):
+        conversations = Conversation.objects.filter(status='ended')
+        with mock.patch.object(self.service, '_retrieve', lambda *args: list(conversations)):
+            answer, _ = self.service.query_past_conversations(query, conversations)
+        return answer
+
+    def test_repeated_question_skips_the_model(self):
+        self.assertEqual(self.ask('What did we decide about the database?'), 'We chose PostgreSQL.')
+        self.assertEqual(self.ask('What did we  decide about the database? '), 'We chose PostgreSQL.')
+        self.assertEqual(self.model.calls, 1)
+
+        stats = self.service.answer_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+        self.assertGreater(stats['saved_seconds'], 0)
+
+    def test_changed_conversation_invalidates(self):
+        self.ask('What did we decide about the database?')
+        self.conversation.summary = 'Chose PostgreSQL over MySQL'
+        self.conversation.save()
+        self.ask('What did we decide about the database?')
+        self.assertEqual(self.model.calls, 2)
+
+    def test_threshold(self):
+        cache = SemanticAnswerCache(LLMCache(), threshold=0.95)
+        question = np.array([1.0, 0.0, 0.0])
+        cache.store('key', question.tolist(), 'answer', 1.5)
+
+        paraphrase = question + [0.0, 0.2, 0.0]
+        self.assertEqual(cache.lookup('key', (paraphrase / np.linalg.norm(paraphrase)).tolist()), 'answer')
+        self.assertIsNone(cache.lookup('key', [0.6, 0.8, 0.0]))
+        self.assertIsNone(cache.lookup('other', question.tolist()))
+        self.assertEqual(cache.stats()['saved_seconds'], 1.5)
+
+
+class SummaryMapReduceTests(TestCase):
+
+    def setUp(self):
+        self.model = FakeGenerativeModel(reply=self.reply)
+        self.service = EnhancedAIService(model=self.model, embedder=FakeEmbedder())
+        self.service.cache = LLMCache()
+        self.service.config = {**self.service.config, 'CHUNK_SIZE': 60}
+
+    def reply(self, prompt):
+        if prompt.startswith('These are summaries'):
+            return json.dumps({'summary': 'Billing first, then the deploy.', 'main_intent': 'support'})
+        billing = 'invoice' in prompt
+        return json.dumps({
+            'summary': 'Billing.' if billing else 'Deploy.',
+            'key_topics': ['Billing', 'account'] if billing else ['deploy', 'Account'],
+            'action_items': ['Refund the invoice'] if billing else ['Roll back', 'refund the invoice'],
+            'sentiment': 'negative' if billing else 'positive',
+        })
+
+    def messages(self, count, text):
+        return [{'sender': 'user' if i % 2 == 0 else 'ai', 'content': f"{text} {i} " + 'x' * 100} for i in range(count)]
+
+    def test_long_transcript_is_chunked_and_merged(self):
+        messages = self.messages(6, 'Wrong invoice') + self.messages(6, 'Deploy failed')
+        chunks = self.service._chunk_transcript(messages)
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(estimate_tokens(chunk) <= 60 for chunk in chunks))
+
+        analysis = self.service.generate_conversation_summary(messages)
+        self.assertEqual(self.model.calls, len(chunks) + 1)
+        self.assertEqual(analysis['summary'], 'Billing first, then the deploy.')
+        self.assertEqual(analysis['key_topics'][0], 'account')
+        self.assertEqual(set(analysis['key_topics']), {'account', 'Billing', 'deploy'})
+        self.assertEqual(analysis['action_items'], ['Refund the invoice', 'Roll back'])
+        self.assertEqual(analysis['sentiment'], 'mixed')
+
+    def test_reanalysis_only_sends_changed_chunks(self):
+        messages = self.messages(12, 'Deploy failed')
+        self.service.generate_conversation_summary(messages)
+        calls = self.model.calls
+
+        self.service.generate_conversation_summary(messages + self.messages(1, 'Deploy fixed'))
+        self.assertEqual(self.model.calls, calls + 2)  # The last chunk and the reduce step
+
+    def test_short_transcript_single_call(self):
+        analysis = async_to_sync(self.service.agenerate_conversation_summary)(self.messages(1, 'Wrong invoice'))
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual(analysis['sentiment'], 'negative')
+
+    def test_fallback_when_every_chunk_fails(self):
+        self.model.reply = lambda prompt: 'not json'
+        analysis = self.service.generate_conversation_summary(self.messages(12, 'Deploy failed'))
+        self.assertEqual(analysis['summary'], 'Conversation with 12 messages')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title='Cached')
+        Message.objects.create(conversation=self.conversation, sender='user', content='Hello')
+
+    def revalidate(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        return response, len(queries)
+
+    def test_detail(self):
+        url = f'/api/conversations/{self.conversation.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response, queries = self.revalidate(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, queries), (304, 1))
+        response, _ = self.revalidate(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        Message.objects.create(conversation=self.conversation, sender='ai', content='Hi')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 2)
+
+        etag = response['ETag']
+        self.client.patch(url, {'title': 'Renamed'}, content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(url + '0/', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_list(self):
+        url = '/api/conversations/'
+        etag = self.client.get(url)['ETag']
+        response, queries = self.revalidate(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, queries), (304, 1))
+
+        Conversation.objects.create(title='New')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+        etag = response['ETag']
+        Conversation.objects.filter(title='New').delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class GeminiClientTests(TestCase):
+
+    def tearDown(self):
+        gemini_client.reset()
+
+    @mock.patch('chat.gemini_client.genai_client.get_default_generative_client')
+    @mock.patch('chat.gemini_client.genai.configure')
+    def test_model_is_shared(self, configure, get_client):
+        gemini_client.reset()
+        model = gemini_client.get_model()
+        self.assertIs(EnhancedAIService().model, model)
+        self.assertIs(gemini_client.get_model(), model)
+        configure.assert_called_once()
+        get_client.assert_called_once()
+
+    @mock.patch('chat.gemini_client.genai_client.get_default_generative_client')
+    @mock.patch('chat.gemini_client.genai.configure')
+    def test_concurrent_first_calls_configure_once(self, configure, get_client):
+        gemini_client.reset()
+        configure.side_effect = lambda **kwargs: time.sleep(0.05)
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(gemini_client.get_model())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        configure.assert_called_once()
+        self.assertEqual(len({id(model) for model in models}), 1)
+
+    @mock.patch('chat.gemini_client.genai.configure')
+    def test_pool_sizing_failure_is_not_fatal(self, configure):
+        session = mock.Mock()
+        session.mount.side_effect = TypeError('unexpected adapter')
+        client = SimpleNamespace(_transport=SimpleNamespace(_session=session))
+        with mock.patch('chat.gemini_client.genai_client.get_default_generative_client', return_value=client):
+            gemini_client.configure(transport='rest')
+        self.assertIsNotNone(gemini_client.get_model())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@mock.patch.object(ConversationViewSet, 'throttle_classes', [])
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        get_metrics().clear()
+
+    def test_server_timing_and_scrape(self):
+        conversation = Conversation.objects.create(title='Metrics')
+        service = EnhancedAIService(model=FakeGenerativeModel(reply=lambda prompt: 'four token reply here'))
+        with mock.patch.object(ConversationViewSet, 'get_ai_service', lambda view: service):
+            response = self.client.post(
+                f'/api/conversations/{conversation.id}/send_message/',
+                {'content': 'Hello'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('generate_chat_response;dur=', timing)
+        self.assertIn('tokens;desc="4"', timing)
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="conversation-send-message",method="POST",status="201"} 1',
+            text
+        )
+        self.assertIn('ai_service_call_seconds_count{method="generate_chat_response"} 1', text)
+        self.assertIn('# TYPE llm_cache_hit_ratio gauge', text)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_scrape_is_local(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AdminQueryCountTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def add_rows(self, count):
+        conversations = Conversation.objects.bulk_create(
+            Conversation(title=f"Conversation {i}") for i in range(count)
+        )
+        update_conversation_vectors([conversation.id for conversation in conversations])
+        Message.objects.bulk_create(
+            Message(conversation=conversation, sender='user', content='Hello there')
+            for conversation in conversations
+        )
+        query = ConversationQuery.objects.create(query_text='q', response='r')
+        query.add_relevant_conversations(conversations)
+        ConversationQuery.objects.create(query_text='q2', response='r2')
+
+    def test_changelists(self):
+        for url in (
+            '/admin/chat/conversation/',
+            '/admin/chat/conversation/?q=conversation',
+            '/admin/chat/message/',
+            '/admin/chat/conversationquery/',
+            '/admin/chat/dailystats/',
+        ):
+            with self.subTest(url=url):
+                self.add_rows(2)
+                before = self.count_queries(url)
+                self.add_rows(15)
+                after = self.count_queries(url)
+                self.assertEqual(before, after, f"{url} went from {before} to {after} queries")
@@ -0,0 +1,48 @@
+"""
+Topic filters and rankings over the normalized topic index.
+
+Conversation.topic_index holds the lowercased, deduplicated key_topics under
+a GIN index, so any combination of topics is a single indexed containment
+(AND) or overlap (OR) test. Topic keeps per-topic conversation counts, so
+the most common topics are read without touching conversations.
+"""
+from django.db.models import Sum
+
+from .models import DailyTopicCount, Topic, normalize_topics
+
+
+def filter_by_topics(queryset, topics, match='all'):
+    """
+    Conversations tagged with all (or, with match='any', any) of the topics.
+    Topics are compared case-insensitively.
+    """
+    topics = normalize_topics(topics)
+    if not topics:
+        return queryset
+    if match == 'any':
+        return queryset.filter(topic_index__overlap=topics)
+    return queryset.filter(topic_index__contains=topics)
+
+
+def top_topics(limit=10, date_from=None, date_to=None):
+    """
+    Most common topics with their conversation counts. Without a date range
+    they come from the Topic counters; with one, from the daily rollups of
+    the conversations that ended in the range.
+    """
+    if date_from is None and date_to is None:
+        return list(
+            Topic.objects
+            .filter(conversation_count__gt=0)
+            .values('name', 'conversation_count')[:limit]
+        )
+
+    counts = DailyTopicCount.objects.all()
+    if date_from:
+        counts = counts.filter(date__gte=date_from)
+    if date_to:
+        counts = counts.filter(date__lte=date_to)
+    return [
+        {'name': row['topic'], 'conversation_count': row['total']}
+        for row in counts.values('topic').annotate(total=Sum('count')).order_by('-total', 'topic')[:limit]
+    ]
@@ -1,11 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import ConversationViewSet
+from . import async_views
 
 # Create router and register viewsets
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
 
+# Async LLM-bound actions, for deployments served through config.asgi
+async_urlpatterns = [
+    path('conversations/<int:pk>/send_message/', async_views.send_message, name='async-send-message'),
+    path('conversations/<int:pk>/end_conversation/', async_views.end_conversation, name='async-end-conversation'),
+    path('conversations/query_conversations/', async_views.query_conversations, name='async-query-conversations'),
+]
+
 urlpatterns = [
+    path('async/', include(async_urlpatterns)),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
@@ -1,8 +1,15 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from django.conf import settings
+from django.db.models import F, Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+import hashlib
 import logging
 import time
 
@@ -18,7 +25,17 @@ from .serializers import (
     ConversationQueryResponseSerializer
 )
 from .enhanced_ai_service import EnhancedAIService as GeminiService
-from .ai_utils import generate_title_from_text
+from .ai_utils import generate_title_from_text, schedule_title_generation
+from .streaming import sse_event, streaming_body
+from .context import ConversationContext
+from .jobs import get_job_queue
+from .answer_cache import get_answer_cache
+from .llm_cache import get_llm_cache
+from .metrics import get_metrics
+from .search import search_conversations
+from .pagination import ConversationCursorPagination, MessageCursorPagination
+from .topics import filter_by_topics, top_topics as most_common_topics
+from . import analytics
 
 logger = logging.getLogger(__name__)
 
@@ -29,7 +46,37 @@ class ConversationViewSet(viewsets.ModelViewSet):
     Provides CRUD operations and custom actions.
     """
     
-    queryset = Conversation.objects.all()
+    # Embeddings are only read by the search index, never serialized
+    queryset = Conversation.objects.defer('embedding', 'embedding_vector', 'search_vector')
+    
+    pagination_class = ConversationCursorPagination
+    
+    @property
+    def paginator(self):
+        """
+        Cursor pagination for the default newest-first list. Search results
+        (ordered by rank), ?ordering= and explicit ?page= requests keep page
+        numbers.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if self.action == 'list' and any(params.get(name) for name in ('search', 'ordering', 'page')):
+                self._paginator = PageNumberPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            return queryset.prefetch_related(
+                Prefetch('messages', queryset=Message.objects.defer('search_vector'))
+            )
+        return queryset
+    
+    def get_ai_service(self):
+        """AI service used by the LLM-backed actions; override to inject a fake model"""
+        return GeminiService()
     
     def get_serializer_class(self):
         """Use different serializers for list vs detail views"""
@@ -39,10 +86,40 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return ConversationCreateSerializer
         return ConversationDetailSerializer
     
+    LIST_ORDERINGS = ('created_at', 'last_message_at', 'message_count', 'total_tokens')
+    
+    # Enough to paginate (the cursor reads created_at) and to build validators
+    VALIDATOR_FIELDS = ('id', 'version', 'updated_at', 'created_at')
+    
+    def _validators(self, rows, *extra):
+        """
+        Weak ETag and Last-Modified (a timestamp) for (id, version, updated_at)
+        rows. `extra` holds anything else the response depends on, e.g. the
+        pagination links.
+        """
+        material = repr([(pk, version, updated_at.isoformat()) for pk, version, updated_at in rows] + list(extra))
+        etag = f'W/"{hashlib.md5(material.encode()).hexdigest()}"'
+        last_modified = int(max(updated_at for _, _, updated_at in rows).timestamp()) if rows else None
+        return etag, last_modified
+    
+    def _with_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Cache, but revalidate on every use: no heuristic freshness
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
     def list(self, request):
         """
         GET /api/conversations/
         Retrieve all conversations with pagination and filtering.
+        
+        The page is first read with only the validator columns; when the
+        client's If-None-Match / If-Modified-Since still match, the answer is
+        a 304 without loading or serializing the conversations. If-None-Match
+        is authoritative: Last-Modified has second precision and does not
+        move when a conversation leaves the page.
         """
         try:
             queryset = self.get_queryset()
@@ -52,13 +129,16 @@ class ConversationViewSet(viewsets.ModelViewSet):
             if status_filter:
                 queryset = queryset.filter(status=status_filter)
             
-            # Search by title or topics
+            # Full-text search over title, topics, summary and messages, best match first
             search = request.query_params.get('search', None)
             if search:
-                queryset = queryset.filter(
-                    Q(title__icontains=search) |
-                    Q(key_topics__contains=[search])
-                )
+                queryset = search_conversations(queryset, search)
+            
+            # Comma-separated topics, all required unless topics_match=any
+            topics = request.query_params.get('topics', None)
+            if topics:
+                match = request.query_params.get('topics_match', 'all')
+                queryset = filter_by_topics(queryset, topics.split(','), match=match)
             
             # Date range filtering
             date_from = request.query_params.get('date_from', None)
@@ -68,11 +148,36 @@ class ConversationViewSet(viewsets.ModelViewSet):
             if date_to:
                 queryset = queryset.filter(created_at__lte=date_to)
             
+            # Sort by activity or size using the denormalized counters
+            ordering = request.query_params.get('ordering', None)
+            if ordering:
+                if ordering.lstrip('-') not in self.LIST_ORDERINGS:
+                    return Response(
+                        {'error': f"ordering must be one of: {', '.join(self.LIST_ORDERINGS)}"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                field = F(ordering.lstrip('-'))
+                field = field.desc(nulls_last=True) if ordering.startswith('-') else field.asc(nulls_last=True)
+                queryset = queryset.order_by(field, '-created_at')
+            
             # Paginate results
-            page = self.paginate_queryset(queryset)
+            page = self.paginate_queryset(queryset.only(*self.VALIDATOR_FIELDS))
             if page is not None:
+                django_page = getattr(self.paginator, 'page', None)
+                etag, last_modified = self._validators(
+                    [(row.id, row.version, row.updated_at) for row in page],
+                    getattr(getattr(django_page, 'paginator', None), 'count', None),
+                    self.paginator.get_next_link(),
+                    self.paginator.get_previous_link(),
+                )
+                not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if not_modified is not None:
+                    return self._with_validators(not_modified, etag, last_modified)
+                
+                rows = self.get_queryset().in_bulk([row.id for row in page])
+                page = [rows[row.id] for row in page if row.id in rows]
                 serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
+                return self._with_validators(self.get_paginated_response(serializer.data), etag, last_modified)
             
             serializer = self.get_serializer(queryset, many=True)
             return Response(serializer.data)
@@ -88,11 +193,23 @@ class ConversationViewSet(viewsets.ModelViewSet):
         """
         GET /api/conversations/{id}/
         Get specific conversation with full message history.
+        
+        Answers If-None-Match / If-Modified-Since with a 304 after one
+        primary key lookup, before the messages are loaded.
         """
         try:
+            row = Conversation.objects.filter(pk=pk).values_list('id', 'version', 'updated_at').first()
+            if row is None:
+                raise Conversation.DoesNotExist
+            # Read before the data: a concurrent write can only make the ETag stale, never ahead
+            etag, last_modified = self._validators([row])
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return self._with_validators(not_modified, etag, last_modified)
+            
             conversation = self.get_object()
             serializer = self.get_serializer(conversation)
-            return Response(serializer.data)
+            return self._with_validators(Response(serializer.data), etag, last_modified)
             
         except Conversation.DoesNotExist:
             return Response(
@@ -106,6 +223,27 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        """
+        GET /api/conversations/{id}/messages/
+        Page through a conversation's messages, oldest first.
+        
+        Follow the `next` link (?cursor=...) for the following page;
+        ?page_size= sets the page length. Every page is one index range scan,
+        so long transcripts load incrementally at a flat cost per page.
+        """
+        if not Conversation.objects.filter(pk=pk).exists():
+            return Response(
+                {'error': 'Conversation not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        messages = Message.objects.filter(conversation_id=pk).defer('search_vector')
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+    
     def create(self, request):
         """
         POST /api/conversations/
@@ -158,12 +296,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 content=user_content
             )
             
-            # Get conversation history for context
-            previous_messages = list(conversation.messages.order_by('timestamp'))
-            history = self._build_gemini_history(previous_messages[:-1])
+            # Recent turns plus the rolling summary of older ones
+            context = ConversationContext(conversation).load(exclude=user_message)
+            history = context.history()
             
             # Generate AI response using Gemini
-            gemini_service = GeminiService()
+            gemini_service = self.get_ai_service()
             ai_response_data = gemini_service.generate_chat_response(
                 user_content,
                 conversation_history=history
@@ -177,21 +315,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 tokens_used=ai_response_data['tokens_used']
             )
             
-            # AUTO-GENERATE TITLE AFTER 4 MESSAGES
-            total_messages = conversation.messages.count()
-            if total_messages >= 4 and (conversation.title == "New Conversation" or not conversation.title):
-                try:
-                    # Get first 4 messages for context
-                    first_messages = conversation.messages.order_by('timestamp')[:4]
-                    text_for_title = " ".join([msg.content for msg in first_messages])
-                    
-                    # Generate title
-                    new_title = generate_title_from_text(text_for_title)
-                    conversation.title = new_title
-                    conversation.save()
-                    logger.info(f"Auto-generated title: {new_title}")
-                except Exception as title_error:
-                    logger.error(f"Failed to generate title: {str(title_error)}")
+            self._maybe_generate_title(conversation, gemini_service)
+            context.fold_in_background(gemini_service)
             
             # Return both messages
             return Response({
@@ -211,6 +336,106 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['post'])
+    def send_message_stream(self, request, pk=None):
+        """
+        POST /api/conversations/{id}/send_message_stream/
+        Send a message and stream the AI response as Server-Sent Events.
+        
+        Events: 'user_message' (saved user message), 'chunk' ({"text": ...})
+        for each model chunk, then 'ai_message' with the saved AI message,
+        or 'error'. Chunks are only flushed incrementally when served through
+        config.asgi (or a streaming WSGI server).
+        """
+        try:
+            conversation = self.get_object()
+            
+            if conversation.status != 'active':
+                return Response(
+                    {'error': 'Cannot send message to ended conversation'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            message_serializer = MessageCreateSerializer(data=request.data)
+            message_serializer.is_valid(raise_exception=True)
+            user_content = message_serializer.validated_data['content']
+            
+            user_message = Message.objects.create(
+                conversation=conversation,
+                sender='user',
+                content=user_content
+            )
+            
+            context = ConversationContext(conversation).load(exclude=user_message)
+            
+            events = self._stream_ai_reply(conversation, user_message, context)
+            response = StreamingHttpResponse(
+                streaming_body(request, events),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+            
+        except Conversation.DoesNotExist:
+            return Response(
+                {'error': 'Conversation not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Exception as e:
+            logger.error(f"Error sending message: {str(e)}")
+            return Response(
+                {'error': f'Failed to send message: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    def _stream_ai_reply(self, conversation, user_message, context):
+        """Yield SSE frames for one AI reply; the AI message is saved at the end"""
+        yield sse_event('user_message', MessageSerializer(user_message).data)
+        
+        try:
+            gemini_service = self.get_ai_service()
+            history = context.history()
+            for event in gemini_service.stream_chat_response(user_message.content, conversation_history=history):
+                if event['type'] == 'chunk':
+                    yield sse_event('chunk', {'text': event['text']})
+                    continue
+                
+                ai_message = Message.objects.create(
+                    conversation=conversation,
+                    sender='ai',
+                    content=event['response'],
+                    tokens_used=event['tokens_used']
+                )
+                self._maybe_generate_title(conversation, gemini_service)
+                context.fold_in_background(gemini_service)
+                yield sse_event('ai_message', MessageSerializer(ai_message).data)
+        
+        except Exception as e:
+            logger.error(f"Error streaming message: {str(e)}")
+            yield sse_event('error', {'error': f'Failed to send message: {str(e)}'})
+    
+    def _maybe_generate_title(self, conversation, gemini_service):
+        """AUTO-GENERATE TITLE AFTER 4 MESSAGES"""
+        if conversation.message_count >= 4 and (conversation.title == "New Conversation" or not conversation.title):
+            try:
+                if settings.AI_CONFIG.get('DEFERRED_TITLE'):
+                    # Keep the title call off the request path, one at a time per conversation
+                    schedule_title_generation(conversation.id, model=gemini_service.model)
+                    return
+                
+                # Get first 4 messages for context
+                first_messages = conversation.messages.order_by('timestamp')[:4]
+                text_for_title = " ".join([msg.content for msg in first_messages])
+                
+                # Generate title
+                new_title = generate_title_from_text(text_for_title, model=gemini_service.model)
+                conversation.title = new_title
+                conversation.save()
+                logger.info(f"Auto-generated title: {new_title}")
+            except Exception as title_error:
+                logger.error(f"Failed to generate title: {str(title_error)}")
+    
     @action(detail=True, methods=['post'])
     def end_conversation(self, request, pk=None):
         """
@@ -226,24 +451,28 @@ class ConversationViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            messages = conversation.messages.all()
-            
-            if messages.count() < 2:
+            # Denormalized counter: no COUNT over the messages
+            if conversation.message_count < 2:
                 return Response(
                     {'error': 'Cannot end conversation with less than 2 messages'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            if settings.AI_CONFIG.get('BACKGROUND_ANALYSIS'):
+                # Summary and embedding are produced by the analysis workers;
+                # clients poll analysis_status on the conversation
+                get_job_queue().enqueue(conversation)
+                serializer = ConversationDetailSerializer(conversation)
+                return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+            
             message_data = [
                 {'sender': msg.sender, 'content': msg.content}
-                for msg in messages
+                for msg in conversation.messages.all()
             ]
             
-            gemini_service = GeminiService()
-            analysis = gemini_service.generate_conversation_summary(message_data)
-            
-            full_conversation_text = "\n".join([msg['content'] for msg in message_data])
-            embedding = gemini_service.generate_embedding(full_conversation_text)
+            # Summary and embedding are independent, so they run in parallel
+            gemini_service = self.get_ai_service()
+            analysis, embedding = gemini_service.analyze_conversation(message_data)
             
             conversation.status = 'ended'
             conversation.ended_at = timezone.now()
@@ -251,7 +480,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
             conversation.key_topics = analysis['key_topics']
             conversation.action_items = analysis['action_items']
             conversation.sentiment = analysis['sentiment']
-            conversation.embedding = embedding
+            conversation.embedding_vector = embedding
+            conversation.analysis_status = 'completed'
             conversation.save()
             
             serializer = ConversationDetailSerializer(conversation)
@@ -269,6 +499,75 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['get'])
+    def analysis_stats(self, request):
+        """
+        GET /api/conversations/analysis_stats/
+        Queue depth, throughput and per-stage latency of the analysis workers.
+        """
+        return Response(get_job_queue().stats())
+    
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        GET /api/conversations/analytics/
+        Conversation, message, token, sentiment, topic and query-latency
+        statistics for an optional date range (date_from / date_to,
+        inclusive), read from the daily rollups.
+        """
+        bounds, error = self._date_bounds(request)
+        if error:
+            return error
+        return Response(analytics.summarize(**bounds))
+    
+    @action(detail=False, methods=['get'])
+    def top_topics(self, request):
+        """
+        GET /api/conversations/top_topics/
+        Most common topics with their conversation counts. ?limit= (default
+        10, max 100); an optional date_from / date_to range counts the
+        conversations that ended in it.
+        """
+        bounds, error = self._date_bounds(request)
+        if error:
+            return error
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(most_common_topics(limit=limit, **bounds))
+    
+    def _date_bounds(self, request):
+        """Parse date_from / date_to query params; returns (bounds, error response)"""
+        bounds = {}
+        for param in ('date_from', 'date_to'):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    bounds[param] = parse_date(value[:10])
+                except ValueError:
+                    bounds[param] = None
+                if bounds[param] is None:
+                    return None, Response(
+                        {'error': f'{param} must be a date (YYYY-MM-DD)'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+        return bounds, None
+    
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """
+        GET /api/conversations/cache_stats/
+        Hit/miss/eviction counters of this process's model response cache,
+        with the hit rate and model time saved by the semantic answer cache.
+        """
+        stats = get_llm_cache().stats()
+        stats['answers'] = get_answer_cache().stats()
+        return Response(stats)
+    
     @action(detail=False, methods=['post'])
     def query_conversations(self, request):
         """
@@ -294,25 +593,17 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 )
             
             if 'topics' in query_serializer.validated_data:
-                topics = query_serializer.validated_data['topics']
-                for topic in topics:
-                    conversations = conversations.filter(key_topics__contains=[topic])
-            
-            conversation_data = []
-            for conv in conversations[:20]:
-                conversation_data.append({
-                    'id': conv.id,
-                    'title': conv.title,
-                    'created_at': conv.created_at.isoformat(),
-                    'summary': conv.summary,
-                    'key_topics': conv.key_topics,
-                    'sentiment': conv.sentiment
-                })
-            
-            gemini_service = GeminiService()
-            ai_response = gemini_service.query_past_conversations(
+                conversations = filter_by_topics(
+                    conversations,
+                    query_serializer.validated_data['topics'],
+                    match=query_serializer.validated_data['topics_match']
+                )
+            
+            # Ranks every matching conversation, not just the newest ones
+            gemini_service = self.get_ai_service()
+            ai_response, relevant_conversations = gemini_service.query_past_conversations(
                 query_text,
-                conversation_data
+                conversations
             )
             
             execution_time = time.time() - start_time
@@ -321,9 +612,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 response=ai_response,
                 execution_time=execution_time
             )
-            query_obj.relevant_conversations.set(conversations[:10])
+            query_obj.add_relevant_conversations(relevant_conversations)
             
-            response_serializer = ConversationQueryResponseSerializer(query_obj)
+            response_serializer = ConversationQueryResponseSerializer(
+                query_obj,
+                context={'relevant_conversations': relevant_conversations}
+            )
             return Response(response_serializer.data)
             
         except Exception as e:
@@ -333,17 +627,6 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
-    def _build_gemini_history(self, messages):
-        """Build conversation history in Gemini format"""
-        history = []
-        for msg in messages:
-            role = 'user' if msg.sender == 'user' else 'model'
-            history.append({
-                'role': role,
-                'parts': [msg.content]
-            })
-        return history
-    
     def partial_update(self, request, *args, **kwargs):
         try:
             conversation = self.get_object()
@@ -354,3 +637,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
         except Exception as e:
             logger.error(f"Error updating conversation: {str(e)}")
             return Response({'error': str(e)}, status=400)
+
+
+def metrics(request):
+    """
+    GET /metrics
+    Prometheus scrape endpoint for this process, limited to METRICS_ALLOWED_IPS.
+    """
+    allowed = settings.METRICS_ALLOWED_IPS
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        raise Http404
+    return HttpResponse(get_metrics().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
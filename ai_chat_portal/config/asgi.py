@@ -3,6 +3,9 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serving through this entry point (e.g. ``uvicorn config.asgi:application``)
+lets ``send_message_stream`` flush Server-Sent Events as model chunks arrive.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.metrics.MetricsMiddleware',  # First, so it times the whole request
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -131,6 +132,32 @@ CORS_ALLOWED_ORIGINS = os.getenv(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Caches. Set LLM_SHARED_CACHE to 'file' or 'db' to share model responses
+# between worker processes ('db' needs `manage.py createcachetable`).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+LLM_SHARED_CACHE = os.getenv('LLM_SHARED_CACHE', '')
+if LLM_SHARED_CACHE == 'file':
+    CACHES['llm'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('LLM_CACHE_DIR', str(BASE_DIR / 'data' / 'llm_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+elif LLM_SHARED_CACHE == 'db':
+    CACHES['llm'] = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'llm_cache',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+
+# Metrics: Prometheus text at /metrics, per-request Server-Timing headers
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]  # Empty = any
+
 # Gemini API Configuration
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
@@ -141,7 +168,66 @@ AI_CONFIG = {
     'TEMPERATURE': 0.7,
     'TOP_P': 0.9,
     'EMBEDDING_MODEL': 'models/embedding-004',  # Gemini embedding model
-    'CHUNK_SIZE': 1000,  # For processing long conversations
+    'CHUNK_SIZE': 1000,  # Tokens per chunk when summarizing long conversations (map-reduce)
+
+    # Shared Gemini client (chat.gemini_client), configured once per process
+    'GEMINI_TRANSPORT': os.getenv('GEMINI_TRANSPORT', ''),  # 'grpc' (SDK default) or 'rest'
+    'GEMINI_API_ENDPOINT': os.getenv('GEMINI_API_ENDPOINT', ''),  # e.g. a proxy; empty = Google's
+    'GEMINI_POOL_SIZE': 32,  # Keep-alive connections kept by the REST transport
+
+    # Semantic search backend: 'exact' (brute-force scan) or 'ivfpq' (approximate)
+    'SEARCH_BACKEND': os.getenv('SEARCH_BACKEND', 'exact'),
+    'ANN_NLIST': int(os.getenv('ANN_NLIST', '256')),  # Coarse k-means centroids
+    'ANN_M': int(os.getenv('ANN_M', '16')),  # PQ sub-quantizers, must divide 768
+    'ANN_NPROBE': int(os.getenv('ANN_NPROBE', '8')),  # Inverted lists scanned per query
+    'ANN_RERANK': int(os.getenv('ANN_RERANK', '10')),  # Exact rescoring of k * RERANK candidates, 0 = off
+    'ANN_INDEX_PATH': os.getenv('ANN_INDEX_PATH', str(BASE_DIR / 'data' / 'ann_index.npz')),
+    'ANN_RETRAIN_GROWTH': int(os.getenv('ANN_RETRAIN_GROWTH', '4')),  # Retrain at N x the training size, 0 = never
+    'FTS_CONFIG': os.getenv('FTS_CONFIG', 'english'),  # PostgreSQL text search configuration
+    # Seconds between catch-ups of the in-process search indexes with other processes' writes, 0 = never
+    'INDEX_SYNC_INTERVAL': float(os.getenv('INDEX_SYNC_INTERVAL', '5')),
+
+    # Hybrid retrieval: lexical and semantic rankings merged by reciprocal rank fusion
+    'LEXICAL_BACKEND': os.getenv('LEXICAL_BACKEND', 'bm25'),  # 'bm25' (in-process) or 'fts' (PostgreSQL)
+    'HYBRID_SEMANTIC_WEIGHT': float(os.getenv('HYBRID_SEMANTIC_WEIGHT', '1.0')),
+    'HYBRID_LEXICAL_WEIGHT': float(os.getenv('HYBRID_LEXICAL_WEIGHT', '1.2')),
+    'RRF_K': 60,
+    'BM25_K1': 1.2,
+    'BM25_B': 0.75,
+
+    # Background analysis of ended conversations (summary + embedding)
+    'BACKGROUND_ANALYSIS': os.getenv('BACKGROUND_ANALYSIS', 'True') == 'True',
+    'ANALYSIS_WORKERS': int(os.getenv('ANALYSIS_WORKERS', '2')),
+    # Run workers inside web server processes; False when run_analysis_worker is deployed instead
+    'ANALYSIS_IN_PROCESS': os.getenv('ANALYSIS_IN_PROCESS', 'True') == 'True',
+    'ANALYSIS_MAX_ATTEMPTS': 3,
+    'ANALYSIS_RETRY_BACKOFF': 2.0,  # Seconds, doubled on every retry
+
+    # Concurrent model calls within one request
+    'FANOUT_WORKERS': int(os.getenv('FANOUT_WORKERS', '16')),
+    'SUMMARY_WORKERS': int(os.getenv('SUMMARY_WORKERS', '8')),  # Chunks of a long conversation summarized at once
+    'LLM_DEADLINE': float(os.getenv('LLM_DEADLINE', '30')),  # Seconds shared by a fan-out, 0 = none
+    'DEFERRED_TITLE': os.getenv('DEFERRED_TITLE', 'True') == 'True',  # Generate titles off the request path
+
+    # Chat context: recent messages verbatim, older turns as a rolling summary
+    'CONTEXT_WINDOW_MESSAGES': int(os.getenv('CONTEXT_WINDOW_MESSAGES', '12')),  # 0 = send the full transcript
+    'CONTEXT_TOKEN_BUDGET': 6000,  # Estimated tokens for summary + window
+    'CONTEXT_SUMMARY_EVERY': 8,  # Messages folded into the summary per update
+
+    # Model response cache (chat replies and embeddings)
+    'LLM_CACHE_SIZE': int(os.getenv('LLM_CACHE_SIZE', '2048')),  # Entries in the per-process LRU
+    'LLM_CACHE_TTL': 3600,  # Seconds for chat replies; embeddings are kept 24x longer
+
+    # Semantic cache of query_conversations answers (stored in the model response cache)
+    'ANSWER_CACHE': os.getenv('ANSWER_CACHE', 'True') == 'True',
+    'ANSWER_CACHE_THRESHOLD': float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95')),  # Cosine between questions
+    'ANSWER_CACHE_VARIANTS': 16,  # Questions remembered per retrieved context
+    'ANSWER_CACHE_TTL': 6 * 3600,
+
+    # Batched embedding requests (generate_embeddings / backfill_embeddings)
+    'EMBED_BATCH_SIZE': 100,  # Texts per embed_content call
+    'EMBED_CONCURRENCY': int(os.getenv('EMBED_CONCURRENCY', '4')),
+    'EMBED_REQUESTS_PER_MINUTE': int(os.getenv('EMBED_REQUESTS_PER_MINUTE', '150')),  # 0 = unlimited
 }
 
 # Logging Configuration
@@ -4,6 +4,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from chat.views import metrics
+
 # Swagger/OpenAPI documentation setup
 schema_view = get_schema_view(
     openapi.Info(
@@ -36,6 +38,9 @@ urlpatterns = [
     # API endpoints
     path('api/', include('chat.urls')),
     
+    # Prometheus scrape endpoint
+    path('metrics', metrics, name='metrics'),
+    
     # API Documentation
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),